@@ -13,6 +13,7 @@ from __future__ import absolute_import, division, print_function, \
 import sys
 import os
 import shutil
+import glob
 import fnmatch
 import re
 import argparse
@@ -171,6 +172,11 @@ if __name__ == "__main__":
                         print(' -- Removed driver script '
                               '{}/{}'.format(work_dir, script_name))
 
+                    # Delete the lists of fields the script compares
+                    for field_list in glob.glob('{}/{}_fields*.txt'.format(
+                            work_dir, os.path.splitext(script_name)[0])):
+                        os.remove(field_list)
+
                 del config_tree
                 del config_root
 
@@ -10,6 +10,10 @@ criteria.
 
 Additionally, if -n is passed in to get information about a single test case,
 it will only print the flags needed to setup that specific test case.
+
+The test cases found are stored in an index file (.list_testcases_index.json)
+next to this script, which is reused as long as the modification times of the
+directories and XML files it was built from are unchanged.
 """
 
 from __future__ import absolute_import, division, print_function, \
@@ -20,6 +24,10 @@ import fnmatch
 import argparse
 import xml.etree.ElementTree as ET
 import re
+import json
+
+index_file_name = '.list_testcases_index.json'
+index_version = 1
 
 
 def print_case(quiet, args, core_dir, config_dir, res_dir, test_dir, case_num):
@@ -40,6 +48,167 @@ def print_case(quiet, args, core_dir, config_dir, res_dir, test_dir, case_num):
     return case_num
 
 
+def get_core_dirs(script_path):  # {{{
+    # All directories at the top level are searched for test cases
+    return [core_dir for core_dir in sorted(os.listdir(script_path))
+            if os.path.isdir(os.path.join(script_path, core_dir)) and
+            core_dir != '.git']
+# }}}
+
+
+def build_index(script_path):  # {{{
+    # Walk the core/configuration/resolution/test directory structure, finding
+    # all tests that have either a config file or a driver_script file.  The
+    # modification times of all directories and XML files that were visited
+    # are stored so the index can be checked for changes later on.  The index
+    # file itself lives in script_path, so for that directory the list of
+    # cores is stored instead of its modification time.
+    index = {'version': index_version, 'cores': get_core_dirs(script_path),
+             'dirs': {}, 'files': {}, 'cases': []}
+
+    def add_dir(path):
+        index['dirs'][path] = os.path.getmtime(os.path.join(script_path,
+                                                            path))
+
+    # Iterate over all cores
+    for core_dir in index['cores']:
+        add_dir(core_dir)
+        # Iterate over all configurations within a core
+        for config_dir in sorted(os.listdir(os.path.join(script_path,
+                                                         core_dir))):
+            config_path = '{}/{}'.format(core_dir, config_dir)
+            if os.path.isdir(os.path.join(script_path, config_path)):
+                add_dir(config_path)
+                # Iterate over all resolutions within a configuration
+                for res_dir in sorted(os.listdir(
+                        os.path.join(script_path, config_path))):
+                    res_path = '{}/{}'.format(config_path, res_dir)
+                    if os.path.isdir(os.path.join(script_path, res_path)):
+                        add_dir(res_path)
+                        # Iterate over all tests within a resolution
+                        for test_dir in sorted(os.listdir(
+                                os.path.join(script_path, res_path))):
+                            test_path = '{}/{}'.format(res_path, test_dir)
+                            if os.path.isdir(os.path.join(script_path,
+                                                          test_path)):
+                                add_dir(test_path)
+                                add_test_to_index(index, script_path,
+                                                  core_dir, config_dir,
+                                                  res_dir, test_dir)
+
+    return index
+# }}}
+
+
+def add_test_to_index(index, script_path, core_dir, config_dir, res_dir,
+                      test_dir):  # {{{
+    test_path = '{}/{}/{}/{}'.format(core_dir, config_dir, res_dir, test_dir)
+
+    files = {}
+    is_case = False
+    # Iterate over all files within a test
+    for case_file in sorted(os.listdir(os.path.join(script_path, test_path))):
+        if fnmatch.fnmatch(case_file, '*.xml'):
+            file_path = '{}/{}'.format(test_path, case_file)
+            full_path = os.path.join(script_path, file_path)
+            index['files'][file_path] = os.path.getmtime(full_path)
+
+            tree = ET.parse(full_path)
+            root = tree.getroot()
+
+            files[case_file] = root.tag
+
+            # Check to make sure the test is either a config file or a
+            # driver_script file
+            if root.tag == 'config' or root.tag == 'driver_script':
+                is_case = True
+
+            del root
+            del tree
+
+    if is_case:
+        index['cases'].append({'core': core_dir,
+                               'configuration': config_dir,
+                               'resolution': res_dir,
+                               'test': test_dir,
+                               'path': test_path,
+                               'files': files})
+# }}}
+
+
+def index_is_current(index, script_path):  # {{{
+    # The index is current if no directory has had entries added or removed
+    # and no XML file has been modified since the index was built.
+    try:
+        if index['version'] != index_version:
+            return False
+
+        if index['cores'] != get_core_dirs(script_path):
+            return False
+
+        for path, mtime in index['dirs'].items():
+            if os.path.getmtime(os.path.join(script_path, path)) != mtime:
+                return False
+
+        for path, mtime in index['files'].items():
+            if os.path.getmtime(os.path.join(script_path, path)) != mtime:
+                return False
+    except (KeyError, OSError):
+        return False
+
+    return True
+# }}}
+
+
+def get_index(script_path=None):  # {{{
+    # Read the index of test cases from disk if it is still current.
+    # Otherwise, rebuild it and try to write it out for next time.
+    if script_path is None:
+        script_path = os.path.dirname(os.path.realpath(__file__))
+
+    index_path = os.path.join(script_path, index_file_name)
+
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r') as index_file:
+                index = json.load(index_file)
+            if index_is_current(index, script_path):
+                return index
+        except ValueError:
+            pass
+
+    index = build_index(script_path)
+
+    # Write to a temporary file first, so other processes never see a partial
+    # index. The index is only a cache, so failing to write it is not an
+    # error (e.g. if this script is in a read-only location).
+    tmp_path = '{}.{}'.format(index_path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename(tmp_path, index_path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return index
+# }}}
+
+
+def get_test_case(number, index):  # {{{
+    # Return the index entry (a dictionary with the core, configuration,
+    # resolution, test, path and XML files with their root tags) of the N'th
+    # test case, starting from 1, from an index returned by get_index (which
+    # should be read once for all test cases looked up).
+    cases = index['cases']
+    if number < 1 or number > len(cases):
+        raise ValueError('There is no test case with number {}. Valid test '
+                         'case numbers are 1 to {}.'.format(number,
+                                                            len(cases)))
+    return cases[number - 1]
+# }}}
+
+
 if __name__ == "__main__":
     # Define and process input arguments
     parser = argparse.ArgumentParser(
@@ -68,47 +237,9 @@ if __name__ == "__main__":
     # Start case numbering at 1
     case_num = 1
 
-    script_path = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(script_path)
-
-    # Iterate over all cores
-    for core_dir in sorted(os.listdir('.')):
-        if os.path.isdir(core_dir) and core_dir != '.git':
-            # Iterate over all configurations within a core
-            for config_dir in sorted(os.listdir(core_dir)):
-                config_path = '{}/{}'.format(core_dir, config_dir)
-                if os.path.isdir(config_path):
-                    # Iterate over all resolutions within a configuration
-                    for res_dir in sorted(os.listdir(config_path)):
-                        res_path = '{}/{}'.format(config_path, res_dir)
-                        if os.path.isdir(res_path):
-                            # Iterate over all tests within a resolution
-                            for test_dir in sorted(os.listdir(res_path)):
-                                test_path = '{}/{}'.format(res_path, test_dir)
-                                if os.path.isdir(test_path):
-                                    do_print = False
-                                    # Iterate over all files within a test
-                                    for case_file in sorted(
-                                            os.listdir(test_path)):
-                                        if fnmatch.fnmatch(case_file, '*.xml'):
-                                            tree = ET.parse('{}/{}'.format(
-                                                test_path, case_file))
-                                            root = tree.getroot()
-
-                                            # Check to make sure the test is
-                                            # either a config file or a
-                                            # driver_script file
-                                            if root.tag == 'config' or \
-                                                    root.tag == \
-                                                    'driver_script':
-                                                do_print = True
-
-                                            del root
-                                            del tree
-
-                                    if do_print:
-                                        case_num = print_case(
-                                            quiet, args, core_dir, config_dir,
-                                            res_dir, test_dir, case_num)
+    for case in get_index()['cases']:
+        case_num = print_case(quiet, args, case['core'],
+                              case['configuration'], case['resolution'],
+                              case['test'], case_num)
 
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
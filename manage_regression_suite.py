@@ -3,7 +3,8 @@
 This script is used to manage regression suites. A regression suite is a set of
 test cases that ensure one or more features in a model meet certain criteria.
 
-Using this script one can setup or clean a regression suite.
+Using this script one can setup or clean a regression suite, or report on the
+results of running one.
 
 When setting up a regression suite, this script will generate a script to run
 all tests in the suite, and additionally setup each individual test case.
@@ -21,10 +22,26 @@ import fnmatch
 import argparse
 import xml.etree.ElementTree as ET
 import subprocess
+import hashlib
+from six.moves import configparser
+
+sys.path.append('{}/utility_scripts'.format(
+    os.path.dirname(os.path.realpath(__file__))))
+from suite_results import results_file_name, print_report, \
+    write_setup_manifest
+
+# The file in each test's work directory with the fingerprint of the inputs it
+# was last set up from
+setup_fingerprint_name = '.setup_fingerprint'
 
 
 def process_test_setup(test_tag, config_file, work_dir, model_runtime,
-                       suite_script, baseline_dir, verbose):  # {{{
+                       suite_script, baseline_dir, verbose,
+                       scheduled=False, force=False):  # {{{
+    # Set up the test case, unless it was already set up from the same inputs
+    # (see get_setup_fingerprint) and force is False. If scheduled is False,
+    # the steps to run it are written to the suite script. Either way, the
+    # name, path, scripts and output file name of the test are returned.
 
     if verbose:
         stdout = open(work_dir + '/manage_regression_suite.py.out', 'a')
@@ -81,69 +98,118 @@ def process_test_setup(test_tag, config_file, work_dir, model_runtime,
 
     # Setup test case
 
-    if baseline_dir == 'NONE':
-        subprocess.check_call(
-            ['./setup_testcase.py', '-q', '-f', config_file,
-             '--work_dir', work_dir, '-o', test_core, '-c', test_configuration,
-             '-r', test_resolution, '-t', test_test,  '-m', model_runtime],
-            stdout=stdout, stderr=stderr)
+    scripts = list()
+    for script in test_tag:
+        if script.tag == 'script':
+            try:
+                scripts.append(script.attrib['name'])
+            except KeyError:
+                print("ERROR: <script> tag is missing 'name' attribute.")
+                print('Exiting...')
+                sys.exit(1)
+
+    test_path = '{}/{}/{}/{}'.format(test_core, test_configuration,
+                                     test_resolution, test_test)
+
+    command = ['./setup_testcase.py', '-q', '-f', config_file,
+               '--work_dir', work_dir, '-o', test_core, '-c',
+               test_configuration, '-r', test_resolution, '-t', test_test,
+               '-m', model_runtime]
+    if baseline_dir != 'NONE':
+        command.extend(['-b', baseline_dir])
+
+    # Skip the setup if none of its inputs changed since the last time
+    fingerprint = get_setup_fingerprint(command, test_path, config_file,
+                                        model_runtime)
+    fingerprint_file = '{}/{}/{}'.format(work_dir, test_path,
+                                         setup_fingerprint_name)
+    if not force and setup_is_current(fingerprint_file, fingerprint,
+                                      '{}/{}'.format(work_dir, test_path),
+                                      scripts):
+        print("   -- Unchanged case '{}': -o {} -c {} -r {} -t {}".format(
+            test_name, test_core, test_configuration, test_resolution,
+            test_test))
     else:
-        subprocess.check_call(
-            ['./setup_testcase.py', '-q', '-f', config_file,
-             '--work_dir', work_dir, '-o', test_core, '-c', test_configuration,
-             '-r', test_resolution, '-t', test_test,  '-m', model_runtime,
-             '-b', baseline_dir], stdout=stdout, stderr=stderr)
+        if os.path.exists(fingerprint_file):
+            os.remove(fingerprint_file)
 
-    print("   -- Setup case '{}': -o {} -c {} -r {} -t {}".format(
-        test_name, test_core, test_configuration, test_resolution, test_test))
+        subprocess.check_call(command, stdout=stdout, stderr=stderr)
+
+        # List the files that were set up, for the result key of the test
+        write_setup_manifest('{}/{}'.format(work_dir, test_path),
+                             os.path.abspath(model_runtime),
+                             get_executables(config_file))
+
+        with open(fingerprint_file, 'w') as fingerprint_out:
+            fingerprint_out.write('{}\n'.format(fingerprint))
+
+        print("   -- Setup case '{}': -o {} -c {} -r {} -t {}".format(
+            test_name, test_core, test_configuration, test_resolution,
+            test_test))
+
+    test = {'name': test_name,
+            'path': test_path,
+            'scripts': scripts,
+            'output': case_output_name}
+
+    if scheduled:
+        if verbose:
+            stdout.close()
+        else:
+            dev_null.close()
+        return test
 
     # Write step into suite script to cd into the base of the regression suite
     suite_script.write("os.chdir(base_path)\n")
 
+    # Write the step to skip the test if its result can be reused (see
+    # --reuse_results)
+    suite_script.write("if results.is_cached('{}', '{}', '{}'):\n".format(
+        test_name, test_path, case_output_name))
+    suite_script.write("    print(' ** Skipping case {}')\n".format(test_name))
+    suite_script.write("    print('      PASS (cached)')\n")
+    suite_script.write("else:\n")
+    suite_script.write("    test_passed = True\n")
+
     # Write the step to define the output file
-    suite_script.write("case_output = open('case_outputs/{}', 'w')\n".format(
-        case_output_name))
+    suite_script.write("    case_output = open('case_outputs/{}', "
+                       "'w')\n".format(case_output_name))
 
     # Write step to cd into test case directory
-    suite_script.write("os.chdir('{}/{}/{}/{}')\n".format(
-        test_core, test_configuration, test_resolution, test_test))
+    suite_script.write("    os.chdir('{}')\n".format(test_path))
 
-    for script in test_tag:
+    for script_name in scripts:
         # Process test case script
-        if script.tag == 'script':
-            try:
-                script_name = script.attrib['name']
-            except KeyError:
-                print("ERROR: <script> tag is missing 'name' attribute.")
-                print('Exiting...')
-                sys.exit(1)
-
-            command = "subprocess.check_call(['time', '-p', " \
-                      "'{}/{}/{}/{}/{}/{}']".format(
-                          work_dir, test_core, test_configuration,
-                          test_resolution, test_test, script_name)
-            command = '{}, stdout=case_output, stderr=case_output)'.format(
-                command)
-
-            # Write test case run step
-            suite_script.write("print(' ** Running case {}')\n".format(
-                test_name))
-            suite_script.write('try:\n')
-            suite_script.write('    {}\n'.format(command))
-            suite_script.write("    print('      PASS')\n")
-            suite_script.write('except subprocess.CalledProcessError:\n')
-            suite_script.write("    print('   ** FAIL (See case_outputs/{} "
-                               "for more information)')\n".format(
-                                       case_output_name))
-            suite_script.write("    test_failed = True\n")
-
-    # Finish writing test case output
-    suite_script.write("case_output.close()\n")
+        command = "results.check_call(['{}/{}/{}']".format(
+            work_dir, test_path, script_name)
+        command = "{}, '{}', '{}', stdout=case_output, " \
+                  "stderr=case_output)".format(command, test_name,
+                                               case_output_name)
+
+        # Write test case run step
+        suite_script.write("    print(' ** Running case {}')\n".format(
+            test_name))
+        suite_script.write('    try:\n')
+        suite_script.write('        {}\n'.format(command))
+        suite_script.write("        print('      PASS')\n")
+        suite_script.write('    except subprocess.CalledProcessError:\n')
+        suite_script.write("        print('   ** FAIL (See case_outputs/{} "
+                           "for more information)')\n".format(
+                               case_output_name))
+        suite_script.write("        test_failed = True\n")
+        suite_script.write("        test_passed = False\n")
+
+    # Finish writing test case output, and store the result
+    suite_script.write("    case_output.close()\n")
+    suite_script.write("    results.record_result('{}', test_passed)\n".format(
+        test_name))
     suite_script.write("\n")
     if verbose:
         stdout.close()
     else:
         dev_null.close()
+
+    return test
 # }}}
 
 
@@ -196,6 +262,13 @@ def process_test_clean(test_tag, work_dir):  # {{{
          '-c',  test_configuration, '-r', test_resolution, '-t', test_test],
         stdout=dev_null, stderr=dev_null)
 
+    # Make sure the test is set up again next time
+    fingerprint_file = '{}/{}/{}/{}/{}/{}'.format(
+        work_dir, test_core, test_configuration, test_resolution, test_test,
+        setup_fingerprint_name)
+    if os.path.exists(fingerprint_file):
+        os.remove(fingerprint_file)
+
     print("   -- Cleaned case '{}': -o {} -c {} -r {} -t {}".format(
         test_name, test_core, test_configuration, test_resolution, test_test))
 
@@ -204,9 +277,128 @@ def process_test_clean(test_tag, work_dir):  # {{{
 # }}}
 
 
+def get_setup_inputs(test_path, config_file, model_runtime):  # {{{
+    # Return the files that setting up a test reads: setup_testcase.py, the
+    # XML files of the test and the templates they apply (recursively), the
+    # namelist and streams templates named in the config file, the config file
+    # itself and the runtime definition.
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    inputs = [os.path.join(script_path, 'setup_testcase.py'), config_file,
+              model_runtime]
+
+    # Paths that script_* path_base attributes of <template> tags refer to
+    test_dirs = test_path.split('/')
+    template_bases = dict()
+    for index, sub_path in enumerate(['core_dir', 'configuration_dir',
+                                      'resolution_dir', 'test_dir']):
+        template_bases['script_{}'.format(sub_path)] = '{}/{}'.format(
+            script_path, '/'.join(test_dirs[0:index+1]))
+
+    xml_files = sorted(['{}/{}/{}'.format(script_path, test_path, file_name)
+                        for file_name in os.listdir('{}/{}'.format(
+                            script_path, test_path))
+                        if fnmatch.fnmatch(file_name, '*.xml')])
+    while len(xml_files) > 0:
+        xml_file = xml_files.pop(0)
+        if xml_file in inputs:
+            continue
+        inputs.append(xml_file)
+        if not os.path.exists(xml_file):
+            continue
+        try:
+            root = ET.parse(xml_file).getroot()
+        except ET.ParseError:
+            continue
+        for template in root.iter('template'):
+            if 'file' not in template.attrib or \
+                    template.attrib.get('path_base') not in template_bases:
+                continue
+            template_path = template_bases[template.attrib['path_base']]
+            if 'path' in template.attrib:
+                template_path = '{}/{}'.format(template_path,
+                                               template.attrib['path'])
+            xml_files.append('{}/{}'.format(template_path,
+                                            template.attrib['file']))
+
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    for section in ['namelists', 'streams']:
+        if config.has_section(section):
+            for option, value in sorted(config.items(section, raw=True)):
+                inputs.append(value)
+
+    return inputs
+# }}}
+
+
+def get_executables(config_file):  # {{{
+    # The paths to the executables in the config file
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    if not config.has_section('executables'):
+        return list()
+    return [value for option, value in sorted(config.items('executables',
+                                                           raw=True))]
+# }}}
+
+
+def get_setup_fingerprint(command, test_path, config_file,
+                          model_runtime):  # {{{
+    # Return a hash of everything that setting up a test depends on: the
+    # setup command (e.g. the work and baseline directories), the options in
+    # the config file (e.g. the paths to executables), and the contents of the
+    # files from get_setup_inputs.
+    fingerprint = hashlib.sha256()
+    fingerprint.update(repr(command).encode('utf-8'))
+
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    for section in sorted(config.sections()):
+        for option, value in sorted(config.items(section, raw=True)):
+            fingerprint.update('[{}] {} = {}\n'.format(
+                section, option, value).encode('utf-8'))
+
+    for input_file in get_setup_inputs(test_path, config_file,
+                                       model_runtime):
+        fingerprint.update('{}\n'.format(input_file).encode('utf-8'))
+        if os.path.isfile(input_file):
+            with open(input_file, 'rb') as input_data:
+                fingerprint.update(input_data.read())
+        else:
+            fingerprint.update(b'missing\n')
+
+    return fingerprint.hexdigest()
+# }}}
+
+
+def setup_is_current(fingerprint_file, fingerprint, test_work_dir,
+                     scripts):  # {{{
+    # A test doesn't need to be set up again if it was set up from inputs
+    # with the same fingerprint and the scripts the suite runs still exist
+    if not os.path.exists(fingerprint_file):
+        return False
+    with open(fingerprint_file, 'r') as fingerprint_in:
+        if fingerprint_in.read().strip() != fingerprint:
+            return False
+    for script in scripts:
+        if not os.path.exists('{}/{}'.format(test_work_dir, script)):
+            return False
+    return True
+# }}}
+
+
 def setup_suite(suite_tag, work_dir, model_runtime, config_file, baseline_dir,
-                verbose):
+                verbose, testcases=None, max_cores=None, force=False,
+                reuse_results=False):
     # {{{
+    # If max_cores is set, the suite script runs the tests concurrently with
+    # utility_scripts/suite_scheduler.py, using the procs, threads and
+    # prerequisites of each test from testcases (see get_test_case_procs).
+    # Otherwise, the tests are run one after the other. Tests whose inputs
+    # haven't changed since they were last set up are skipped unless force is
+    # True. If reuse_results is True, the suite script reports tests whose
+    # result key matches that of their last passing run as passed, without
+    # running them.
     try:
         suite_name = suite_tag.attrib['name']
     except KeyError:
@@ -231,7 +423,11 @@ def setup_suite(suite_tag, work_dir, model_runtime, config_file, baseline_dir,
     regression_script.write('import sys\n')
     regression_script.write('import os\n')
     regression_script.write('import subprocess\n')
-    regression_script.write('import numpy as np\n')
+    regression_script.write('\n')
+    regression_script.write("sys.path.append('{}/utility_scripts')\n".format(
+        os.path.dirname(os.path.realpath(__file__))))
+    regression_script.write('from suite_results import SuiteResults, '
+                            'print_runtimes\n')
     regression_script.write('\n')
     regression_script.write("os.environ['PYTHONUNBUFFERED'] = '1'\n")
     regression_script.write("test_failed = False\n")
@@ -240,38 +436,30 @@ def setup_suite(suite_tag, work_dir, model_runtime, config_file, baseline_dir,
     regression_script.write("    os.makedirs('case_outputs')\n")
     regression_script.write('\n')
     regression_script.write("base_path = '{}'\n".format(work_dir))
+    regression_script.write("results = SuiteResults(base_path, '{}', "
+                            "reuse_results={})\n".format(suite_name,
+                                                          reuse_results))
 
     if verbose:
         # flush existing regression suite output file
         open(work_dir + '/manage_regression_suite.py.out', 'w').close()
 
+    scheduled = max_cores is not None
+    tests = list()
     for child in suite_tag:
         # Process <test> tags within the test suite
         if child.tag == 'test':
-            process_test_setup(child, config_file, work_dir, model_runtime,
-                               regression_script, baseline_dir, verbose)
-
-    regression_script.write("print('TEST RUNTIMES:')\n")
-    regression_script.write("case_output = '/case_outputs/'\n")
-    regression_script.write("totaltime = 0\n")
-    regression_script.write("for _, _, files in os.walk(base_path + "
-                            "case_output):\n")
-    regression_script.write("    for afile in sorted(files):\n")
-    regression_script.write("        outputfile = base_path + case_output + "
-                            "afile\n")
-    regression_script.write("        runtime = np.ceil(float(subprocess."
-                            "check_output(\n"
-                            "                ['grep', 'real', outputfile])."
-                            "decode('utf-8').split('\\n')[-2].split()[1]))\n")
-    regression_script.write("        totaltime += runtime\n")
-    regression_script.write("        mins = int(np.floor(runtime/60.0))\n")
-    regression_script.write("        secs = int(np.ceil(runtime - mins*60))\n")
-    regression_script.write("        print('{:02d}:{:02d} {}'.format(mins, "
-                            "secs, afile))\n")
-    regression_script.write("mins = int(np.floor(totaltime/60.0))\n")
-    regression_script.write("secs = int(np.ceil(totaltime - mins*60))\n")
-    regression_script.write("print('Total runtime {:02d}:{:02d}'.format(mins, "
-                            "secs))\n")
+            test = process_test_setup(child, config_file, work_dir,
+                                      model_runtime, regression_script,
+                                      baseline_dir, verbose, scheduled,
+                                      force)
+            tests.append(test)
+
+    if scheduled:
+        write_scheduled_tests(regression_script, tests, testcases, max_cores)
+
+    regression_script.write("results.finish(not test_failed)\n")
+    regression_script.write("print_runtimes(results.path)\n")
     regression_script.write("\n")
 
     regression_script.write("if test_failed:\n")
@@ -288,6 +476,37 @@ def setup_suite(suite_tag, work_dir, model_runtime, config_file, baseline_dir,
 # }}}
 
 
+def write_scheduled_tests(regression_script, tests, testcases,
+                          max_cores):  # {{{
+    # Write the tests to the suite script, to be run concurrently within
+    # max_cores by the suite scheduler.
+    regression_script.write("\n")
+    regression_script.write("from suite_scheduler import run_suite\n")
+    regression_script.write("\n")
+    regression_script.write("tests = []\n")
+    for test in tests:
+        testcase = testcases[test['name']]
+        cores = testcase['cores']
+        prereqs = [prereq['name'] for prereq in testcase['prereqs']]
+        regression_script.write(
+            "tests.append({{'name': {!r},\n"
+            "              'path': {!r},\n"
+            "              'scripts': {!r},\n"
+            "              'cores': {},\n"
+            "              'prereqs': {!r},\n"
+            "              'output': {!r}}})\n".format(
+                str(test['name']), str(test['path']),
+                [str(script) for script in test['scripts']], cores,
+                [str(prereq) for prereq in prereqs], str(test['output'])))
+    regression_script.write("\n")
+    regression_script.write("if not run_suite(tests, max_cores={}, "
+                            "base_path=base_path, results=results):\n".format(
+                                max_cores))
+    regression_script.write("    test_failed = True\n")
+    regression_script.write("\n")
+# }}}
+
+
 def clean_suite(suite_tag, work_dir):  # {{{
     try:
         suite_name = suite_tag.attrib['name']
@@ -393,8 +612,12 @@ def get_test_case_procs(suite_tag):  # {{{
             del config_root
             del config_tree
 
+            # procs and threads are those of the last model run, as shown in
+            # the summary, while the scheduler reserves the cores of the
+            # largest model run
             procs = 1
             threads = 1
+            cores = 1
             # Loop over all files in test_path that have the .xml extension.
             for file in os.listdir('{}'.format(test_path)):
                 if fnmatch.fnmatch(file, '*.xml'):
@@ -420,6 +643,8 @@ def get_test_case_procs(suite_tag):  # {{{
                                 except (KeyError, ValueError):
                                     threads = 1
 
+                                cores = max(cores, procs * threads)
+
                     del config_root
                     del config_tree
             testcases[test_name] = {'core': test_core,
@@ -429,6 +654,7 @@ def get_test_case_procs(suite_tag):  # {{{
                                     'path': test_path,
                                     'procs': procs,
                                     'threads': threads,
+                                    'cores': cores,
                                     'prereqs': prereqs}
 
     return testcases  # }}}
@@ -462,7 +688,7 @@ def main ():  # {{{
         description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("-t", "--test_suite", dest="test_suite",
                         help="Path to file containing a test suite to setup",
-                        metavar="FILE", required=True)
+                        metavar="FILE")
     parser.add_argument("-f", "--config_file", dest="config_file",
                         help="Configuration file for test case setup",
                         metavar="FILE")
@@ -485,9 +711,55 @@ def main ():  # {{{
                         help="If set, script will setup the test suite in "
                         "work_dir rather in this script's location.",
                         metavar="PATH")
+    parser.add_argument("--max_cores", dest="max_cores", type=int,
+                        help="If set, the suite script will run tests "
+                             "concurrently, as their prerequisites allow, "
+                             "using at most this many cores at a time.",
+                        metavar="N")
+    parser.add_argument("--force", dest="force",
+                        help="If set, set up all tests in the suite, even "
+                             "those whose inputs haven't changed since they "
+                             "were last set up.", action="store_true")
+    parser.add_argument("--reuse_results", dest="reuse_results",
+                        help="If set, the suite script will not run tests "
+                             "whose executables, inputs, namelists, streams "
+                             "and runtime definition are identical to those "
+                             "of their last passing run, and report them as "
+                             "passed.", action="store_true")
+    parser.add_argument("--report", dest="report",
+                        help="Print a summary of the results of the last run "
+                             "of the suite in work_dir, with its slowest "
+                             "tests and steps.", action="store_true")
+    parser.add_argument("--compare", dest="compare",
+                        help="With --report, a results file from an earlier "
+                             "run of the suite to compare test times with.",
+                        metavar="FILE")
+    parser.add_argument("--slowest", dest="slowest", type=int, default=10,
+                        help="With --report, the number of slowest tests and "
+                             "steps to list.", metavar="N")
 
     args = parser.parse_args()
 
+    if not args.work_dir:
+        args.work_dir = os.path.dirname(os.path.realpath(__file__))
+
+    args.work_dir = os.path.abspath(args.work_dir)
+
+    if args.report:
+        results_path = '{}/{}'.format(args.work_dir, results_file_name)
+        if not os.path.exists(results_path):
+            parser.error("Results file '{}' does not exist. Please run the "
+                         "suite before running again.".format(results_path))
+        if args.compare and not os.path.exists(args.compare):
+            parser.error("Results file '{}' does not exist.".format(
+                args.compare))
+        print_report(results_path, args.compare, args.slowest)
+        return
+
+    if not args.test_suite:
+        parser.error("A test suite (-t/--test_suite) is required unless "
+                     "--report is used.")
+
     if not args.config_file:
         print("WARNING: Not configuration file specified. Using the default "
               "of 'local.config'")
@@ -498,11 +770,6 @@ def main ():  # {{{
                      "and setup before running again.".format(
                          args.config_file))
 
-    if not args.work_dir:
-        args.work_dir = os.path.dirname(os.path.realpath(__file__))
-
-    args.work_dir = os.path.abspath(args.work_dir)
-
     if not args.model_runtime:
         args.model_runtime = '{}/runtime_definitions/mpirun.xml'.format(
             os.path.dirname(os.path.realpath(__file__)))
@@ -512,6 +779,9 @@ def main ():  # {{{
     if not args.baseline_dir:
         args.baseline_dir = 'NONE'
 
+    if args.max_cores is not None and args.max_cores < 1:
+        parser.error("--max_cores must be at least 1.")
+
     if not args.setup and not args.clean:
         print('WARNING: Neither the setup (-s/--setup) nor the clean '
               '(-c/--clean) flags were provided. Script will perform no '
@@ -536,7 +806,9 @@ def main ():  # {{{
             print("Setting Up Test Cases:")
             testcases = get_test_case_procs(suite_root)
             setup_suite(suite_root, args.work_dir, args.model_runtime,
-                        args.config_file, args.baseline_dir, args.verbose)
+                        args.config_file, args.baseline_dir, args.verbose,
+                        testcases, args.max_cores, args.force,
+                        args.reuse_results)
             summarize_suite(testcases)
             if args.verbose:
                 cmd = ['cat',
@@ -17,6 +17,12 @@ import glob
 from datetime import datetime
 import traceback
 import sys
+import json
+import hashlib
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
 from geometric_features import GeometricFeatures, FeatureCollection
 from mpas_tools.ocean.moc import make_moc_basins_and_transects
 from mpas_tools.io import write_netcdf
@@ -67,8 +73,25 @@ def main():  # {{{
     parser.add_argument('--email', dest='email', required=False,
                         help='email address of the author to include in '
                              'metadata')
+    parser.add_argument('--force', dest='force', action='append',
+                        metavar='STEP',
+                        help='run a step even if its inputs are unchanged '
+                             'since it last succeeded; can be given more '
+                             'than once, and "all" runs all steps')
     args = parser.parse_args()
 
+    step_names = [function.__name__ for function in function_list]
+    force = list()
+    if args.force is not None:
+        for function_name in args.force:
+            if function_name == 'all':
+                force = list(step_names)
+            elif function_name not in step_names:
+                parser.error('unknown step {} in --force'.format(
+                    function_name))
+            else:
+                force.append(function_name)
+
     # clean: Delete all directories
     if args.clean:
         print('****** clean out directories ******')
@@ -76,6 +99,8 @@ def main():  # {{{
             function_name = function.__name__
             shutil.rmtree(function_name)
             print('removed directory: {}'.format(function_name))
+        if os.path.exists(digest_cache_filename):
+            os.remove(digest_cache_filename)
         return
 
     if args.ice_shelf_cavities:
@@ -98,8 +123,6 @@ def main():  # {{{
     shutil.copyfile('mesh_before_metadata.nc', 'mesh.nc')
     append_mesh_metadata(config, 'mesh.nc')
 
-    currentDir = os.getcwd()
-
     # create inputdata directories
     make_dir('assembled_files_for_upload/inputdata/ocn/mpas-o/{}'.format(
         mesh_name))
@@ -111,32 +134,619 @@ def main():  # {{{
     make_dir('assembled_files_for_upload/diagnostics/mpas_analysis/'
              'region_masks')
 
-    success = True
-    print()
-    for function in function_list:
-        function_name = function.__name__
-        print("****** {} ******".format(function_name))
+    # steps run in their own directories, so the weight cache needs an
+    # absolute path
+    weight_cache = config.get('main', 'weight_cache')
+    if weight_cache != '':
+        weight_cache = os.path.abspath(weight_cache)
+        make_dir(weight_cache)
+        config.set('main', 'weight_cache', weight_cache)
+
+    success = run_steps(config, function_list, force)
+
+    if success:
+        print("****** SUCCESS for all enabled steps ******")
+    else:
+        print("!!!!!! FAILURE: One or more steps failed. See output above !!!!!!")
+# }}}
 
-        if config.get(function_name, 'enable').lower() == 'false':
-            print("Disabled in .ini file")
-        else:
-            make_dir(function_name)
-            os.chdir(function_name)
 
-            try:
-                function(config)
+# The steps that each step needs the output of. Steps without any run as soon
+# as the process budget allows, and steps whose prerequisites are disabled
+# run as if they had succeeded.
+step_dependencies = {'mapping_CORE_Gcase': ['scrip'],
+                     'mapping_JRA_Gcase': ['scrip'],
+                     'mapping_ne30': ['scrip'],
+                     'domain_CORE_Gcase': ['mapping_CORE_Gcase'],
+                     'domain_JRA_Gcase': ['mapping_JRA_Gcase'],
+                     'domain_ne30': ['mapping_ne30'],
+                     'mapping_runoff': ['scrip'],
+                     'salinity_restoring': ['scrip']}
+
+# The conda packages whose versions are added to the mesh metadata, keyed by
+# their names in the metadata
+metadata_packages = {'COMPASS': 'compass', 'JIGSAW': 'jigsaw',
+                     'JIGSAW-Python': 'jigsawpy', 'MPAS-Tools': 'mpas_tools',
+                     'NCO': 'nco', 'ESMF': 'esmf',
+                     'geometric_features': 'geometric_features',
+                     'Metis': 'metis', 'pyremap': 'pyremap'}
+
+# The process budget of the step running in this process
+process_budget = None
+
+# The cache of the digests of the input files of steps, which are compared
+# with those recorded in fingerprint.json in the directory of each step when
+# it last succeeded
+digest_cache_filename = 'fingerprint_cache.json'
+
+# The digest cache of the step running in this process: a copy of the one in
+# fingerprint_cache.json when the step started, to which the step adds the
+# digests it computes (which are merged back when it finishes)
+step_digest_cache = dict()
+
+# The links the step running in this process made (see make_link), with
+# their absolute paths
+step_links = list()
+
+
+class ProcessBudget(object):  # {{{
+    # A number of processes (the nprocs config option) shared by the steps,
+    # which run concurrently in separate processes. Each step holds one
+    # process while it runs, and trades it for the processes of its commands
+    # while they run (see run_commands), so a step never waits for processes
+    # while holding any.
+    def __init__(self, nprocs):
+        self.nprocs = nprocs
+        self.available = multiprocessing.Value('i', nprocs, lock=False)
+        self.condition = multiprocessing.Condition()
+
+    def acquire(self, count):
+        # Wait until count processes (at most all of them) are available and
+        # take them, returning how many were taken
+        count = max(1, min(count, self.nprocs))
+        with self.condition:
+            while self.available.value < count:
+                self.condition.wait()
+            self.available.value -= count
+        return count
+
+    def release(self, count):
+        with self.condition:
+            self.available.value += count
+            self.condition.notify_all()
+# }}}
+
+
+def run_steps(config, function_list, force):  # {{{
+    # Run each enabled step in its own directory and process, as soon as the
+    # steps it depends on have succeeded, printing the output and result of
+    # each step as it finishes. Steps whose inputs haven't changed since they
+    # last succeeded are skipped, unless they are in force. Returns True if
+    # all enabled steps succeeded.
+    budget = ProcessBudget(config.getint('main', 'nprocs'))
+    currentDir = os.getcwd()
+    digest_cache = read_digest_cache()
+    # the steps look up the digest of the mesh in their copy of the cache
+    get_file_digest('mesh_before_metadata.nc', digest_cache)
+    write_digest_cache(digest_cache)
+    # the versions of the packages the steps use (and write to the metadata)
+    # are inputs of every step
+    package_versions = dict([(package, get_conda_package_version(package))
+                             for package in metadata_packages.values()])
+
+    step_names = [function.__name__ for function in function_list]
+    pending = list(function_list)
+    succeeded = list()
+    running = dict()
+    success = True
+    print()
+    while len(pending) > 0 or len(running) > 0:
+        for function in list(pending):
+            function_name = function.__name__
+            dependencies = [name for name in
+                            step_dependencies.get(function_name, list())
+                            if name in step_names]
+            pending_names = [step.__name__ for step in pending]
+            if any([name in running or name in pending_names for name in
+                    dependencies]):
+                continue
+            pending.remove(function)
+            failed = [name for name in dependencies if name not in succeeded]
+
+            if config.get(function_name, 'enable').lower() == 'false':
+                print("****** {} ******".format(function_name))
+                print("Disabled in .ini file")
+                print(" ")
+                succeeded.append(function_name)
+            elif len(failed) > 0:
+                print("****** {} ******".format(function_name))
+                print("Skipped because {} failed".format(', '.join(failed)))
+                print('!!! FAILURE !!!')
+                print(" ")
+                success = False
+            elif function_name not in force and \
+                    is_step_up_to_date(config, function_name, digest_cache,
+                                       package_versions):
+                print("****** {} ******".format(function_name))
+                print("Skipped because its inputs are unchanged since it "
+                      "last succeeded (use --force {} to run it "
+                      "again)".format(function_name))
+                print(" ")
+                succeeded.append(function_name)
+            else:
+                make_dir(function_name)
+                # A step that fails partway must not look up to date
+                fingerprint_filename = '{}/fingerprint.json'.format(
+                    function_name)
+                if os.path.exists(fingerprint_filename):
+                    os.remove(fingerprint_filename)
+                process = multiprocessing.Process(
+                    target=run_step, args=(function, config, budget,
+                                           digest_cache))
+                process.start()
+                running[function_name] = process
+
+        if len(running) == 0:
+            continue
+
+        finished = wait([process.sentinel for process in running.values()])
+        for function_name, process in list(running.items()):
+            if process.sentinel not in finished:
+                continue
+            process.join()
+            del running[function_name]
+            merge_step_digests(function_name, digest_cache)
+            links = read_step_links(function_name)
+            print("****** {} ******".format(function_name))
+            log_filename = '{}/{}/step.log'.format(currentDir, function_name)
+            if os.path.exists(log_filename):
+                with open(log_filename) as log_file:
+                    sys.stdout.write(log_file.read())
+            if process.exitcode == 0:
+                write_step_fingerprint(config, function_name, digest_cache,
+                                       package_versions, links)
+                write_digest_cache(digest_cache)
                 print('SUCCESS')
-            except BaseException:
+                succeeded.append(function_name)
+            else:
                 print('!!! FAILURE !!!')
-                traceback.print_exc(file=sys.stdout)
                 success = False
-            os.chdir(currentDir)
-        print(" ")
+            print(" ")
+            sys.stdout.flush()
 
-    if success:
-        print("****** SUCCESS for all enabled steps ******")
+    return success
+# }}}
+
+
+def read_digest_cache():  # {{{
+    # The digests of input files, keyed by their real path, with the size and
+    # modification time they had, so unchanged files aren't read again
+    if not os.path.exists(digest_cache_filename):
+        return dict()
+    with open(digest_cache_filename) as cache_file:
+        return json.load(cache_file)
+# }}}
+
+
+def write_digest_cache(digest_cache):  # {{{
+    with open(digest_cache_filename, 'w') as cache_file:
+        json.dump(digest_cache, cache_file, indent=1, sort_keys=True)
+# }}}
+
+
+def merge_step_digests(function_name, digest_cache):  # {{{
+    # Add the digests a step computed (see run_step) to the cache
+    filename = '{}/new_digests.json'.format(function_name)
+    if not os.path.exists(filename):
+        return
+    with open(filename) as digests_file:
+        digest_cache.update(json.load(digests_file))
+    os.remove(filename)
+    write_digest_cache(digest_cache)
+# }}}
+
+
+def read_step_links(function_name):  # {{{
+    # The links to its outputs a step made in assembled_files_for_upload (see
+    # run_step), with their targets, keyed by their paths relative to the
+    # working directory
+    filename = '{}/upload_links.json'.format(function_name)
+    if not os.path.exists(filename):
+        return dict()
+    with open(filename) as links_file:
+        links = json.load(links_file)
+    os.remove(filename)
+    return links
+# }}}
+
+
+def get_file_digest(filename, digest_cache):  # {{{
+    path = os.path.realpath(filename)
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    if path in digest_cache and \
+            digest_cache[path][0:2] == [stat.st_size, stat.st_mtime]:
+        return digest_cache[path][2]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(16 * 1024 * 1024), b''):
+            sha.update(chunk)
+    digest_cache[path] = [stat.st_size, stat.st_mtime, sha.hexdigest()]
+    return sha.hexdigest()
+# }}}
+
+
+def get_step_inputs(config, function_name, digest_cache,
+                    package_versions):  # {{{
+    # The inputs of a step: the config options it may use (except those that
+    # only change how it runs or today's creation date), the digest of the
+    # mesh before metadata is added (mesh.nc itself gets a new creation date
+    # on every run), the versions of the conda packages, the digests of the
+    # files linked into its directory and the fingerprints of the steps it
+    # depends on
+    inputs = dict()
+    for section in ['main', 'mesh', function_name]:
+        for option in config.options(section):
+            if option in ['nprocs', 'regrid_nprocs', 'weight_cache',
+                          'enable', 'creation_date']:
+                continue
+            inputs['option:{}.{}'.format(section, option)] = \
+                config.get(section, option)
+
+    inputs['file:mesh_before_metadata.nc'] = get_file_digest(
+        'mesh_before_metadata.nc', digest_cache)
+
+    for package, version in package_versions.items():
+        inputs['package:{}'.format(package)] = version
+
+    mesh_path = os.path.realpath('mesh.nc')
+    if os.path.isdir(function_name):
+        for filename in sorted(os.listdir(function_name)):
+            path = '{}/{}'.format(function_name, filename)
+            if not os.path.islink(path) or \
+                    os.path.realpath(path) == mesh_path:
+                continue
+            inputs['link:{}'.format(filename)] = get_file_digest(
+                path, digest_cache)
+
+    for name in step_dependencies.get(function_name, list()):
+        inputs['step:{}'.format(name)] = read_step_fingerprint(name).get(
+            'fingerprint')
+    return inputs
+# }}}
+
+
+def get_step_outputs(function_name):  # {{{
+    # The files a step wrote to its directory, other than logs
+    outputs = list()
+    for filename in sorted(os.listdir(function_name)):
+        path = '{}/{}'.format(function_name, filename)
+        if os.path.islink(path) or not os.path.isfile(path) or \
+                filename in ['step.log', 'log.out', 'command_history',
+                             'fingerprint.json', 'new_digests.json',
+                             'upload_links.json']:
+            continue
+        outputs.append(filename)
+    return outputs
+# }}}
+
+
+def get_fingerprint(inputs):  # {{{
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+# }}}
+
+
+def read_step_fingerprint(function_name):  # {{{
+    filename = '{}/fingerprint.json'.format(function_name)
+    if not os.path.exists(filename):
+        return dict()
+    with open(filename) as fingerprint_file:
+        return json.load(fingerprint_file)
+# }}}
+
+
+def write_step_fingerprint(config, function_name, digest_cache,
+                           package_versions, links):  # {{{
+    inputs = get_step_inputs(config, function_name, digest_cache,
+                             package_versions)
+    outputs = get_step_outputs(function_name)
+    # The outputs of steps that other steps depend on (e.g. the SCRIP files)
+    # are their inputs, so their digests are cached once here rather than in
+    # each of those steps
+    if any([function_name in dependencies for dependencies in
+            step_dependencies.values()]):
+        for filename in outputs:
+            get_file_digest('{}/{}'.format(function_name, filename),
+                            digest_cache)
+    fingerprint = {'fingerprint': get_fingerprint(inputs), 'inputs': inputs,
+                   'outputs': outputs, 'links': links}
+    with open('{}/fingerprint.json'.format(function_name),
+              'w') as fingerprint_file:
+        json.dump(fingerprint, fingerprint_file, indent=1, sort_keys=True)
+# }}}
+
+
+def is_step_up_to_date(config, function_name, digest_cache,
+                       package_versions):  # {{{
+    # Whether a step succeeded before with the same inputs, and its outputs
+    # and the links to them in assembled_files_for_upload are still there
+    old = read_step_fingerprint(function_name)
+    if 'fingerprint' not in old or 'links' not in old:
+        return False
+    inputs = get_step_inputs(config, function_name, digest_cache,
+                             package_versions)
+    if get_fingerprint(inputs) != old['fingerprint']:
+        changed = sorted([key for key in set(inputs) | set(old['inputs'])
+                          if inputs.get(key) != old['inputs'].get(key)])
+        print("- {} will run again, since these inputs changed: {}".format(
+            function_name, ', '.join(changed)))
+        return False
+    missing = [filename for filename in old['outputs'] if not
+               os.path.exists('{}/{}'.format(function_name, filename))]
+    missing.extend([path for path, target in sorted(old['links'].items())
+                    if not os.path.islink(path) or
+                    os.readlink(path) != target or
+                    not os.path.exists(path)])
+    if len(missing) > 0:
+        print("- {} will run again, since these outputs are missing: "
+              "{}".format(function_name, ', '.join(missing)))
+        return False
+    return True
+# }}}
+
+
+def run_step(function, config, budget, digest_cache):  # {{{
+    # Run a step in its directory, holding one process of the budget, with
+    # its output written to step.log there, the digests it computed to
+    # new_digests.json and the links it made in assembled_files_for_upload to
+    # upload_links.json. Exits 0 if the step succeeded.
+    global process_budget
+    global step_digest_cache
+    global step_links
+    process_budget = budget
+    step_digest_cache = dict(digest_cache)
+    step_links = list()
+
+    upload_dir = os.path.abspath('assembled_files_for_upload')
+    os.chdir(function.__name__)
+    # some steps change to the directories of their outputs
+    step_dir = os.getcwd()
+    log_file = open('step.log', 'w')
+    sys.stdout = log_file
+    sys.stderr = log_file
+
+    process_budget.acquire(1)
+    exit_code = 0
+    try:
+        function(config)
+    except BaseException:
+        traceback.print_exc(file=sys.stdout)
+        exit_code = 1
+    process_budget.release(1)
+
+    new_digests = dict([(path, entry) for path, entry in
+                        step_digest_cache.items() if
+                        digest_cache.get(path) != entry])
+    if len(new_digests) > 0:
+        with open('{}/new_digests.json'.format(step_dir),
+                  'w') as digests_file:
+            json.dump(new_digests, digests_file)
+
+    upload_links = dict()
+    for path in step_links:
+        if path.startswith(upload_dir + os.sep) and os.path.islink(path):
+            upload_links[os.path.relpath(path, os.path.dirname(upload_dir))] \
+                = os.readlink(path)
+    with open('{}/upload_links.json'.format(step_dir), 'w') as links_file:
+        json.dump(upload_links, links_file)
+
+    log_file.close()
+    os._exit(exit_code)
+# }}}
+
+
+@contextmanager
+def released_step_process():  # {{{
+    # Give back the process held by this step while its commands take
+    # processes of their own from the budget
+    if process_budget is None:
+        yield
+        return
+    process_budget.release(1)
+    try:
+        yield
+    finally:
+        process_budget.acquire(1)
+# }}}
+
+
+@contextmanager
+def budget_processes(nprocs):  # {{{
+    # Take nprocs processes from the budget (e.g. for an MPI call), yielding
+    # how many were taken
+    if process_budget is None:
+        yield nprocs
+        return
+    acquired = process_budget.acquire(nprocs)
+    try:
+        yield acquired
+    finally:
+        process_budget.release(acquired)
+# }}}
+
+
+def get_regrid_nprocs(config):  # {{{
+    # The number of MPI tasks of each call to ESMF_RegridWeightGen
+    if config.has_option('main', 'regrid_nprocs'):
+        return config.getint('main', 'regrid_nprocs')
+    return config.getint('main', 'nprocs')
+# }}}
+
+
+def get_mpirun_prefix(nprocs):  # {{{
+    if 'CONDA_PREFIX' not in os.environ:
+        raise ValueError('A COMPASS conda environment needs to be loaded.')
+    mpirun_path = '{}/bin/mpirun'.format(os.environ['CONDA_PREFIX'])
+    if os.path.exists(mpirun_path):
+        return [mpirun_path, '-n', str(nprocs)]
     else:
-        print("!!!!!! FAILURE: One or more steps failed. See output above !!!!!!")
+        return list()
+# }}}
+
+
+def run_commands(commands, nprocs=1, mpi=False):  # {{{
+    # Run independent commands concurrently, each on nprocs processes of the
+    # budget, with the output of each appended to log.out when it's done. If
+    # mpi is True, each command is launched with mpirun on as many tasks as
+    # the budget actually gave it (at most nprocs).
+    def run(index):
+        log_filename = 'log.{}.out'.format(index)
+        with budget_processes(nprocs) as acquired:
+            args = commands[index]
+            if mpi:
+                args = get_mpirun_prefix(acquired) + args
+            run_command(args, log_filename=log_filename)
+
+    if len(commands) == 0:
+        return
+    # without mpirun, each command only runs on one process
+    if mpi and len(get_mpirun_prefix(nprocs)) == 0:
+        nprocs = 1
+    if process_budget is None:
+        nthreads = 1
+    else:
+        nthreads = max(1, process_budget.nprocs // max(1, nprocs))
+    pool = ThreadPool(min(nthreads, len(commands)))
+    try:
+        with released_step_process():
+            pool.map(run, range(len(commands)), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        for index in range(len(commands)):
+            log_filename = 'log.{}.out'.format(index)
+            if os.path.exists(log_filename):
+                with open(log_filename) as instream:
+                    with open('log.out', 'a') as outstream:
+                        outstream.write(instream.read())
+                os.remove(log_filename)
+# }}}
+
+
+def get_weight_key(source, destination, options):  # {{{
+    # The name of a weight file in the cache: a digest of the source and
+    # destination grids (digests of their files, or descriptions of grids
+    # that aren't read from a file) and the options of the regridding
+    key = {'source': source, 'destination': destination,
+           'options': list(options)}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+# }}}
+
+
+def get_mesh_digest():  # {{{
+    # The weights to and from the mesh only depend on its coordinates, which
+    # don't change when its metadata (e.g. the creation date) is added
+    return get_file_digest('../mesh_before_metadata.nc', step_digest_cache)
+# }}}
+
+
+def link_or_copy(source, destination):  # {{{
+    # Hard link a weight file so the cache and the steps share the same data,
+    # copying it if they aren't on the same file system
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+# }}}
+
+
+def get_cached_weights(cache_dir, key, weight_filename):  # {{{
+    # Link the weight file from the cache, returning whether it was there
+    if cache_dir is None or cache_dir == '':
+        return False
+    cache_filename = '{}/{}.nc'.format(cache_dir, key)
+    if not os.path.exists(cache_filename):
+        return False
+    # never write into a file that is linked to the cache
+    if os.path.lexists(weight_filename):
+        os.remove(weight_filename)
+    link_or_copy(cache_filename, weight_filename)
+    print('- using cached weights {} for {}'.format(cache_filename,
+                                                   weight_filename))
+    return True
+# }}}
+
+
+def store_cached_weights(cache_dir, key, weight_filename):  # {{{
+    # Add a new weight file to the cache, renaming it into place so other
+    # steps never see a partial file
+    if cache_dir is None or cache_dir == '' or \
+            not os.path.exists(weight_filename):
+        return
+    cache_filename = '{}/{}.nc'.format(cache_dir, key)
+    if os.path.exists(cache_filename):
+        return
+    temp_filename = '{}.{}.tmp'.format(cache_filename, os.getpid())
+    link_or_copy(weight_filename, temp_filename)
+    os.rename(temp_filename, cache_filename)
+# }}}
+
+
+@contextmanager
+def cached_weights(cache_dir, key, weight_filename):  # {{{
+    # Link the weight file from the cache before the block (which then
+    # shouldn't compute it again, as Remapper doesn't), and store it in the
+    # cache after. Without a cache, an existing weight file is left for the
+    # block to reuse.
+    if cache_dir is not None and cache_dir != '' and \
+            not get_cached_weights(cache_dir, key, weight_filename) and \
+            os.path.lexists(weight_filename):
+        os.remove(weight_filename)
+    yield
+    store_cached_weights(cache_dir, key, weight_filename)
+# }}}
+
+
+def get_regrid_arg(args, flag):  # {{{
+    return args[args.index(flag) + 1]
+# }}}
+
+
+def run_regrid_commands(config, commands):  # {{{
+    # Run ESMF_RegridWeightGen commands with mpirun as run_commands does,
+    # except those whose weights are in the cache, and add the new weights to
+    # the cache
+    cache_dir = config.get('main', 'weight_cache')
+    keys = list()
+    remaining = list()
+    for args in commands:
+        options = list()
+        index = 1
+        while index < len(args):
+            if args[index] in ['--source', '--destination', '--weight']:
+                index += 2
+            else:
+                options.append(args[index])
+                index += 1
+        digest = list()
+        for flag in ['--source', '--destination']:
+            digest.append(get_file_digest(get_regrid_arg(args, flag),
+                                          step_digest_cache))
+        key = get_weight_key(digest[0], digest[1], options)
+        weight_filename = get_regrid_arg(args, '--weight')
+        if not get_cached_weights(cache_dir, key, weight_filename):
+            if os.path.lexists(weight_filename):
+                os.remove(weight_filename)
+            keys.append((key, weight_filename))
+            remaining.append(args)
+
+    run_commands(remaining, get_regrid_nprocs(config), mpi=True)
+
+    for key, weight_filename in keys:
+        store_cached_weights(cache_dir, key, weight_filename)
 # }}}
 
 
@@ -192,10 +802,12 @@ def graph_partition_ocean(config):  # {{{
     for power10 in range(3):
         n = np.concatenate([n, 10**power10 * n_multiples12])
 
+    commands = list()
     for j in range(len(n)):
         if min_graph_size <= n[j] <= max_graph_size:
             args = ['gpmetis', 'mpas-o.graph.info.' + date_string, str(n[j])]
-            run_command(args)
+            commands.append(args)
+    run_commands(commands)
 
     # create link to output directory
     files = glob.glob('mpas-o.graph.info.*')
@@ -377,7 +989,6 @@ def mapping(config, atm_scrip_tag):  # {{{
     ice_shelf_cavities = config.getboolean('main', 'ice_shelf_cavities')
 
     # obtain configuration settings
-    nprocs = config.get('main', 'nprocs')
     if ice_shelf_cavities:
         nomaskStr = '.nomask'
     else:
@@ -391,14 +1002,10 @@ def mapping(config, atm_scrip_tag):  # {{{
     atm_scrip_file = '{}.nc'.format(atm_scrip_tag)
     make_link('{}/{}'.format(atm_scrip_path, atm_scrip_file), atm_scrip_file)
 
-    if 'CONDA_PREFIX' not in os.environ:
-        raise ValueError('A COMPASS conda environment needs to be loaded.')
-    mpirun_path = '{}/bin/mpirun'.format(os.environ['CONDA_PREFIX'])
-    if os.path.exists(mpirun_path):
-        prefix = [mpirun_path, '-n', nprocs]
-    else:
-        prefix = list()
-
+    # The regrid calls are independent of one another, so they all run
+    # concurrently as the process budget allows, except those whose weights
+    # are in the cache
+    commands = list()
     for method, short in [['conserve', 'aave'], ['bilinear', 'blin'],
                           ['patch', 'patc']]:
 
@@ -411,7 +1018,7 @@ def mapping(config, atm_scrip_tag):  # {{{
                 '--destination', atm_scrip_file,
                 '--weight', mapping_file,
                 '--ignore_unmapped']
-        run_command(prefix + args)
+        commands.append(args)
 
         # Atmosphere to ocean
         mapping_file = 'map_{}_TO_{}{}_{}.{}.nc'.format(
@@ -422,7 +1029,7 @@ def mapping(config, atm_scrip_tag):  # {{{
                 '--destination', ocn_scrip_file,
                 '--weight', mapping_file,
                 '--ignore_unmapped']
-        run_command(prefix + args)
+        commands.append(args)
 
     if ice_shelf_cavities:
         print("\n Mapping files with masks for ice shelf cavities")
@@ -443,7 +1050,7 @@ def mapping(config, atm_scrip_tag):  # {{{
                     '--destination', atm_scrip_file,
                     '--weight', mapping_file,
                     '--ignore_unmapped']
-            run_command(prefix + args)
+            commands.append(args)
 
             # Atmosphere to ocean
             mapping_file = 'map_{}_TO_{}.mask_{}.{}.nc'.format(
@@ -454,8 +1061,9 @@ def mapping(config, atm_scrip_tag):  # {{{
                     '--destination', ocn_scrip_file,
                     '--weight', mapping_file,
                     '--ignore_unmapped']
-            run_command(prefix + args)
+            commands.append(args)
 
+    run_regrid_commands(config, commands)
 # }}}
 
 
@@ -597,7 +1205,6 @@ def salinity_restoring(config):  # {{{
         'salinity_restoring', 'grid_Levitus_1x1_scrip_file')
     salinity_restoring_input_file = config.get(
         'salinity_restoring', 'salinity_restoring_input_file')
-    nprocs = config.get('main', 'nprocs')
     if ice_shelf_cavities:
         nomaskStr = '.nomask'
     else:
@@ -612,14 +1219,6 @@ def salinity_restoring(config):  # {{{
                                                      date_string)
     make_link('../scrip/{}'.format(ocn_scrip_file), ocn_scrip_file)
 
-    if 'CONDA_PREFIX' not in os.environ:
-        raise ValueError('A COMPASS conda environment needs to be loaded.')
-    mpirun_path = '{}/bin/mpirun'.format(os.environ['CONDA_PREFIX'])
-    if os.path.exists(mpirun_path):
-        prefix = [mpirun_path, '-n', nprocs]
-    else:
-        prefix = list()
-
     # execute commands
     salinity_restoring_output_file = \
         'sss.PHC2_monthlyClimatology.{}.{}.nc'.format(mesh_name, date_string)
@@ -635,7 +1234,7 @@ def salinity_restoring(config):  # {{{
                 '--destination', ocn_scrip_file,
                 '--weight', map_Levitus_file,
                 '--ignore_unmapped']
-        run_command(prefix + args)
+        run_regrid_commands(config, [args])
 
     # remap from 1x1 to model grid
     args = ['ncremap',
@@ -685,13 +1284,16 @@ def prescribed_ismf(config):  # {{{
     out_filename = 'prescriped_ismf_rignot2013.{}.{}.nc'.format(
         mesh_name, date_string)
 
-    mpiTasks = config.getint('main', 'nprocs')
-
-    remap_rignot(inFileName=in_filename, meshFileName='../mesh.nc',
-                 meshName=mesh_name, outFileName=out_filename,
-                 mappingDirectory='.', method='conserve',
-                 renormalizationThreshold=None, inVarName='melt_actual',
-                 mpiTasks=mpiTasks)
+    with released_step_process():
+        with budget_processes(get_regrid_nprocs(config)) as mpiTasks:
+            remap_rignot(inFileName=in_filename, meshFileName='../mesh.nc',
+                         meshName=mesh_name, outFileName=out_filename,
+                         mappingDirectory='.', method='conserve',
+                         renormalizationThreshold=None,
+                         inVarName='melt_actual', mpiTasks=mpiTasks,
+                         weightCacheDirectory=config.get('main',
+                                                         'weight_cache'),
+                         meshDigest=get_mesh_digest())
 
     output_dir = '../assembled_files_for_upload/inputdata/ocn/mpas-o/{}'.format(
         mesh_name)
@@ -715,6 +1317,7 @@ def make_link(source, linkName):  # {{{
         os.symlink(source, linkName)
     except OSError:
         pass
+    step_links.append(os.path.abspath(linkName))
 # }}}
 
 
@@ -728,11 +1331,12 @@ def write_command_history(text):  # {{{
 # }}}
 
 
-def run_command(args):  # {{{
+def run_command(args, log_filename='log.out'):  # {{{
     try:
         write_command_history(' '.join(args))
-        with open('log.out', 'a') as outstream:
+        with open(log_filename, 'a') as outstream:
             outstream.write('Command: {}\n'.format(' '.join(args)))
+            outstream.flush()
             subprocess.check_call(args, stdout=outstream, stderr=outstream)
             outstream.write('\n')
     except OSError:
@@ -1017,9 +1621,13 @@ def make_analysis_lat_lon_map(config, mesh_name):
 
     remapper = Remapper(inDescriptor, outDescriptor, mappingFileName)
 
-    mpiTasks = config.getint('main', 'nprocs')
-    remapper.build_mapping_file(method='bilinear', mpiTasks=mpiTasks,
-                                tempdir='.')
+    key = get_weight_key(get_mesh_digest(), outGridName, ['bilinear'])
+    with cached_weights(config.get('main', 'weight_cache'), key,
+                        mappingFileName):
+        with released_step_process():
+            with budget_processes(get_regrid_nprocs(config)) as mpiTasks:
+                remapper.build_mapping_file(method='bilinear',
+                                            mpiTasks=mpiTasks, tempdir='.')
     # }}}
 
 
@@ -1050,16 +1658,20 @@ def make_analysis_polar_map(config, mesh_name, projection):
 
     remapper = Remapper(inDescriptor, outDescriptor, mappingFileName)
 
-    mpiTasks = config.getint('main', 'nprocs')
-    remapper.build_mapping_file(method='bilinear', mpiTasks=mpiTasks,
-                                tempdir='.')
+    key = get_weight_key(get_mesh_digest(), outGridName, ['bilinear'])
+    with cached_weights(config.get('main', 'weight_cache'), key,
+                        mappingFileName):
+        with released_step_process():
+            with budget_processes(get_regrid_nprocs(config)) as mpiTasks:
+                remapper.build_mapping_file(method='bilinear',
+                                            mpiTasks=mpiTasks, tempdir='.')
     # }}}
 
 
 def remap_rignot(inFileName, meshFileName, meshName, outFileName,
                  mappingDirectory='.', method='conserve',
                  renormalizationThreshold=None, inVarName='melt_actual',
-                 mpiTasks=1):
+                 mpiTasks=1, weightCacheDirectory=None, meshDigest=None):
     # {{{
 
     """
@@ -1102,6 +1714,16 @@ def remap_rignot(inFileName, meshFileName, meshName, outFileName,
 
     mpiTasks : int, optional
         The number of MPI tasks to use to compute the mapping file
+
+    weightCacheDirectory : str, optional
+        A directory of mapping files shared between runs, where the mapping
+        file is looked up before it is computed and stored after, or
+        ``None`` (or an empty string) for no cache
+
+    meshDigest : str, optional
+        A digest of the MPAS mesh used to look up the mapping file in the
+        cache, which only needs to change when the mesh coordinates do
+        (defaults to the digest of ``meshFileName``)
     """
 
     ds = xr.open_dataset(inFileName)
@@ -1133,7 +1755,14 @@ def remap_rignot(inFileName, meshFileName, meshName, outFileName,
 
     remapper = Remapper(inDescriptor, outDescriptor, mappingFileName)
 
-    remapper.build_mapping_file(method=method, mpiTasks=mpiTasks)
+    if meshDigest is None:
+        meshDigest = get_file_digest(meshFileName, step_digest_cache)
+    key = get_weight_key(
+        '{} {}'.format(inGridName, get_file_digest(inFileName,
+                                                   step_digest_cache)),
+        meshDigest, [method])
+    with cached_weights(weightCacheDirectory, key, mappingFileName):
+        remapper.build_mapping_file(method=method, mpiTasks=mpiTasks)
 
     dsRemap = remapper.remap(
         ds, renormalizationThreshold=renormalizationThreshold)
@@ -1277,14 +1906,8 @@ def append_mesh_metadata(config, filename):  # {{{
                 'MPAS_Mesh_Runoff_Description': config.get(
                     'mesh', 'runoff_description')}
 
-    packages = {'COMPASS': 'compass', 'JIGSAW': 'jigsaw',
-                'JIGSAW-Python': 'jigsawpy', 'MPAS-Tools': 'mpas_tools',
-                'NCO': 'nco', 'ESMF': 'esmf',
-                'geometric_features': 'geometric_features',
-                'Metis': 'metis', 'pyremap': 'pyremap'}
-
-    for name in packages:
-        package = packages[name]
+    for name in metadata_packages:
+        package = metadata_packages[name]
         attrdict['MPAS_Mesh_{}_Version'.format(name)] = \
             get_conda_package_version(package)
 
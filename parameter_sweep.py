@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+This script sets up a parameter sweep of a test case.
+
+A config file for each variant of the sweep is written from a template (as
+with utility_scripts/make_parameter_study_configs.py) into the directory of
+the test case in work_dir, and the test case is then set up with
+setup_testcase.py (with --config_dir pointing to the variants), with its
+cases set up concurrently in a pool of -j processes. The variants are
+cases of the test case, so they share a single copy of the inputs set up by
+its other cases (e.g. the mesh and initial condition), which they link to
+rather than each setting them up again.
+
+Parameter values are given as with make_parameter_study_configs.py, and
+--sampling selects whether variants take the values of all parameters in
+lock step (zip), every combination of them (cartesian), or --samples values
+from a Latin hypercube (lhs). The dummy string @variant in the template is
+replaced with the number of each variant, and should be part of its case
+name unless another parameter is unique to each variant.
+
+A manifest mapping the number of each variant to its config file, case name
+and parameter values is written (as JSON) to <prefix>_manifest.json next to
+the config files of the variants, for analysis of the sweep. Nothing is
+written to the repository.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import sys
+import os
+import argparse
+import subprocess
+
+sys.path.append('{}/utility_scripts'.format(
+    os.path.dirname(os.path.realpath(__file__))))
+from make_parameter_study_configs import make_parameter_study
+
+
+def main():  # {{{
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-o", "--core", dest="core", required=True,
+                        help="Core that contains configurations",
+                        metavar="CORE")
+    parser.add_argument("-c", "--configuration", dest="configuration",
+                        required=True,
+                        help="Configuration of the test case",
+                        metavar="CONFIG")
+    parser.add_argument("-r", "--resolution", dest="resolution",
+                        required=True,
+                        help="Resolution of the test case", metavar="RES")
+    parser.add_argument("-t", "--test", dest="test", required=True,
+                        help="Test name within a resolution", metavar="TEST")
+    parser.add_argument("--template", dest="template", required=True,
+                        help="Template of the config file of the variants, "
+                             "relative to the configuration directory if it "
+                             "isn't found", metavar="FILE")
+    parser.add_argument("-p", "--parameters", dest="parameters", nargs="+",
+                        required=True,
+                        help="Parameters and their values, e.g. "
+                             "GammaT=0.01,0.02 (or GammaT=0.01:0.1 for a "
+                             "range with --sampling lhs)",
+                        metavar="PARAMETERS")
+    parser.add_argument("--sampling", dest="sampling", default="cartesian",
+                        choices=['zip', 'cartesian', 'lhs'],
+                        help="How parameter values are combined into "
+                             "variants (default: cartesian)")
+    parser.add_argument("--samples", dest="samples", type=int,
+                        help="Number of variants with --sampling lhs",
+                        metavar="N")
+    parser.add_argument("--seed", dest="seed", type=int,
+                        help="Seed of the random numbers of --sampling lhs",
+                        metavar="SEED")
+    parser.add_argument("--prefix", dest="prefix", default="config_sweep",
+                        help="Prefix of the config files of the variants "
+                             "(default: config_sweep)", metavar="PREFIX")
+    parser.add_argument("-f", "--config_file", dest="config_file",
+                        help="Configuration file for test case setup",
+                        metavar="FILE")
+    parser.add_argument("-m", "--model_runtime", dest="model_runtime",
+                        help="Definition of how to build model run commands "
+                             "on this machine", metavar="FILE")
+    parser.add_argument("--work_dir", dest="work_dir",
+                        help="If set, the test case is set up in work_dir "
+                             "rather than the current directory.",
+                        metavar="PATH")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="Number of cases to set up concurrently",
+                        metavar="N")
+    parser.add_argument("--no_download", dest="no_download",
+                        help="If set, setup_testcase.py will not "
+                             "auto-download base_mesh files",
+                        action="store_true")
+    parser.add_argument("--no_setup", dest="no_setup",
+                        help="If set, only the config files and manifest of "
+                             "the variants are written (to be set up with "
+                             "setup_testcase.py --config_dir)",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    configuration_dir = '{}/{}/{}'.format(script_path, args.core,
+                                          args.configuration)
+    test_path = '{}/{}/{}/{}'.format(args.core, args.configuration,
+                                     args.resolution, args.test)
+    test_dir = '{}/{}'.format(script_path, test_path)
+    if not os.path.isdir(test_dir):
+        parser.error("Test case '{}' does not exist.".format(test_dir))
+
+    template = args.template
+    if not os.path.exists(template):
+        template = '{}/{}'.format(configuration_dir, args.template)
+    if not os.path.exists(template):
+        parser.error("Template '{}' does not exist.".format(args.template))
+
+    if not args.work_dir:
+        args.work_dir = os.getcwd()
+    args.work_dir = os.path.abspath(args.work_dir)
+
+    # The variants are kept in the test case directory in work_dir, not in
+    # the repository, where every later setup of the test case would pick
+    # them up
+    variant_dir = '{}/{}'.format(args.work_dir, test_path)
+    if not os.path.exists(variant_dir):
+        os.makedirs(variant_dir)
+
+    try:
+        manifest = make_parameter_study(
+            template, '{}/{}'.format(variant_dir, args.prefix),
+            args.parameters, args.sampling, args.samples, args.seed)
+    except ValueError as error:
+        print("ERROR: {}".format(error))
+        print("Exiting...")
+        sys.exit(1)
+    manifest_file = '{}/{}_manifest.json'.format(variant_dir, args.prefix)
+    print(" -- Wrote {} variants to {}".format(len(manifest['variants']),
+                                               manifest_file))
+
+    if args.no_setup:
+        return
+
+    command = ['{}/setup_testcase.py'.format(script_path),
+               '-o', args.core, '-c', args.configuration,
+               '-r', args.resolution, '-t', args.test,
+               '--work_dir', args.work_dir, '--config_dir', variant_dir,
+               '-j', str(args.jobs)]
+    if args.config_file:
+        command.extend(['-f', os.path.abspath(args.config_file)])
+    if args.model_runtime:
+        command.extend(['-m', os.path.abspath(args.model_runtime)])
+    if args.no_download:
+        command.append('--no_download')
+    try:
+        subprocess.check_call(command, cwd=script_path)
+    except subprocess.CalledProcessError:
+        print("ERROR: Setting up the variants failed.")
+        print("Exiting...")
+        sys.exit(1)
+# }}}
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
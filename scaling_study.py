@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+This script runs a strong or weak scaling study of a test case.
+
+For each layout (a number of procs and threads), the test case is set up in
+its own directory under work_dir with setup_testcase.py --procs and
+--threads, so parallel model runs use the layout and their mesh is
+partitioned for it, while namelists (and so the physics) are unchanged. The
+driver script of each layout is then run, one layout after the other, with
+the runtime definition given with -m.
+
+Finally, the timers of the scaled case (--case, forward by default) are
+collected from each layout, as compare_timers.py reads them, into tables of
+the time, speedup and parallel efficiency of each layout relative to the one
+with the fewest cores. The results are written to scaling_results.json in
+work_dir, along with a plot for each timer if matplotlib is available. The
+script fails if a timer isn't found in any layout.
+
+For a strong scaling study, one resolution is given with -r. For a weak
+scaling study (--weak), a comma-separated list of resolutions is given with
+-r, one for each number of procs, so the work per proc stays about the same.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import sys
+import os
+import time
+import json
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+
+sys.path.append('{}/utility_scripts'.format(
+    os.path.dirname(os.path.realpath(__file__))))
+from compare_timers import read_timers, get_timer_stats
+
+
+def get_layouts(resolutions, procs, threads, weak):  # {{{
+    # The layouts of the study, each with the resolution, procs and threads it
+    # runs with, and the name of its directory
+    layouts = list()
+    if weak:
+        pairs = list(zip(resolutions, procs))
+    else:
+        pairs = [(resolutions[0], proc_count) for proc_count in procs]
+    for resolution, proc_count in pairs:
+        for thread_count in threads:
+            name = 'procs{}_threads{}'.format(proc_count, thread_count)
+            if weak:
+                name = '{}_{}'.format(resolution, name)
+            layouts.append({'name': name, 'resolution': resolution,
+                            'procs': proc_count, 'threads': thread_count,
+                            'cores': proc_count * thread_count})
+    return layouts
+# }}}
+
+
+def get_driver_script(test_dir):  # {{{
+    # The name of the driver script of a test case, from the config file in
+    # its directory with a <driver_script> tag
+    for file_name in sorted(os.listdir(test_dir)):
+        if not file_name.endswith('.xml'):
+            continue
+        try:
+            root = ET.parse('{}/{}'.format(test_dir, file_name)).getroot()
+        except ET.ParseError:
+            continue
+        if root.tag == 'driver_script':
+            return root.attrib['name']
+    return None
+# }}}
+
+
+def setup_layout(layout, args, script_path):  # {{{
+    command = ['{}/setup_testcase.py'.format(script_path), '-q',
+               '-f', args.config_file, '-m', args.model_runtime,
+               '-o', args.core, '-c', args.configuration,
+               '-r', layout['resolution'], '-t', args.test,
+               '--work_dir', layout['work_dir'],
+               '--procs', str(layout['procs']),
+               '--threads', str(layout['threads'])]
+    if args.no_download:
+        command.append('--no_download')
+    print(" -- Setting up layout {}".format(layout['name']))
+    with open('{}/setup.log'.format(layout['work_dir']), 'w') as log:
+        subprocess.check_call(command, stdout=log, stderr=log,
+                              cwd=script_path)
+# }}}
+
+
+def run_layout(layout, driver_script):  # {{{
+    # Run the driver script of a layout, returning whether it passed
+    test_dir = layout['test_dir']
+    print(" -- Running layout {} ({} procs, {} threads)".format(
+        layout['name'], layout['procs'], layout['threads']))
+    start = time.time()
+    with open('{}/scaling_run.log'.format(layout['work_dir']), 'w') as log:
+        returncode = subprocess.call(['./{}'.format(driver_script)],
+                                     cwd=test_dir, stdout=log, stderr=log)
+    print("      {} in {:.1f} s".format('PASS' if returncode == 0 else 'FAIL',
+                                        time.time() - start))
+    return returncode == 0
+# }}}
+
+
+def collect_timers(layouts, case, timers):  # {{{
+    # The time of each timer in the scaled case of each layout (None if it
+    # wasn't found)
+    for layout in layouts:
+        run_dir = '{}/{}'.format(layout['test_dir'], case)
+        layout['times'] = dict()
+        ranks = list()
+        if os.path.isdir(run_dir):
+            ranks = read_timers(run_dir)
+        for timer_name in timers:
+            stats = get_timer_stats(ranks, timer_name)
+            if stats is None:
+                layout['times'][timer_name] = None
+            else:
+                layout['times'][timer_name] = stats['total']
+# }}}
+
+
+def get_scaling(layouts, timer_name, weak):  # {{{
+    # The speedup and parallel efficiency of each layout with a time for the
+    # timer, relative to the one with the fewest cores. For weak scaling, the
+    # speedup is scaled by the number of cores.
+    timed = [layout for layout in layouts
+             if layout['times'][timer_name] is not None and
+             layout['times'][timer_name] > 0.0]
+    if len(timed) == 0:
+        return list()
+    reference = min(timed, key=lambda layout: layout['cores'])
+    ref_time = reference['times'][timer_name]
+    rows = list()
+    for layout in sorted(timed, key=lambda layout: (layout['cores'],
+                                                   layout['procs'])):
+        layout_time = layout['times'][timer_name]
+        cores_ratio = layout['cores'] / reference['cores']
+        if weak:
+            efficiency = ref_time / layout_time
+            speedup = efficiency * cores_ratio
+        else:
+            speedup = ref_time / layout_time
+            efficiency = speedup / cores_ratio
+        rows.append({'layout': layout['name'], 'procs': layout['procs'],
+                     'threads': layout['threads'], 'cores': layout['cores'],
+                     'time': layout_time, 'speedup': speedup,
+                     'efficiency': efficiency})
+    return rows
+# }}}
+
+
+def print_scaling(timer_name, rows, weak):  # {{{
+    print('')
+    print('{} scaling of timer {}:'.format('Weak' if weak else 'Strong',
+                                           timer_name))
+    if len(rows) == 0:
+        print('   (not found in any layout)')
+        return
+    print('{:<32}  {:>6}  {:>7}  {:>6}  {:>12}  {:>8}  {:>10}'.format(
+        'layout', 'procs', 'threads', 'cores', 'time (s)', 'speedup',
+        'efficiency'))
+    for row in rows:
+        print('{:<32}  {:>6d}  {:>7d}  {:>6d}  {:>12.4f}  {:>8.3f}  '
+              '{:>9.1f}%'.format(row['layout'], row['procs'], row['threads'],
+                                 row['cores'], row['time'], row['speedup'],
+                                 100.0 * row['efficiency']))
+# }}}
+
+
+def plot_scaling(timer_name, rows, weak, work_dir):  # {{{
+    # Plot the speedup (or efficiency for weak scaling) against the number of
+    # cores, if matplotlib is available
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+
+    cores = [row['cores'] for row in rows]
+    fig = plt.figure()
+    if weak:
+        plt.semilogx(cores, [row['efficiency'] for row in rows], 'o-',
+                     label='efficiency')
+        plt.semilogx(cores, [1.0 for _ in cores], 'k--', label='ideal')
+        plt.ylabel('parallel efficiency')
+    else:
+        plt.loglog(cores, [row['speedup'] for row in rows], 'o-',
+                   label='speedup')
+        plt.loglog(cores, [core_count / cores[0] for core_count in cores],
+                   'k--', label='ideal')
+        plt.ylabel('speedup')
+    plt.xlabel('cores')
+    plt.title(timer_name)
+    plt.legend()
+    plot_file = '{}/scaling_{}.png'.format(work_dir,
+                                          timer_name.replace(' ', '_'))
+    fig.savefig(plot_file)
+    plt.close(fig)
+    return plot_file
+# }}}
+
+
+def main():  # {{{
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-o", "--core", dest="core", required=True,
+                        help="Core that contains configurations",
+                        metavar="CORE")
+    parser.add_argument("-c", "--configuration", dest="configuration",
+                        required=True,
+                        help="Configuration of the test case",
+                        metavar="CONFIG")
+    parser.add_argument("-r", "--resolution", dest="resolution",
+                        required=True,
+                        help="Resolution of the test case, or a "
+                             "comma-separated list of resolutions with "
+                             "--weak", metavar="RES")
+    parser.add_argument("-t", "--test", dest="test", required=True,
+                        help="Test name within a resolution", metavar="TEST")
+    parser.add_argument("-p", "--procs", dest="procs", type=int, nargs='+',
+                        required=True,
+                        help="Numbers of procs to run with", metavar="N")
+    parser.add_argument("--threads", dest="threads", type=int, nargs='+',
+                        default=[1],
+                        help="Numbers of threads to run with (default: 1)",
+                        metavar="N")
+    parser.add_argument("--weak", dest="weak", action="store_true",
+                        help="Run a weak scaling study, with a resolution "
+                             "for each number of procs")
+    parser.add_argument("-f", "--config_file", dest="config_file",
+                        help="Configuration file for test case setup",
+                        metavar="FILE")
+    parser.add_argument("-m", "--model_runtime", dest="model_runtime",
+                        help="Definition of how to build model run commands "
+                             "on this machine", metavar="FILE")
+    parser.add_argument("--work_dir", dest="work_dir",
+                        help="Directory to set up the layouts in (default: "
+                             "the current directory)", metavar="PATH")
+    parser.add_argument("--case", dest="case", default="forward",
+                        help="Case of the test whose timers are collected "
+                             "(default: forward)", metavar="CASE")
+    parser.add_argument("--timer", dest="timers", action="append",
+                        help="Timer to collect. Can be given more than once "
+                             "(default: 'total time' and 'time integration')",
+                        metavar="NAME")
+    parser.add_argument("--no_download", dest="no_download",
+                        help="If set, setup_testcase.py will not "
+                             "auto-download base_mesh files",
+                        action="store_true")
+    parser.add_argument("--skip_setup", dest="skip_setup",
+                        help="If set, layouts are not set up again",
+                        action="store_true")
+    parser.add_argument("--skip_run", dest="skip_run",
+                        help="If set, layouts are not run, and only the "
+                             "timers of earlier runs are collected",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    script_path = os.path.dirname(os.path.realpath(__file__))
+
+    if not args.config_file:
+        print("WARNING: No configuration file specified. Using the default "
+              "of 'local.config'")
+        args.config_file = 'local.config'
+    if not os.path.exists(args.config_file):
+        parser.error("Configuration file '{}' does not exist. Please create "
+                     "and setup before running again.".format(
+                         args.config_file))
+    args.config_file = os.path.abspath(args.config_file)
+
+    if not args.model_runtime:
+        args.model_runtime = '{}/runtime_definitions/mpirun.xml'.format(
+            script_path)
+    args.model_runtime = os.path.abspath(args.model_runtime)
+
+    if not args.work_dir:
+        args.work_dir = os.getcwd()
+    args.work_dir = os.path.abspath(args.work_dir)
+
+    if not args.timers:
+        args.timers = ['total time', 'time integration']
+
+    resolutions = args.resolution.split(',')
+    if args.weak and len(resolutions) != len(args.procs):
+        parser.error("With --weak, give one resolution for each number of "
+                     "procs.")
+    if not args.weak and len(resolutions) != 1:
+        parser.error("Give a single resolution, or use --weak.")
+
+    driver_scripts = dict()
+    for resolution in set(resolutions):
+        test_dir = '{}/{}/{}/{}/{}'.format(script_path, args.core,
+                                           args.configuration, resolution,
+                                           args.test)
+        if not os.path.isdir(test_dir):
+            parser.error("Test case '{}' does not exist.".format(test_dir))
+        driver_scripts[resolution] = get_driver_script(test_dir)
+        if driver_scripts[resolution] is None:
+            parser.error("Test case '{}' has no driver script to run.".format(
+                test_dir))
+
+    layouts = get_layouts(resolutions, args.procs, args.threads, args.weak)
+    for layout in layouts:
+        layout['work_dir'] = '{}/{}'.format(args.work_dir, layout['name'])
+        layout['test_dir'] = '{}/{}/{}/{}/{}'.format(
+            layout['work_dir'], args.core, args.configuration,
+            layout['resolution'], args.test)
+        if not os.path.exists(layout['work_dir']):
+            os.makedirs(layout['work_dir'])
+
+    if not args.skip_setup:
+        for layout in layouts:
+            try:
+                setup_layout(layout, args, script_path)
+            except subprocess.CalledProcessError:
+                print("ERROR: Setting up layout {} failed. See {}/setup.log "
+                      "for more information.".format(layout['name'],
+                                                     layout['work_dir']))
+                print("Exiting...")
+                sys.exit(1)
+
+    failed = list()
+    if not args.skip_run:
+        for layout in layouts:
+            if not run_layout(layout,
+                              driver_scripts[layout['resolution']]):
+                failed.append(layout['name'])
+
+    collect_timers(layouts, args.case, args.timers)
+
+    results = {'core': args.core, 'configuration': args.configuration,
+               'test': args.test, 'case': args.case, 'weak': args.weak,
+               'layouts': [dict([(key, layout[key]) for key in
+                                 ['name', 'resolution', 'procs', 'threads',
+                                  'cores', 'times']])
+                           for layout in layouts],
+               'scaling': dict()}
+    missing = list()
+    for timer_name in args.timers:
+        rows = get_scaling(layouts, timer_name, args.weak)
+        results['scaling'][timer_name] = rows
+        if len(rows) == 0:
+            missing.append(timer_name)
+        print_scaling(timer_name, rows, args.weak)
+        if len(rows) > 1:
+            plot_file = plot_scaling(timer_name, rows, args.weak,
+                                     args.work_dir)
+            if plot_file is not None:
+                print('   Plot: {}'.format(plot_file))
+
+    results_file = '{}/scaling_results.json'.format(args.work_dir)
+    with open(results_file, 'w') as out:
+        json.dump(results, out, indent=1)
+    print('')
+    print('Results written to {}'.format(results_file))
+
+    if len(failed) > 0:
+        print("ERROR: Layouts {} failed. See scaling_run.log in their "
+              "directories for more information.".format(', '.join(failed)))
+    if len(missing) > 0:
+        print("ERROR: Timers {} were not found in any layout."
+              .format(', '.join(["'{}'".format(timer_name)
+                                 for timer_name in missing])))
+    if len(failed) > 0 or len(missing) > 0:
+        print("Exiting...")
+        sys.exit(1)
+# }}}
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -27,20 +27,49 @@ import textwrap
 import netCDF4
 import shutil
 import errno
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import copy
+import traceback
+import hashlib
+import json
+import fcntl
+import socket
+from six.moves import http_client
+from six.moves.urllib.request import Request, urlopen
 
-try:
-    from collections import defaultdict
-except ImportError:
-    from utils import defaultdict
+from list_testcases import get_index, get_test_case
 
+sys.path.append('{}/utility_scripts'.format(
+    os.path.dirname(os.path.realpath(__file__))))
+from materialize_links import materialize_file
 
-# *** Namelist setup functions *** # {{{
-def generate_namelist_files(config_file, case_path, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+from collections import OrderedDict
+
+# Parsed template files, shared by all cases set up in this invocation. The
+# least recently used template is dropped once max_cached_templates have been
+# parsed.
+template_cache = OrderedDict()
+max_cached_templates = 128
+
+# The number of field lists written for each driver script, keyed by the path
+# to the script
+field_list_counts = dict()
+
+# Ingested namelist templates, keyed by path, that each case's namelists are
+# cloned from.
+namelist_cache = dict()
+
+# The errors that make a download from a mirror fail, after which the next
+# mirror is tried
+download_errors = (IOError, OSError, ValueError, http_client.HTTPException,
+                   socket.timeout)
 
+
+# *** Namelist setup functions *** # {{{
+def generate_namelist_files(case_config, case_path, configs):  # {{{
     # Iterate over all namelists to be generated
-    for namelists in config_root.iter('namelist'):
+    for namelists in case_config.root.iter('namelist'):
         # Determine the name of the namelist that will be generated
         try:
             namelist_file = '{}/{}'.format(case_path, namelists.attrib['name'])
@@ -59,73 +88,148 @@ def generate_namelist_files(config_file, case_path, configs):  # {{{
         if not configs.has_option("namelists", namelist_mode):
             print("Error. Configuration file '{}' requires paths for "
                   "streams and namelist files for '{}' mode.".format(
-                      config_file, namelist_mode))
+                      case_config.config_file, namelist_mode))
             print("Exiting...")
             sys.exit(1)
 
         template_namelist = configs.get("namelists", namelist_mode)
 
-        # Ingest namelist template into a dictionary
-        namelist_dict = defaultdict(lambda: defaultdict(list))
-        ingest_namelist(template_namelist, namelist_dict)
-
-        # Modify the dictionary to have the desired values
-        configure_namelist(namelist_dict, namelists, configs)
+        # Start from a copy of the ingested namelist template
+        namelist = get_namelist_template(template_namelist).copy()
 
-        # Write the namelist using the template to determine the writing order.
-        write_namelist(namelist_dict, namelist_file, template_namelist)
-        del namelist_dict
+        # Modify the namelist to have the desired values
+        configure_namelist(namelist, namelists, configs)
 
-    del config_root
-    del config_tree
+        # Write the namelist in the same order as the template.
+        namelist.write(namelist_file)
+        del namelist
 # }}}
 
 
-def ingest_namelist(namelist_file, namelist_dict):  # {{{
-    # Read the template file
-    namelistfile = open(namelist_file, 'r')
-    lines = namelistfile.readlines()
+class Namelist(object):  # {{{
+    # A namelist file, with its records and options kept in the order they
+    # were read in. Options are indexed by their name, so setting an option
+    # doesn't require searching the whole namelist. Copies share the ingested
+    # template and only store the options that were changed.
+    def __init__(self):
+        # The record and option lines of the template, in order
+        self.lines = list()
+        # The value of each (record, option) pair in the template
+        self.values = dict()
+        # The (record, option) pairs for each stripped option name
+        self.index = dict()
+        # Values set on this namelist, overriding those in the template
+        self.changes = dict()
+
+    def ingest(self, namelist_file):  # {{{
+        # Read the template file
+        namelistfile = open(namelist_file, 'r')
+        lines = namelistfile.readlines()
+        namelistfile.close()
+
+        record_name = 'NONE!!!'
+        records = set()
+
+        # Add each line into the corresponding record / option entry.
+        for line in lines:
+            if line.find('&') >= 0:
+                record_name = line.strip().strip('&').strip('\n')
+                # A record that appears again starts over with no options
+                if record_name in records:
+                    for key in list(self.values.keys()):
+                        if key[0] == record_name:
+                            del self.values[key]
+                records.add(record_name)
+                self.lines.append((line, record_name, None))
+            elif line.find('=') >= 0:
+                opt, val = line.strip().strip('\n').split('=')
+                if record_name != "NONE!!!":
+                    key = (record_name, opt)
+                    self.lines.append((line, record_name, opt))
+                    if key not in self.values:
+                        self.values[key] = val
+                        self.index.setdefault(opt.strip(), list()).append(key)
+    # }}}
+
+    def copy(self):  # {{{
+        # Make a namelist that shares this one's template, but not its changes
+        namelist = Namelist()
+        namelist.lines = self.lines
+        namelist.values = self.values
+        namelist.index = self.index
+        namelist.changes = dict(self.changes)
+        return namelist
+    # }}}
+
+    def set(self, option_name, option_val):  # {{{
+        # Set the value of the namelist option, in every record it appears in.
+        for key in self.index.get(option_name, list()):
+            if key in self.values:
+                self.changes[key] = option_val
+    # }}}
+
+    def get(self, record_name, opt):  # {{{
+        key = (record_name, opt)
+        if key in self.changes:
+            return self.changes[key]
+        return self.values[key]
+    # }}}
+
+    def write(self, outfilename):  # {{{
+        # Write the namelist out, in the order of the template.
+        out_namelist = open(outfilename, 'w+')
+
+        record_name = 'NONE!!!'
+
+        for line, record, opt in self.lines:
+            if opt is None:
+                if record_name != "NONE!!!":
+                    out_namelist.write('/\n')
+
+                record_name = record
+                out_namelist.write(line)
+            else:
+                out_namelist.write('    {} = {}\n'.format(
+                        opt.strip(), self.get(record_name, opt).strip()))
 
-    record_name = 'NONE!!!'
+        if record_name != "NONE!!!":
+            out_namelist.write('/\n')
 
-    # Add each linke into the corresponding record / option entry in the
-    # dictionary.
-    for line in lines:
-        if line.find('&') >= 0:
-            record_name = line.strip().strip('&').strip('\n')
-            namelist_dict[record_name] = defaultdict(list)
-        elif line.find('=') >= 0:
-            opt, val = line.strip().strip('\n').split('=')
-            if record_name != "NONE!!!":
-                namelist_dict[record_name][opt].append(val)
+        out_namelist.close()
+    # }}}
 # }}}
 
 
-def set_namelist_val(namelist_dict, option_name, option_val):  # {{{
-    # Set the value of the namelist option.
-    for record, opts in namelist_dict.items():
-        for opt, val in opts.items():
-            if opt.strip() == option_name:
-                val[0] = option_val
+def get_namelist_template(template_namelist):  # {{{
+    # Return the ingested namelist template, reading the file only the first
+    # time it is used. The result should be copied before it is modified.
+    key = os.path.abspath(template_namelist)
+
+    if key not in namelist_cache:
+        namelist = Namelist()
+        namelist.ingest(template_namelist)
+        namelist_cache[key] = namelist
+
+    return namelist_cache[key]
 # }}}
 
 
-def configure_namelist(namelist_dict, namelist_tag, configs):  # {{{
+def configure_namelist(namelist, namelist_tag, configs):  # {{{
     # Iterate over all children within the namelist tag.
     for child in namelist_tag:
         # Process <option> tags
         if child.tag == 'option':
             option_name = child.attrib['name']
             option_val = child.text
-            set_namelist_val(namelist_dict, option_name, option_val)
+            namelist.set(option_name, option_val)
         # Process <template> tags
         elif child.tag == 'template':
-            apply_namelist_template(namelist_dict, child, configs)
+            apply_namelist_template(namelist, child, configs)
 
 # }}}
 
 
-def apply_namelist_template(namelist_dict, template_tag, configs):  # {{{
+def apply_namelist_template(namelist, template_tag, configs):  # {{{
     # Determine the template information, like it's path and the filename
     template_info = get_template_info(template_tag, configs)
 
@@ -133,9 +237,8 @@ def apply_namelist_template(namelist_dict, template_tag, configs):  # {{{
     template_file = '{}/{}'.format(template_info['template_path'],
                                    template_info['template_file'])
 
-    # Parse the template
-    template_tree = ET.parse(template_file)
-    template_root = template_tree.getroot()
+    # Get the parsed template
+    template_root = parse_template(template_file)
 
     # Apply the template, by changing each option
     for child in template_root:
@@ -144,57 +247,20 @@ def apply_namelist_template(namelist_dict, template_tag, configs):  # {{{
                 if grandchild.tag == 'option':
                     option_name = grandchild.attrib['name']
                     option_val = grandchild.text
-                    set_namelist_val(namelist_dict, option_name, option_val)
+                    namelist.set(option_name, option_val)
                 elif grandchild.tag == 'template':
-                    apply_namelist_template(namelist_dict, grandchild, configs)
+                    apply_namelist_template(namelist, grandchild, configs)
 
-    del template_root
-    del template_tree
     del template_info
 # }}}
-
-
-def write_namelist(namelist_dict, outfilename, infilename):  # {{{
-    # Write the namelist out, using the infilename as a template to determine
-    # the writing order.
-    in_namelist = open(infilename, 'r')
-    lines = in_namelist.readlines()
-    in_namelist.close()
-
-    out_namelist = open(outfilename, 'w+')
-
-    record_name = 'NONE!!!'
-
-    for line in lines:
-        if line.find('&') >= 0:
-            if record_name != "NONE!!!":
-                out_namelist.write('/\n')
-
-            record_name = line.strip().strip('&').strip('\n')
-            out_namelist.write(line)
-        elif line.find('=') >= 0:
-            opt, val = line.strip().strip('\n').split('=')
-            if record_name != "NONE!!!":
-                out_namelist.write('    {} = {}\n'.format(
-                        opt.strip(),
-                        namelist_dict[record_name][opt][0].strip()))
-
-    if record_name != "NONE!!!":
-        out_namelist.write('/\n')
-
-    out_namelist.close()
-# }}}
 # }}}
 
 
 # *** Streams setup functions *** # {{{
 
-def generate_streams_files(config_file, case_path, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
-
+def generate_streams_files(case_config, case_path, configs):  # {{{
     # Iterate over all sterams files to be generated
-    for streams in config_root:
+    for streams in case_config.root:
         if streams.tag == "streams":
             # Determine the path to the template streams file
             streams_filename = '{}/{}'.format(case_path,
@@ -210,26 +276,24 @@ def generate_streams_files(config_file, case_path, configs):  # {{{
             if not configs.has_option("streams", streams_mode):
                 print("Error. Configuration file '{}' requires paths for "
                       "streams and namelist files for '{}' mode.".format(
-                          config_file, streams_mode))
+                          case_config.config_file, streams_mode))
                 print("Exiting...")
                 sys.exit(1)
 
             template_streams = configs.get("streams", streams_mode)
 
-            # Parse the template
-            streams_tree = ET.parse(template_streams)
-            streams_root = streams_tree.getroot()
+            # Copy the parsed template, since it gets modified below
+            streams_root = copy.deepcopy(parse_template(template_streams))
 
             # Configure the new streams file, using the template as a starting
             # place.
             configure_streams_file(streams_root, streams, configs)
 
             # Write out the streams file
-            write_streams_file(streams_root, config_file, streams_filename,
+            write_streams_file(streams_root, case_config, streams_filename,
                                '{}'.format(case_path))
 
             del streams_root
-            del streams_tree
 # }}}
 
 
@@ -338,9 +402,8 @@ def apply_stream_template(streams_file, template_tag, configs):  # {{{
     template_file = '{}/{}'.format(template_info['template_path'],
                                    template_info['template_file'])
 
-    # Parse the template
-    template_tree = ET.parse(template_file)
-    template_root = template_tree.getroot()
+    # Get the parsed template
+    template_root = parse_template(template_file)
 
     # Apply the streams portion of the template to the streams file
     for child in template_root:
@@ -351,16 +414,11 @@ def apply_stream_template(streams_file, template_tag, configs):  # {{{
                 elif grandchild.tag == 'template':
                     apply_stream_template(streams_file, grandchild, configs)
 
-    del template_tree
-    del template_root
     del template_info
 # }}}
 
 
-def write_streams_file(streams, config_file, filename, init_path):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
-
+def write_streams_file(streams, case_config, filename, init_path):  # {{{
     stream_file = open(filename, 'w')
 
     stream_file.write('<streams>\n')
@@ -443,20 +501,16 @@ def write_streams_file(streams, config_file, filename, init_path):  # {{{
 
     stream_file.write('\n')
     stream_file.write('</streams>\n')
-
-    del config_tree
-    del config_root
+    stream_file.close()
 # }}}
 # }}}
 
 
 # *** Script Generation Functions *** # {{{
-def generate_run_scripts(config_file, init_path, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+def generate_run_scripts(case_config, init_path, configs):  # {{{
     dev_null = open('/dev/null', 'r+')
 
-    for run_script in config_root:
+    for run_script in case_config.root:
         # Process run_script
         if run_script.tag == 'run_script':
             # Determine the name of the script, and create the file
@@ -474,10 +528,14 @@ def generate_run_scripts(config_file, init_path, configs):  # {{{
             script.write('import os\n')
             script.write('import shutil\n')
             script.write('import glob\n')
-            script.write("import subprocess\n\n\n")
+            script.write("import subprocess\n")
+            write_step_runner_import(script, configs)
+            script.write("\n\n")
             script.write("dev_null = open('/dev/null', 'w')\n")
+            write_step_runner_setup(script, configs)
 
             # Process each part of the run script
+            run_script = apply_layout(run_script, configs)
             for child in run_script:
                 # Process each <step> tag
                 if child.tag == 'step':
@@ -496,19 +554,48 @@ def generate_run_scripts(config_file, init_path, configs):  # {{{
                                   stdout=dev_null, stderr=dev_null)
 
     dev_null.close()
-    del config_tree
-    del config_root
 # }}}
 
 
-def generate_driver_scripts(config_file, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+def apply_layout(run_script, configs):  # {{{
+    # With --procs or --threads, return a copy of a <run_script> tag where
+    # parallel model runs (those with more than one proc) use the given
+    # layout, along with the gpmetis steps that partition the mesh for them
+    procs = configs.get('script_input_arguments', 'procs')
+    threads = configs.get('script_input_arguments', 'threads')
+    if procs == 'NONE' and threads == 'NONE':
+        return run_script
+
+    run_script = copy.deepcopy(run_script)
+    old_procs = list()
+    for child in run_script:
+        if child.tag == 'model_run' and \
+                child.attrib.get('procs', '1') != '1':
+            old_procs.append(child.attrib['procs'])
+            if procs != 'NONE':
+                child.attrib['procs'] = procs
+            if threads != 'NONE':
+                child.attrib['threads'] = threads
+
+    if procs != 'NONE':
+        for child in run_script:
+            if child.tag == 'step' and \
+                    child.attrib.get('executable') == 'gpmetis':
+                for argument in child:
+                    if argument.tag == 'argument' and \
+                            argument.text in old_procs:
+                        argument.text = procs
+    return run_script
+# }}}
+
+
+def generate_driver_scripts(case_config, configs):  # {{{
+    config_root = case_config.root
     dev_null = open('/dev/null', 'r+')
 
     # init_path is where the driver script will live after it's generated.
-    init_path = '{}/{}'.format(config.get('script_paths', 'work_dir'),
-                               config.get('script_paths', 'config_path'))
+    init_path = '{}/{}'.format(configs.get('script_paths', 'work_dir'),
+                               configs.get('script_paths', 'config_path'))
 
     # Ensure we're in a <driver_script> tag
     if config_root.tag == 'driver_script':
@@ -522,6 +609,7 @@ def generate_driver_scripts(config_file, configs):  # {{{
 
         # Create script file
         script = open('{}/{}'.format(init_path, name), 'w')
+        field_list_counts[script.name] = 0
 
         # Write script header
         script.write('#!/usr/bin/env python\n')
@@ -535,6 +623,7 @@ def generate_driver_scripts(config_file, configs):  # {{{
         script.write('import glob\n')
         script.write('import subprocess\n')
         script.write('import argparse\n')
+        write_step_runner_import(script, configs)
         script.write('\n\n')
         script.write('# This script was generated by setup_testcases.py as '
                      'part of a driver_script\n'
@@ -577,6 +666,7 @@ def generate_driver_scripts(config_file, configs):  # {{{
         script.write('args = parser.parse_args()\n')
         script.write('base_path = os.getcwd()\n')
         script.write("dev_null = open('/dev/null', 'w')\n")
+        write_step_runner_setup(script, configs)
         script.write('error = False\n')
         script.write('\n')
 
@@ -619,16 +709,14 @@ def generate_driver_scripts(config_file, configs):  # {{{
         script.write('    sys.exit(1)\n')
 
         for case_name in case_dict.keys():
+            # Replace symlinks with the files they point to, using reflinks
+            # or hard links instead of copies where possible.
             script.write('if args.finalize_{}:\n'.format(case_name))
-            script.write('    old_dir = os.getcwd()\n')
-            script.write('    os.chdir("{}")\n'.format(case_name))
-            script.write('    file_list = glob.glob("*")\n')
-            script.write('    for file in file_list:\n')
-            script.write('        if os.path.islink(file):\n')
-            script.write('            link_path = os.readlink(file)\n')
-            script.write('            os.unlink(file)\n')
-            script.write('            shutil.copyfile(link_path, file)\n')
-            script.write('    os.chdir(old_dir)\n')
+            script.write('    subprocess.check_call(\n'
+                         '        ["{}/materialize_links.py",\n'
+                         '         os.path.join(base_path, "{}")])\n'.format(
+                             configs.get('script_paths', 'utility_scripts'),
+                             case_name))
             script.write('\n')
 
         script.write('sys.exit(0)\n')
@@ -752,6 +840,8 @@ def process_validation_step(validation_tag, configs, script):  # {{{
 
 # *** Field Comparison Functions *** ##{{{
 def process_compare_fields_step(compare_tag, configs, script):  # {{{
+    # All fields of a <compare_fields> tag, including those from templates,
+    # are compared with a single call to compare_fields.py per pair of files.
     missing_file1 = False
     missing_file2 = False
     # Determine comparison attributes
@@ -777,119 +867,102 @@ def process_compare_fields_step(compare_tag, configs, script):  # {{{
         baseline_root = '{}/{}'.format(baseline_root,
                                        configs.get('script_paths', 'test_dir'))
 
+    fields = get_compare_fields(compare_tag, configs)
+    if len(fields) == 0:
+        return
+
+    if not (missing_file1 or missing_file2):
+        process_field_list(fields, configs, script, file1, file2, False)
+
+    if not missing_file1 and baseline_root != 'NONE':
+        process_field_list(fields, configs, script, file1,
+                           '{}/{}'.format(baseline_root, file1), True)
+
+    if not missing_file2 and baseline_root != 'NONE':
+        process_field_list(fields, configs, script, file2,
+                           '{}/{}'.format(baseline_root, file2), True)
+# }}}
+
+
+def get_compare_fields(compare_tag, configs):  # {{{
+    # Return the <field> tags of a <compare_fields> tag, in order, including
+    # those of any templates it applies
+    fields = list()
     for child in compare_tag:
         # Process field comparisons
         if child.tag == 'field':
-            if not (missing_file1 or missing_file2):
-                process_field_definition(child, configs, script, file1, file2,
-                                         False)
-
-            if not missing_file1 and baseline_root != 'NONE':
-                process_field_definition(child, configs, script, file1,
-                                         '{}/{}'.format(baseline_root, file1),
-                                         True)
-
-            if not missing_file2 and baseline_root != 'NONE':
-                process_field_definition(child, configs, script, file2,
-                                         '{}/{}'.format(baseline_root, file2),
-                                         True)
+            fields.append(child)
         # Process field comparison template
         elif child.tag == 'template':
-            apply_compare_fields_template(child, compare_tag, configs, script)
+            fields.extend(get_compare_fields_template(child, configs))
+    return fields
 # }}}
 
 
-def apply_compare_fields_template(template_tag, compare_tag, configs, script):
-    # {{{
-    missing_file1 = False
-    missing_file2 = False
-    # Determine comparison attributes
-    try:
-        file1 = compare_tag.attrib['file1']
-    except KeyError:
-        missing_file1 = True
-
-    try:
-        file2 = compare_tag.attrib['file2']
-    except KeyError:
-        missing_file2 = True
-
-    if missing_file1 and missing_file2:
-        print("ERROR: <compare_fields> tag is missing both 'file1' and "
-              "'file2' tags. At least one is required.")
-        print("Exiting...")
-        sys.exit(1)
-
-    # Build the path to the baselines
-    baseline_root = configs.get('script_paths', 'baseline_dir')
-    if baseline_root != 'NONE':
-        baseline_root = '{}/{}'.format(baseline_root,
-                                       configs.get('script_paths', 'test_dir'))
-
+def get_compare_fields_template(template_tag, configs):  # {{{
     # Determine template information, like path and filename
     template_info = get_template_info(template_tag, configs)
 
     template_file = '{}/{}'.format(template_info['template_path'],
                                    template_info['template_file'])
 
-    # Parse the template
-    template_tree = ET.parse(template_file)
-    template_root = template_tree.getroot()
+    # Get the parsed template
+    template_root = parse_template(template_file)
 
-    # Find a child tag that is validation->compare_fields->field, and add each
-    # field
+    # Find each child tag that is validation->compare_fields, and add its
+    # fields
+    fields = list()
     for validation in template_root:
         if validation.tag == 'validation':
             for compare_fields in validation:
                 if compare_fields.tag == 'compare_fields':
-                    for field in compare_fields:
-                        if field.tag == 'field':
-                            if not (missing_file1 or missing_file2):
-                                process_field_definition(field, configs,
-                                                         script, file1, file2,
-                                                         False)
-
-                            if not missing_file1 and baseline_root != 'NONE':
-                                process_field_definition(
-                                    field, configs, script, file1,
-                                    '{}/{}'.format(baseline_root, file1), True)
-
-                            if not missing_file2 and baseline_root != 'NONE':
-                                process_field_definition(
-                                    field, configs, script, file2,
-                                    '{}/{}'.format(baseline_root, file2), True)
-                        elif field.tag == 'template':
-                            apply_compare_fields_template(field, compare_tag,
-                                                          configs, script)
-
-    del template_root
-    del template_tree
-    del template_info
+                    fields.extend(get_compare_fields(compare_fields, configs))
+
+    return fields
 # }}}
 
 
-def process_field_definition(field_tag, configs, script, file1, file2,
-                             baseline_comp):  # {{{
+def process_field_list(fields, configs, script, file1, file2,
+                       baseline_comp):  # {{{
     # Build the path to the comparison script.
     compare_executable = '{}/compare_fields.py'.format(
         configs.get('script_paths', 'utility_scripts'))
 
-    field_name = field_tag.attrib['name']
-
-    # Build the base command to compare the fields
-    command_args = [compare_executable, '-q', '-1', file1, '-2', file2, '-v',
-                    field_name]
-
-    # Determine norm thresholds
+    # Write the fields and their norm thresholds to a file next to the driver
+    # script, which compare_fields.py reads with --fields
+    field_list_counts[script.name] = field_list_counts.get(script.name, 0) + 1
+    field_list_name = '{}_fields{}.txt'.format(
+        os.path.splitext(script.name)[0], field_list_counts[script.name])
+
+    field_list = open(field_list_name, 'w')
+    field_list.write('# Fields compared between {} and {}\n'.format(file1,
+                                                                    file2))
+    for field_tag in fields:
+        field_name = field_tag.attrib['name']
+
+        # Determine norm thresholds
+        thresholds = list()
+        if baseline_comp:
+            thresholds = ['l1_norm=0.0', 'l2_norm=0.0', 'linf_norm=0.0']
+        else:
+            for norm in ['l1_norm', 'l2_norm', 'linf_norm']:
+                if norm in field_tag.attrib.keys():
+                    thresholds.append('{}={}'.format(
+                        norm, field_tag.attrib[norm]))
+
+        field_list.write('{}\n'.format(' '.join([field_name] + thresholds)))
+    field_list.close()
+
+    # Build the command to compare the fields, which prints whether the
+    # comparison of each field passed. Like the files, the field list is
+    # relative to the directory of the driver script.
+    command_args = [compare_executable, '-q', '--summary', '-1', file1, '-2',
+                    file2, '--fields', os.path.basename(field_list_name)]
+
+    # Baseline comparisons require bit-for-bit results, so compare digests
+    # first (or those of a sidecar written by make_baseline_digests.py)
     if baseline_comp:
-        command_args.extend(['--l1', '0.0', '--l2', '0.0', '--linf', '0.0'])
-    else:
-        if 'l1_norm' in field_tag.attrib.keys():
-            command_args.extend(['--l1', field_tag.attrib['l1_norm']])
-        if 'l2_norm' in field_tag.attrib.keys():
-            command_args.extend(['--l2', field_tag.attrib['l2_norm']])
-        if 'linf_norm' in field_tag.attrib.keys():
-            command_args.extend(['--linf', field_tag.attrib['linf_norm']])
+        command_args.append('--bitwise')
 
     command = wrap_subprocess_command(command_args, indentation='    ',
                                       quiet=False)
@@ -897,11 +970,7 @@ def process_field_definition(field_tag, configs, script, file1, file2,
     # Write the pass/fail logic.
     script.write('try:\n')
     script.write('{}\n'.format(command))
-    script.write("    print(' ** PASS Comparison of {} between {} and\\n'\n"
-                 "          '    {}')\n".format(field_name, file1, file2))
     script.write('except subprocess.CalledProcessError:\n')
-    script.write("    print(' ** FAIL Comparison of {} between {} and\\n'\n"
-                 "          '    {}')\n".format(field_name, file1, file2))
     script.write('    error = True\n')
 # }}}
 # }}}
@@ -909,8 +978,8 @@ def process_field_definition(field_tag, configs, script, file1, file2,
 
 # *** Timer Comparison Functions *** # {{{
 def process_compare_timers_step(compare_tag, configs, script):  # {{{
-    baseline_root = configs.get('script_paths', 'baseline_dir')
-    baseline_root = '{}/{}'.format(baseline_root,
+    baseline_dir = configs.get('script_paths', 'baseline_dir')
+    baseline_root = '{}/{}'.format(baseline_dir,
                                    configs.get('script_paths', 'test_dir'))
 
     missing_rundir1 = True
@@ -928,119 +997,108 @@ def process_compare_timers_step(compare_tag, configs, script):  # {{{
     except KeyError:
         missing_rundir2 = True
 
-    for child in compare_tag:
-        if child.tag == 'timer':
-            if not (missing_rundir1 or missing_rundir2):
-                process_timer_definition(child, configs, script, rundir1,
-                                         rundir2)
-
-            if not missing_rundir1:
-                process_timer_definition(
-                    child, configs, script,
-                    '{}/{}'.format(baseline_root, rundir1), rundir1)
-
-            if not missing_rundir2:
-                process_timer_definition(
-                    child, configs, script,
-                    '{}/{}'.format(baseline_root, rundir2), rundir2)
-        elif child.tag == 'template':
-            apply_compare_timers_template(child, compare_tag, configs, script)
+    # Pairs of base and comparison directories, where baselines are the base
+    # that runs are compared with
+    pairs = list()
+    if not (missing_rundir1 or missing_rundir2):
+        pairs.append((rundir1, rundir2))
 
-# }}}
+    if not missing_rundir1 and baseline_dir != 'NONE':
+        pairs.append(('{}/{}'.format(baseline_root, rundir1), rundir1))
 
+    if not missing_rundir2 and baseline_dir != 'NONE':
+        pairs.append(('{}/{}'.format(baseline_root, rundir2), rundir2))
 
-def apply_compare_timers_template(template_tag, compare_tag, configs, script):
-    # {{{
-    # Build the path to the baselines
-    baseline_root = configs.get('script_paths', 'baseline_dir')
-    baseline_root = '{}/{}'.format(baseline_root, configs.get('script_paths',
-                                                              'test_dir'))
+    timers = get_compare_timers(compare_tag, configs)
+    if len(timers) == 0 or len(pairs) == 0:
+        return
 
-    missing_rundir1 = True
-    missing_rundir2 = True
+    rundirs = [compare_tag.attrib[rundir] for rundir in ['rundir1', 'rundir2']
+               if rundir in compare_tag.attrib]
+    process_timer_list(timers, configs, script, ' and '.join(rundirs), pairs,
+                       compare_tag)
+# }}}
 
-    try:
-        rundir1 = compare_tag.attrib['rundir1']
-        missing_rundir1 = False
-    except KeyError:
-        missing_rundir1 = True
 
-    try:
-        rundir2 = compare_tag.attrib['rundir2']
-        missing_rundir2 = False
-    except KeyError:
-        missing_rundir2 = True
+def get_compare_timers(compare_tag, configs):  # {{{
+    # Return the names of the timers of a <compare_timers> tag, in order,
+    # including those of any templates it applies
+    timers = list()
+    for child in compare_tag:
+        if child.tag == 'timer':
+            try:
+                timers.append(child.attrib['name'])
+            except KeyError:
+                print("ERROR: <timer> tag is missing the 'name' attribute.")
+                print("Exiting...")
+                sys.exit(1)
+        elif child.tag == 'template':
+            timers.extend(get_compare_timers_template(child, configs))
+    return timers
+# }}}
 
+
+def get_compare_timers_template(template_tag, configs):  # {{{
     # Get the template information and build the template file
     template_info = get_template_info(template_tag, configs)
     template_file = '{}/{}'.format(template_info['template_path'],
                                    template_info['template_file'])
 
-    # Parse template file
-    template_tree = ET.parse(template_file)
-    template_root = template_tree.getroot()
+    # Get the parsed template
+    template_root = parse_template(template_file)
 
+    # Find each child tag that is validation->compare_timers, and add its
+    # timers
+    timers = list()
     for validation in template_root:
         if validation.tag == 'validation':
             for compare_timers in validation:
                 if compare_timers.tag == 'compare_timers':
-                    for timer in compare_timers:
-                        if timer.tag == 'timer':
-                            if not (missing_rundir1 or missing_rundir2):
-                                process_timer_definition(
-                                    timer, configs, script, rundir1, rundir2)
-
-                            if not missing_rundir1:
-                                process_timer_definition(
-                                    timer, configs, script,
-                                    '{}/{}'.format(baseline_root, rundir1),
-                                    rundir1)
-
-                            if not missing_rundir2:
-                                process_timer_definition(
-                                    timer, configs, script,
-                                    '{}/{}'.format(baseline_root, rundir2),
-                                    rundir2)
-                        elif timer.tag == 'template':
-                            apply_compare_timers_template(timer, compare_tag,
-                                                          configs, script)
-    del template_root
-    del template_tree
-    del template_info
+                    timers.extend(get_compare_timers(compare_timers, configs))
 
+    return timers
 # }}}
 
 
-def process_timer_definition(timer_tag, configs, script, basedir, compdir):
-    # {{{
+def process_timer_list(timers, configs, script, rundirs, pairs,
+                       compare_tag):  # {{{
     compare_script = '{}/compare_timers.py'.format(
         configs.get('script_paths', 'utility_scripts'))
 
-    try:
-        timer_name = timer_tag.attrib['name']
-    except KeyError:
-        print("ERROR: <timer> tag is missing the 'name' attribute.")
-        print("Exiting...")
-        sys.exit(1)
+    # Compare all timers between all pairs of directories in one call, which
+    # skips pairs that weren't run (e.g. without baselines), but fails if a
+    # timer is missing from a run
+    command_args = [compare_script, '--skip_missing']
+    for basedir, compdir in pairs:
+        command_args.extend(['-b', basedir, '-c', compdir])
+    for timer_name in timers:
+        command_args.extend(['-t', timer_name])
+
+    # Fail if timers are significantly slower than in the base runs
+    for attribute in ['max_slowdown', 'confidence']:
+        if attribute in compare_tag.attrib:
+            try:
+                float(compare_tag.attrib[attribute])
+            except ValueError:
+                print("ERROR: The '{}' attribute of a <compare_timers> tag "
+                      "must be a number.".format(attribute))
+                print("Exiting...")
+                sys.exit(1)
+            command_args.extend(['--{}'.format(attribute),
+                                 compare_tag.attrib[attribute]])
 
-    command = 'subprocess.check_call(["{}", "-b", "{}", "-c", "{}", "-t", ' \
-              '"{}"])'.format(compare_script, compdir, basedir, timer_name)
+    command = wrap_subprocess_command(command_args, indentation='    ',
+                                      quiet=False)
 
     script.write('\n')
-    script.write('if os.path.exists("{}") and \\\n'
-                 '        os.path.exists("{}"):\n'.format(compdir, basedir))
-    script.write('    try:\n')
-    script.write('        {}\n'.format(command))
-    script.write("        print(' ** PASS Comparison of timer {} between {} "
-                 "and\\n'\n"
-                 "              '    {}')\n".format(timer_name, compdir,
-                                                    basedir))
-    script.write('    except subprocess.CalledProcessError:\n')
-    script.write("        print(' ** FAIL Comparison of timer {} between {} "
-                 "and\\n'\n"
-                 "              '    {}')\n".format(timer_name, compdir,
-                                                    basedir))
-    script.write("        error = True\n")
+    script.write('try:\n')
+    script.write('{}\n'.format(command))
+    script.write("    print(' ** PASS Comparison of timers in {}')\n".format(
+        rundirs))
+    script.write('except subprocess.CalledProcessError:\n')
+    script.write("    print(' ** FAIL Comparison of timers in {}')\n".format(
+        rundirs))
+    script.write("    error = True\n")
 # }}}
 # }}}
 
@@ -1048,8 +1106,8 @@ def process_timer_definition(timer_tag, configs, script, basedir, compdir):
 def process_model_run_step(model_run_tag, configs, script):  # {{{
     run_definition_file = configs.get('script_input_arguments',
                                       'model_runtime')
-    run_config_tree = ET.parse(run_definition_file)
-    run_config_root = run_config_tree.getroot()
+    # Copy the parsed run definition, since its steps get modified below
+    run_config_root = copy.deepcopy(parse_template(run_definition_file))
 
     dev_null = open('/dev/null', 'r+')
 
@@ -1075,18 +1133,18 @@ def process_model_run_step(model_run_tag, configs, script):  # {{{
                     arg_text = grandchild.text
 
                     if arg_text == 'model':
-                        executable_full_path = config.get('executables',
-                                                          executable_name)
+                        executable_full_path = configs.get('executables',
+                                                           executable_name)
                         executable_parts = executable_full_path.split('/')
                         executable_link = \
                             executable_parts[len(executable_parts) - 1]
                         link_path = '{}/{}/{}'.format(
-                            config.get('script_paths', 'work_dir'),
-                            config.get('script_paths', 'case_dir'),
+                            configs.get('script_paths', 'work_dir'),
+                            configs.get('script_paths', 'case_dir'),
                             executable_link)
                         subprocess.check_call(
                             ['ln', '-sf',
-                             config.get('executables', executable_name),
+                             configs.get('executables', executable_name),
                              link_path],
                             stdout=dev_null, stderr=dev_null)
                         grandchild.text = './{}'.format(executable_link)
@@ -1145,7 +1203,10 @@ def wrap_subprocess_command(command_args, indentation, quiet):  # {{{
     else:
         redirect = ""
 
-    prefix = "{}subprocess.check_call(".format(indentation)
+    # Lines are only broken between arguments, so spaces within arguments
+    # (e.g. in timer names) are swapped for non-breaking ones while wrapping
+    command_args = [arg.replace(' ', '\xa0') for arg in command_args]
+    prefix = "{}runner.check_call(".format(indentation)
     command = textwrap.wrap("'{}'".format("', '".join(command_args)), width=79,
                             initial_indent="{}[".format(prefix),
                             subsequent_indent=' ' * (len(prefix)+1),
@@ -1156,16 +1217,294 @@ def wrap_subprocess_command(command_args, indentation, quiet):  # {{{
             "{}]{})".format(last_line, redirect),
             width=80, subsequent_indent=' ' * (len(prefix)),
             break_on_hyphens=False, break_long_words=False))
-    command = '\n'.join(command)
+    command = '\n'.join(command).replace('\xa0', ' ')
     return command
 # }}}
+
+
+def write_step_runner_import(script, configs):  # {{{
+    # Generated scripts run their steps through a StepRunner from
+    # utility_scripts/step_runner.py, which reports the time of each step.
+    script.write("sys.path.append('{}')\n".format(
+        configs.get('script_paths', 'utility_scripts')))
+    script.write('from step_runner import StepRunner\n')
+# }}}
+
+
+def write_step_runner_setup(script, configs):  # {{{
+    # In in-process mode, python steps are run in a fork of the script's
+    # interpreter rather than in a new subprocess.
+    in_process = configs.get('script_input_arguments',
+                             'in_process_steps') == 'yes'
+    script.write('runner = StepRunner(in_process={})\n'.format(in_process))
+# }}}
+# }}}
+
+
+# *** Download Functions *** #{{{
+def get_download_cache_dir(configs):  # {{{
+    # Determine the directory of the download cache, and make sure it exists.
+    # Files in the cache are stored by the sha256 checksum of their contents,
+    # so the same cache can be shared by any number of work directories.
+    if configs.has_option('download', 'cache_dir') and \
+            configs.get('download', 'cache_dir').strip() != '':
+        cache_dir = configs.get('download', 'cache_dir').strip()
+    else:
+        cache_dir = '{}/.download_cache'.format(
+            configs.get('script_paths', 'work_dir'))
+
+    for subdir in ['objects', 'urls', 'partial']:
+        path = '{}/{}'.format(cache_dir, subdir)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+
+    return cache_dir
+# }}}
+
+
+def get_url_key(url):  # {{{
+    # The name used for the files in the cache that belong to a url
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+# }}}
+
+
+def get_object_path(cache_dir, checksum):  # {{{
+    return '{}/objects/{}/{}'.format(cache_dir, checksum[0:2], checksum)
+# }}}
+
+
+def read_cache_entry(cache_dir, url):  # {{{
+    # Return the cache entry of a url (a dictionary with its url, sha256
+    # checksum, size and, once it has been validated, file_id), or None if the
+    # url hasn't been downloaded into the cache.
+    entry_path = '{}/urls/{}.json'.format(cache_dir, get_url_key(url))
+    try:
+        with open(entry_path, 'r') as entry_file:
+            entry = json.load(entry_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if not os.path.exists(get_object_path(cache_dir, entry['sha256'])):
+        return None
+
+    return entry
+# }}}
+
+
+def write_cache_entry(cache_dir, entry):  # {{{
+    # Write to a temporary file first, so other processes never see a partial
+    # entry.
+    entry_path = '{}/urls/{}.json'.format(cache_dir, get_url_key(entry['url']))
+    tmp_path = '{}.{}'.format(entry_path, os.getpid())
+    with open(tmp_path, 'w') as entry_file:
+        json.dump(entry, entry_file)
+    os.rename(tmp_path, entry_path)
+# }}}
+
+
+def remove_cache_entry(cache_dir, entry):  # {{{
+    # Remove the cache entry of a url whose file turned out to be bad, so it
+    # is downloaded again, along with the file unless another url's entry
+    # refers to the same file.
+    entry_path = '{}/urls/{}.json'.format(cache_dir, get_url_key(entry['url']))
+    if os.path.exists(entry_path):
+        os.remove(entry_path)
+
+    urls_dir = '{}/urls'.format(cache_dir)
+    for file in os.listdir(urls_dir):
+        if not fnmatch.fnmatch(file, '*.json'):
+            continue
+        try:
+            with open('{}/{}'.format(urls_dir, file), 'r') as entry_file:
+                if json.load(entry_file)['sha256'] == entry['sha256']:
+                    return
+        except (IOError, OSError, ValueError, KeyError):
+            continue
+
+    object_path = get_object_path(cache_dir, entry['sha256'])
+    if os.path.exists(object_path):
+        os.remove(object_path)
+# }}}
+
+
+def download_to_cache(cache_dir, url, chunk_size=1024*1024):  # {{{
+    # Download a url into the cache, computing the checksum of the file as it
+    # is streamed to disk. A partial download left behind by an earlier
+    # attempt is resumed if the server supports it. Any url that urllib
+    # supports can be used, including file:// for local mirrors.
+    partial_path = '{}/partial/{}'.format(cache_dir, get_url_key(url))
+
+    partial_file = open(partial_path, 'ab')
+    try:
+        # Only one process at a time downloads a given url
+        fcntl.flock(partial_file, fcntl.LOCK_EX)
+
+        # Another process may have finished the download while we waited
+        entry = read_cache_entry(cache_dir, url)
+        if entry is not None:
+            return entry
+
+        checksum = hashlib.sha256()
+        partial_file.seek(0, os.SEEK_END)
+        offset = partial_file.tell()
+
+        request = Request(url)
+        if offset > 0:
+            request.add_header('Range', 'bytes={}-'.format(offset))
+        response = urlopen(request)
+
+        if offset > 0 and response.getcode() == 206:
+            # Resume the download, starting from the checksum of the part
+            # we already have
+            with open(partial_path, 'rb') as existing_file:
+                for chunk in iter(lambda: existing_file.read(chunk_size), b''):
+                    checksum.update(chunk)
+        else:
+            partial_file.seek(0)
+            partial_file.truncate()
+
+        try:
+            for chunk in iter(lambda: response.read(chunk_size), b''):
+                partial_file.write(chunk)
+                checksum.update(chunk)
+        finally:
+            response.close()
+        partial_file.flush()
+
+        object_path = get_object_path(cache_dir, checksum.hexdigest())
+        if not os.path.exists(os.path.dirname(object_path)):
+            try:
+                os.makedirs(os.path.dirname(object_path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+        os.rename(partial_path, object_path)
+
+        entry = {'url': url, 'sha256': checksum.hexdigest(),
+                 'size': os.path.getsize(object_path)}
+        write_cache_entry(cache_dir, entry)
+    finally:
+        partial_file.close()
+
+    return entry
+# }}}
+
+
+def get_verified_file(cache_dir, url, expected_hash, file_name):  # {{{
+    # Return the path to the cached file downloaded from url, or None if it
+    # hasn't been downloaded or doesn't match the expected hash. The file_id
+    # of a validated file is stored in its cache entry, so the file only
+    # needs to be opened the first time it is validated. A file that fails
+    # validation is removed from the cache, so it is downloaded again.
+    entry = read_cache_entry(cache_dir, url)
+    if entry is None:
+        return None
+
+    object_path = get_object_path(cache_dir, entry['sha256'])
+
+    if expected_hash is not None:
+        if 'file_id' not in entry:
+            nc = netCDF4.Dataset(object_path, 'r')
+            try:
+                entry['file_id'] = nc.file_id
+            except AttributeError:
+                nc.close()
+                print(" Downloaded file '{}' does not have a 'file_id' "
+                      "attribute.".format(file_name))
+                print(" Deleting file and exiting...")
+                remove_cache_entry(cache_dir, entry)
+                sys.exit(1)
+            nc.close()
+            write_cache_entry(cache_dir, entry)
+
+        if entry['file_id'].strip() != expected_hash.strip():
+            print("*** ERROR: Base mesh has hash of '{}' which does not "
+                  "match expected hash of '{}'.".format(entry['file_id'],
+                                                        expected_hash))
+            print(" Deleting file...")
+            remove_cache_entry(cache_dir, entry)
+            return None
+
+    return object_path
+# }}}
+
+
+def link_from_cache(cached_file, dest_file):  # {{{
+    # Hard link the cached file into place, so it takes no extra space, or
+    # copy it if the cache is on a different file system.
+    try:
+        os.link(cached_file, dest_file)
+    except OSError:
+        shutil.copyfile(cached_file, dest_file)
+# }}}
+
+
+def fetch_file(cache_dir, urls):  # {{{
+    # Download a file into the cache from the first mirror that works,
+    # unless it is already in the cache.
+    for url in urls:
+        if read_cache_entry(cache_dir, url) is not None:
+            return True
+        try:
+            download_to_cache(cache_dir, url)
+            return True
+        except download_errors as e:
+            print("  -- Download of {} failed: {}".format(url, e))
+    return False
+# }}}
+
+
+def fetch_file_worker(args):  # {{{
+    return fetch_file(*args)
+# }}}
+
+
+def prefetch_files(test_configs, max_downloads):  # {{{
+    # Download the files for all <get_file> tags in the given test cases that
+    # aren't already in place, concurrently, before any case is set up.
+    downloads = OrderedDict()
+    for configs in test_configs:
+        if configs.get('script_input_arguments', 'no_download') != 'no':
+            continue
+
+        cache_dir = get_download_cache_dir(configs)
+        test_path = configs.get('script_paths', 'test_dir')
+        for file in sorted(get_test_case_files(configs)):
+            case_config = CaseConfig(file)
+            if case_config.tag != 'config':
+                continue
+
+            # Set case_dir path, which dest_path may be relative to
+            configs.set('script_paths', 'case_dir',
+                        '{}/{}'.format(test_path, case_config.case_name))
+
+            for get_file in case_config.root:
+                if get_file.tag == 'get_file':
+                    dest_path, file_name, urls, expected_hash = \
+                        get_file_info(get_file, configs)
+                    if len(urls) > 0 and not os.path.exists(
+                            '{}/{}'.format(dest_path, file_name)):
+                        downloads[(cache_dir, tuple(urls))] = True
+
+    if len(downloads) == 0:
+        return
+
+    print(" -- Downloading {} file(s)".format(len(downloads)))
+    pool = ThreadPool(max(1, min(max_downloads, len(downloads))))
+    pool.map(fetch_file_worker, downloads.keys(), chunksize=1)
+    pool.close()
+    pool.join()
+# }}}
 # }}}
 
 
 # *** General Utility Functions *** #{{{
-def add_links(config_file, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+def add_links(case_config, configs):  # {{{
+    config_root = case_config.root
 
     case = config_root.attrib['case']
 
@@ -1196,7 +1535,7 @@ def add_links(config_file, configs):  # {{{
             dest = child.attrib['dest']
             if not configs.has_option("executables", source_attr):
                 raise ValueError('Configuration {} requires a definition of '
-                      '{}.'.format(config_file, source_attr))
+                      '{}.'.format(case_config.config_file, source_attr))
             source = configs.get("executables", source_attr)
 
             subprocess.check_call(['ln', '-sf', '{}'.format(source),
@@ -1256,9 +1595,8 @@ def get_source_file(child, config):  # {{{
 # }}}
 
 
-def copy_files(config_file, config):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+def copy_files(case_config, config):  # {{{
+    config_root = case_config.root
 
     case = config_root.attrib['case']
 
@@ -1275,197 +1613,166 @@ def copy_files(config_file, config):  # {{{
 
             dest = '{}/{}'.format(base_path, child.attrib['dest'])
 
-            shutil.copy(source, dest)
+            # Reflink or hard link the file if possible, rather than copying it
+            materialize_file(source, dest, copy_mode=True)
 # }}}
 
 
-def make_case_dir(config_file, base_path):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
-
-    case_name = config_root.attrib['case']
+def make_case_dir(case_config, base_path):  # {{{
+    case_name = case_config.case_name
 
     # Build the case directory, if it doesn't already exist
     if not os.path.exists('{}/{}'.format(base_path, case_name)):
         os.makedirs('{}/{}'.format(base_path, case_name))
 
-    del config_root
-    del config_tree
-
     return case_name
 # }}}
 
 
-def get_defined_files(config_file, init_path, configs):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
-    dev_null = open('/dev/null', 'w')
+def get_defined_files(case_config, init_path, configs):  # {{{
+    config_root = case_config.root
 
     for get_file in config_root:
         # Process <get_file> tag
         if get_file.tag == 'get_file':
-            # Determine dest_path
-            try:
-                dest_path_name = get_file.attrib['dest_path']
-            except KeyError:
-                print(" get_file tag is missing the 'dest_path' attribute.")
-                print(" Exiting...")
-                sys.exit(1)
+            dest_path, file_name, urls, expected_hash = \
+                get_file_info(get_file, configs)
 
-            # Determine file_name
-            try:
-                file_name = get_file.attrib['file_name']
-            except KeyError:
-                print(" get_file tag is missing a 'file_name' attribute.")
-                print(" Exiting...")
-                sys.exit(1)
+            # if the dest_path doesn't exist, create it
+            if not os.path.exists(dest_path):
+                os.makedirs(dest_path)
 
-            # Build out the dest path
-            keyword_path = False
-            if dest_path_name.find('work_') >= 0:
-                keyword_path = True
-            elif dest_path_name.find('script_') >= 0:
-                keyword_path = True
-            else:
-                if configs.has_option('paths', dest_path_name):
-                    dest_path = '{}'.format(
-                        configs.get('paths', dest_path_name))
-                else:
-                    print(" Path '{}' is not defined in the config file, "
-                          "but is required to get a file.".format(
-                              dest_path_name))
+            dest_file = '{}/{}'.format(dest_path, file_name)
+
+            # If the file doesn't exist in dest_path, process it's mirrors
+            if not os.path.exists(dest_file):
+                cache_dir = get_download_cache_dir(configs)
+
+                # Use a file that has already been downloaded into the cache
+                # (e.g. by prefetch_files) from any of the mirrors, validating
+                # it if requested (i.e. file had a hash attribute)
+                cached_file = None
+                for url in urls:
+                    if read_cache_entry(cache_dir, url) is not None:
+                        cached_file = get_verified_file(
+                            cache_dir, url, expected_hash, file_name)
+                        if cached_file is not None:
+                            break
+
+                # Otherwise, download the file from each mirror in turn
+                if cached_file is None and \
+                        configs.get('script_input_arguments',
+                                    'no_download') == 'no':
+                    for url in urls:
+                        if read_cache_entry(cache_dir, url) is not None:
+                            continue
+                        try:
+                            download_to_cache(cache_dir, url)
+                        except download_errors:
+                            print("  -- Web mirror attempt failed."
+                                  " Trying other mirrors...")
+                            continue
+                        cached_file = get_verified_file(
+                            cache_dir, url, expected_hash, file_name)
+                        if cached_file is not None:
+                            break
+
+                if cached_file is not None:
+                    link_from_cache(cached_file, dest_file)
+
+                # IF validation valied, exit.
+                if not os.path.exists(dest_file):
+                    print(" Failed to acquire required file '{}'.".format(
+                        file_name))
                     print(" Exiting...")
                     sys.exit(1)
+# }}}
 
-            if keyword_path:
-                dest_arr = dest_path_name.split('_')
-                base_name = dest_arr[0]
-                subname = '{}_{}'.format(dest_arr[1], dest_arr[2])
-
-                if base_name == 'work':
-                    base_path = 'work_dir'
-                elif base_name == 'script':
-                    base_path = 'script_path'
-
-                if subname in {'core_dir', 'configuration_dir',
-                               'resolution_dir', 'test_dir', 'case_dir'}:
-                    dest_path = '{}/{}'.format(
-                        configs.get('script_paths', base_path),
-                        configs.get('script_paths', subname))
-                else:
-                    print(" Path '{}' is not defined.".format(dest_path_name))
+
+def get_file_info(get_file, configs):  # {{{
+    # Determine the destination path, file name, mirror urls and expected
+    # hash (None if the file should not be validated) of a <get_file> tag.
+
+    # Determine dest_path
+    try:
+        dest_path_name = get_file.attrib['dest_path']
+    except KeyError:
+        print(" get_file tag is missing the 'dest_path' attribute.")
+        print(" Exiting...")
+        sys.exit(1)
+
+    # Determine file_name
+    try:
+        file_name = get_file.attrib['file_name']
+    except KeyError:
+        print(" get_file tag is missing a 'file_name' attribute.")
+        print(" Exiting...")
+        sys.exit(1)
+
+    # Build out the dest path
+    keyword_path = False
+    if dest_path_name.find('work_') >= 0:
+        keyword_path = True
+    elif dest_path_name.find('script_') >= 0:
+        keyword_path = True
+    else:
+        if configs.has_option('paths', dest_path_name):
+            dest_path = '{}'.format(configs.get('paths', dest_path_name))
+        else:
+            print(" Path '{}' is not defined in the config file, but is "
+                  "required to get a file.".format(dest_path_name))
+            print(" Exiting...")
+            sys.exit(1)
+
+    if keyword_path:
+        dest_arr = dest_path_name.split('_')
+        base_name = dest_arr[0]
+        subname = '{}_{}'.format(dest_arr[1], dest_arr[2])
+
+        if base_name == 'work':
+            base_path = 'work_dir'
+        elif base_name == 'script':
+            base_path = 'script_path'
+
+        if subname in {'core_dir', 'configuration_dir', 'resolution_dir',
+                       'test_dir', 'case_dir'}:
+            dest_path = '{}/{}'.format(configs.get('script_paths', base_path),
+                                       configs.get('script_paths', subname))
+        else:
+            print(" Path '{}' is not defined.".format(dest_path_name))
+            print(" Exiting...")
+            sys.exit(1)
+
+    # Determine the url of the file on each mirror
+    urls = list()
+    for mirror in get_file:
+        # Process each mirror
+        if mirror.tag == 'mirror':
+            # Determine the protocol for the mirror
+            try:
+                protocol = mirror.attrib['protocol']
+            except KeyError:
+                print("Mirror is missing the 'protocol' attribute.")
+                print("Exiting...")
+                sys.exit(1)
+
+            # Process a wget mirror
+            if protocol == 'wget':
+                try:
+                    urls.append('{}/{}'.format(mirror.attrib['url'],
+                                               file_name))
+                except KeyError:
+                    print(" Mirror with protocol 'wget' is missing a 'url' "
+                          "attribute")
                     print(" Exiting...")
                     sys.exit(1)
 
-            # if the dest_path doesn't exist, create it
-            if not os.path.exists(dest_path):
-                os.makedirs(dest_path)
+    try:
+        expected_hash = get_file.attrib['hash']
+    except KeyError:
+        expected_hash = None
 
-            # If the file doesn't exist in dest_path, process it's mirrors
-            if not os.path.exists('{}/{}'.format(dest_path, file_name)):
-                file_found = False
-                if not file_found:
-                    for mirror in get_file:
-                        # Process each mirror
-                        if mirror.tag == 'mirror':
-                            # Determine the protocol for the mirror
-                            try:
-                                protocol = mirror.attrib['protocol']
-                            except KeyError:
-                                print("Mirror is missing the 'protocol' "
-                                      "attribute.")
-                                print("Exiting...")
-                                sys.exit(1)
-
-                            # Process a wget mirror
-                            if protocol == 'wget':
-                                if config.get('script_input_arguments',
-                                              'no_download') == 'no':
-                                    try:
-                                        path = '{}/{}'.format(
-                                            mirror.attrib['url'], file_name)
-                                    except KeyError:
-                                        print(" Mirror with protocol 'wget' "
-                                              "is missing a 'url' attribute")
-                                        print(" Exiting...")
-                                        sys.exit(1)
-
-                                    try:
-                                        subprocess.check_call(
-                                            ['wget', '-q', '{}'.format(path)],
-                                            stdout=dev_null, stderr=dev_null)
-                                    except subprocess.CalledProcessError:
-                                        print(" Wget failed....")
-
-                                    try:
-                                        subprocess.check_call(
-                                            ['mv', '{}'.format(file_name),
-                                             '{}/{}'.format(dest_path,
-                                                            file_name)],
-                                            stdout=dev_null, stderr=dev_null)
-                                    except subprocess.CalledProcessError:
-                                        print("  -- Web mirror attempt failed."
-                                              " Trying other mirrors...")
-
-                        # If the file exists in dest_path, determine if it
-                        # should be validated
-                        if os.path.exists('{}/{}'.format(dest_path,
-                                          file_name)):
-                            try:
-                                expected_hash = get_file.attrib['hash']
-                                validate_file = True
-                            except KeyError:
-                                validate_file = False
-
-                            # Validate the file, if requested (i.e. file had a
-                            # hash attribute)
-                            if validate_file:
-                                if os.path.exists('{}/{}'.format(dest_path,
-                                                                 file_name)):
-                                    nc = netCDF4.Dataset('{}/{}'.format(
-                                        dest_path, file_name), 'r')
-                                    try:
-                                        file_hash = nc.file_id
-                                    except AttributeError:
-                                        nc.close()
-                                        print(" Downloaded file '{}' does "
-                                              "not have a 'file_id' "
-                                              "attribute.".format(file_name))
-                                        print(" Deleting file and exiting...")
-                                        subprocess.check_call(
-                                            ['rm', '-f',
-                                             '{}/{}'.format(dest_path,
-                                                            file_name)],
-                                            stdout=dev_null, stderr=dev_null)
-                                        sys.exit(1)
-
-                                    nc.close()
-
-                                    if file_hash.strip() != \
-                                            expected_hash.strip():
-                                        print("*** ERROR: Base mesh has "
-                                              "hash of '{}' which does not "
-                                              "match expected hash of "
-                                              "'{}'.".format(file_hash,
-                                                             expected_hash))
-                                        print(" Deleting file...")
-                                        subprocess.check_call(
-                                            ['rm', '-f',
-                                             '{}/{}'.format(dest_path,
-                                                            file_name)],
-                                            stdout=dev_null, stderr=dev_null)
-
-                    # IF validation valied, exit.
-                    if not os.path.exists('{}/{}'.format(dest_path,
-                                                         file_name)):
-                        print(" Failed to acquire required file '{}'.".format(
-                            file_name))
-                        print(" Exiting...")
-                        sys.exit(1)
-
-    del config_tree
-    del config_root
-    dev_null.close()
+    return dest_path, file_name, urls, expected_hash
 # }}}
 
 
@@ -1525,34 +1832,46 @@ def get_template_info(template, configs):  # {{{
 # }}}
 
 
-def get_config_file_type(config_file):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+class CaseConfig(object):  # {{{
+    # A config or driver_script file, parsed once so that all of the functions
+    # setting up its case can share the same tree.
+    def __init__(self, config_file):
+        self.config_file = config_file
+        self.tree = ET.parse(config_file)
+        self.root = self.tree.getroot()
 
-    # Determine file type
-    file_type = config_root.tag
+        # Determine file type
+        # Could be config, driver_script, template, etc.
+        # The type is defined by the parent tag.
+        self.tag = self.root.tag
 
-    del config_root
-    del config_tree
-
-    return file_type
+        if self.tag == 'config':
+            self.case_name = self.root.attrib['case']
+        else:
+            self.case_name = None
 # }}}
 
 
-def get_case_name(config_file):  # {{{
-    config_tree = ET.parse(config_file)
-    config_root = config_tree.getroot()
+def parse_template(template_file):  # {{{
+    # Return the root of the parsed template file, parsing it only if it isn't
+    # already in the template cache. The returned tree is shared between all
+    # uses of the template, so callers that modify it need to copy it first.
+    key = os.path.abspath(template_file)
 
-    # Determine file type
-    if config_root.tag == 'config':
-        name = config_root.attrib['case']
+    if key in template_cache:
+        # Move the template to the most recently used end of the cache
+        template_root = template_cache.pop(key)
+    else:
+        template_root = ET.parse(template_file).getroot()
+        if len(template_cache) >= max_cached_templates:
+            template_cache.popitem(last=False)
 
-    del config_root
-    del config_tree
+    template_cache[key] = template_root
 
-    return name
+    return template_root
 # }}}
 
+
 def link_load_compass_env(init_path, configs):  # {{{
 
     if configs.getboolean('conda', 'link_load_compass'):
@@ -1570,6 +1889,190 @@ def link_load_compass_env(init_path, configs):  # {{{
             else:
                 raise e
 # }}}
+
+
+def copy_config(configs):  # {{{
+    # Build an independent copy of the config, so settings for one case (e.g.
+    # its paths) cannot leak into another.
+    if sys.version_info >= (3, 2):
+        case_config = configparser.ConfigParser()
+    else:
+        case_config = configparser.SafeConfigParser()
+
+    for section in configs.sections():
+        case_config.add_section(section)
+        for option, value in configs.items(section, raw=True):
+            case_config.set(section, option, value)
+
+    return case_config
+# }}}
+
+
+def set_case_paths(configs, core, configuration, resolution, test):  # {{{
+    configs.set('script_input_arguments', 'core', core)
+    configs.set('script_input_arguments', 'configuration', configuration)
+    configs.set('script_input_arguments', 'resolution', resolution)
+    configs.set('script_input_arguments', 'test', test)
+
+    test_path = '{}/{}/{}/{}'.format(core, configuration, resolution, test)
+
+    # Set paths to core, configuration, resolution, and case for use in
+    # functions
+    configs.set('script_paths', 'core_dir', core)
+    configs.set('script_paths', 'configuration_dir',
+                '{}/{}'.format(core, configuration))
+    configs.set('script_paths', 'resolution_dir',
+                '{}/{}/{}'.format(core, configuration, resolution))
+    configs.set('script_paths', 'test_dir', test_path)
+    configs.set('script_paths', 'config_path', test_path)
+# }}}
+
+
+def get_test_case_files(configs):  # {{{
+    # The XML files of a test case: those in its directory and, if set, those
+    # in the extra config directory (e.g. the variants of a parameter sweep,
+    # which are kept out of the repository)
+    test_path = configs.get('script_paths', 'test_dir')
+    config_dirs = [test_path]
+    if configs.get('script_paths', 'extra_config_dir') != 'NONE':
+        config_dirs.append(configs.get('script_paths', 'extra_config_dir'))
+
+    files = list()
+    for config_dir in config_dirs:
+        for file in os.listdir(config_dir):
+            if fnmatch.fnmatch(file, '*.xml'):
+                files.append('{}/{}'.format(config_dir, file))
+    return files
+# }}}
+
+
+def setup_case(case_config, configs, work_dir):  # {{{
+    # Set up the directory, namelists, streams, files, links and run scripts
+    # of a single case. Returns the path of the case directory.
+    test_path = configs.get('script_paths', 'test_dir')
+
+    # Ensure the case directory exists
+    case_dir = make_case_dir(case_config, work_dir)
+    case_name = case_config.case_name
+
+    # Set case_dir path for function calls
+    configs.set('script_paths', 'case_dir',
+                '{}/{}'.format(test_path, case_name))
+
+    case_path = '{}/{}'.format(work_dir, case_dir)
+
+    # Generate all namelists for this case
+    generate_namelist_files(case_config, case_path, configs)
+
+    # Generate all streams files for this case
+    generate_streams_files(case_config, case_path, configs)
+
+    # Ensure required files exist for this case
+    get_defined_files(case_config, '{}'.format(case_path), configs)
+
+    # Process all links for this case
+    add_links(case_config, configs)
+
+    copy_files(case_config, configs)
+
+    # Generate run scripts for this case.
+    generate_run_scripts(case_config, '{}'.format(case_path), configs)
+
+    return '{}/{}'.format(work_dir, case_dir)
+# }}}
+
+
+def setup_case_worker(args):  # {{{
+    # Wrapper around setup_case for use in a process pool, which parses the
+    # config file in the worker. Returns None if setting up the case failed,
+    # rather than letting an exception make the pool abort the other cases.
+    config_file, configs, work_dir = args
+    try:
+        return setup_case(CaseConfig(config_file), configs, work_dir)
+    except SystemExit:
+        return None
+    except Exception:
+        print(traceback.format_exc())
+        return None
+# }}}
+
+
+def setup_test_case(configs, jobs=1):  # {{{
+    # Set up all cases and driver scripts of a single test case, whose paths
+    # have been set in configs with set_case_paths. Returns True if anything
+    # was set up, in which case the command history should be written. With
+    # more than one job, the cases are set up concurrently in a pool of
+    # processes (they only share files through links to each other), and the
+    # driver scripts after all of them.
+    test_path = configs.get('script_paths', 'test_dir')
+    work_dir = '{}/{}'.format(configs.get('script_paths', 'work_dir'),
+                              test_path)
+
+    # Only write history if we did something...
+    write_history = False
+
+    case_files = list()
+    driver_configs = list()
+
+    # Loop over all XML files of the test case
+    for file in get_test_case_files(configs):
+        # Parse the file, which is shared by all setup functions below
+        case_config = CaseConfig(file)
+
+        # Process config files
+        if case_config.tag == 'config':
+            write_history = True
+            if jobs > 1:
+                case_files.append(case_config.config_file)
+            else:
+                case_path = setup_case(case_config, configs, work_dir)
+                print(" -- Set up case: {}".format(case_path))
+        # Process driver scripts
+        elif case_config.tag == 'driver_script':
+            write_history = True
+            if jobs > 1:
+                driver_configs.append(case_config)
+            else:
+                # Generate driver scripts.
+                generate_driver_scripts(case_config, configs)
+                print(" -- Set up driver script in {}".format(work_dir))
+
+    if len(case_files) > 0:
+        pool = multiprocessing.Pool(min(jobs, len(case_files)))
+        case_paths = pool.map(setup_case_worker,
+                              [(case_file, configs, work_dir) for case_file
+                               in case_files], chunksize=1)
+        pool.close()
+        pool.join()
+        for case_file, case_path in zip(case_files, case_paths):
+            if case_path is None:
+                print("ERROR: Setting up the case in {} failed.".format(
+                    case_file))
+                print("Exiting...")
+                sys.exit(1)
+            print(" -- Set up case: {}".format(case_path))
+
+    for case_config in driver_configs:
+        generate_driver_scripts(case_config, configs)
+        print(" -- Set up driver script in {}".format(work_dir))
+
+    return write_history
+# }}}
+
+
+def setup_test_case_worker(configs):  # {{{
+    # Wrapper around setup_test_case for use in a process pool. Errors while
+    # setting up a case exit through sys.exit or raise exceptions, either of
+    # which would otherwise make the pool abort all other test cases, so they
+    # are turned into a failed status here.
+    try:
+        return True, setup_test_case(configs)
+    except SystemExit:
+        return False, False
+    except Exception:
+        print(traceback.format_exc())
+        return False, False
+# }}}
 # }}}
 
 
@@ -1615,6 +2118,29 @@ if __name__ == "__main__":
                         action="store_true",
                         help="If set, a link to <core>/load_compass_env.sh is "
                              "included with each test case")
+    parser.add_argument("--in_process_steps", dest="in_process_steps",
+                        action="store_true",
+                        help="If set, steps that are python scripts are run "
+                             "in a fork of the calling script, with common "
+                             "modules already imported, rather than in a new "
+                             "python interpreter.")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="Number of test cases from the case list (or of "
+                             "cases of a single test case) to set up "
+                             "concurrently in a pool of processes.",
+                        metavar="N")
+    parser.add_argument("--procs", dest="procs", type=int,
+                        help="If set, parallel model runs (with more than "
+                             "one proc) use this many procs, and their mesh "
+                             "is partitioned for it.", metavar="N")
+    parser.add_argument("--threads", dest="threads", type=int,
+                        help="If set, parallel model runs use this many "
+                             "threads.", metavar="N")
+    parser.add_argument("--config_dir", dest="config_dir",
+                        help="Directory of additional config files (e.g. "
+                             "the variants of a parameter sweep) to set up as "
+                             "cases of the test case, along with those in its "
+                             "directory.", metavar="PATH")
 
     args = parser.parse_args()
 
@@ -1680,11 +2206,37 @@ if __name__ == "__main__":
     else:
         config.set('script_paths', 'baseline_dir', 'NONE')
 
+    if args.config_dir:
+        if use_case_list:
+            parser.error(' --config_dir can only be used with a single test '
+                         'case set up with -o, -c, -r and -t.')
+        if not os.path.isdir(args.config_dir):
+            parser.error(" Config directory '{}' does not exist.".format(
+                args.config_dir))
+        config.set('script_paths', 'extra_config_dir',
+                   os.path.abspath(args.config_dir))
+    else:
+        config.set('script_paths', 'extra_config_dir', 'NONE')
+
     if args.no_download:
         config.set('script_input_arguments', 'no_download', 'yes')
     else:
         config.set('script_input_arguments', 'no_download', 'no')
 
+    if args.in_process_steps:
+        config.set('script_input_arguments', 'in_process_steps', 'yes')
+    else:
+        config.set('script_input_arguments', 'in_process_steps', 'no')
+
+    for option in ['procs', 'threads']:
+        value = getattr(args, option)
+        if value is None:
+            config.set('script_input_arguments', option, 'NONE')
+        elif value < 1:
+            parser.error(' --{} must be at least 1.'.format(option))
+        else:
+            config.set('script_input_arguments', option, str(value))
+
     config.set('script_paths', 'script_path',
                os.path.dirname(os.path.realpath(__file__)))
     config.set('script_paths', 'work_dir', os.path.abspath(args.work_dir))
@@ -1723,106 +2275,59 @@ if __name__ == "__main__":
         calling_command = "{}{} ".format(calling_command, arg)
     os.chdir(old_dir)
 
-    # Iterate over all cases in the case_list.
+    # Build an isolated config for each test case in the case_list.
     # There is only one if the (-o, -c, -r) options were used in place of (-n)
+    test_configs = list()
+    if use_case_list:
+        # Read (and if needed rebuild) the index of test cases only once
+        index = get_index(config.get('script_paths', 'script_path'))
     for case_num in case_list:
 
         # If we're using a case_list, determine the core, configuration, and
         # resolution for the current test case.
         if use_case_list:
-            core_configuration = subprocess.check_output(
-                ['{}/list_testcases.py'.format(config.get('script_paths',
-                                                          'script_path')),
-                 '-n', '{:d}'.format(int(case_num))]).decode('utf-8')
-            config_options = core_configuration.strip('\n').split(' ')
-            config.set('script_input_arguments', 'core', config_options[1])
-            config.set('script_input_arguments', 'configuration',
-                       config_options[3])
-            config.set('script_input_arguments', 'resolution',
-                       config_options[5])
-            config.set('script_input_arguments', 'test', config_options[7])
-
-        # Setup each xml file in the configuration directory:
-        test_path = '{}/{}/{}/{}'.format(
-            config.get('script_input_arguments', 'core'),
-            config.get('script_input_arguments', 'configuration'),
-            config.get('script_input_arguments', 'resolution'),
-            config.get('script_input_arguments', 'test'))
-        work_dir = '{}/{}'.format(config.get('script_paths', 'work_dir'),
-                                  test_path)
-
-        # Set paths to core, configuration, resolution, and case for use in
-        # functions
-        config.set('script_paths', 'core_dir',
-                   config.get('script_input_arguments', 'core'))
-        config.set('script_paths', 'configuration_dir',
-                   '{}/{}'.format(config.get('script_paths', 'core_dir'),
-                                  config.get('script_input_arguments',
-                                             'configuration')))
-        config.set('script_paths', 'resolution_dir',
-                   '{}/{}'.format(config.get('script_paths',
-                                             'configuration_dir'),
-                                  config.get('script_input_arguments',
-                                             'resolution')))
-        config.set('script_paths', 'test_dir', test_path)
-        config.set('script_paths', 'config_path', test_path)
-
-        # Only write history if we did something...
-        write_history = False
-
-        # Loop over all files in test_path that have the .xml extension.
-        for file in os.listdir('{}'.format(test_path)):
-            if fnmatch.fnmatch(file, '*.xml'):
-                # Build full file name
-                config_file = '{}/{}'.format(test_path, file)
-
-                # Determine the type of the config file
-                # Could be config, driver_script, template, etc.
-                # The type is defined by the parent tag.
-                config_type = get_config_file_type(config_file)
-
-                # Process config files
-                if config_type == 'config':
-                    write_history = True
-                    # Ensure the case directory exists
-                    case_dir = make_case_dir(config_file, work_dir)
-                    case_name = get_case_name(config_file)
-
-                    # Set case_dir path for function calls
-                    config.set('script_paths', 'case_dir',
-                               '{}/{}'.format(config.get('script_paths',
-                                                         'test_dir'),
-                                              case_name))
-
-                    case_path = '{}/{}'.format(work_dir, case_dir)
-
-                    # Generate all namelists for this case
-                    generate_namelist_files(config_file, case_path, config)
-
-                    # Generate all streams files for this case
-                    generate_streams_files(config_file, case_path, config)
-
-                    # Ensure required files exist for this case
-                    get_defined_files(config_file, '{}'.format(case_path),
-                                      config)
-
-                    # Process all links for this case
-                    add_links(config_file, config)
-
-                    copy_files(config_file, config)
-
-                    # Generate run scripts for this case.
-                    generate_run_scripts(config_file, '{}'.format(case_path),
-                                         config)
-
-                    print(" -- Set up case: {}/{}".format(work_dir, case_dir))
-                # Process driver scripts
-                elif config_type == 'driver_script':
-                    write_history = True
+            try:
+                case = get_test_case(int(case_num), index)
+            except ValueError as error:
+                print("ERROR: {}".format(error))
+                print("Exiting...")
+                sys.exit(1)
+            core = case['core']
+            configuration = case['configuration']
+            resolution = case['resolution']
+            test = case['test']
+        else:
+            core = args.core
+            configuration = args.configuration
+            resolution = args.resolution
+            test = args.test
+
+        test_config = copy_config(config)
+        set_case_paths(test_config, core, configuration, resolution, test)
+        test_configs.append(test_config)
+
+    # Download any files the test cases need into the download cache, all at
+    # once, before setting up the cases.
+    if config.has_option('download', 'max_downloads'):
+        max_downloads = config.getint('download', 'max_downloads')
+    else:
+        max_downloads = 4
+    prefetch_files(test_configs, max_downloads)
+
+    # Setup each xml file in the test case directories, either one after the
+    # other or concurrently in a pool of processes. With a single test case,
+    # its cases are set up concurrently instead.
+    if args.jobs > 1 and len(test_configs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(test_configs)))
+        results = pool.map(setup_test_case_worker, test_configs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [(True, setup_test_case(test_config, args.jobs)) for
+                   test_config in test_configs]
 
-                    # Generate driver scripts.
-                    generate_driver_scripts(config_file, config)
-                    print(" -- Set up driver script in {}".format(work_dir))
+    success = all([result[0] for result in results])
+    write_history = any([result[1] for result in results])
 
     # Write the history of this command to the command_history file, for
     # provenance.
@@ -1840,31 +2345,26 @@ if __name__ == "__main__":
         history_file.write('git_version: {}\n'.format(git_version))
         history_file.write('command: {}\n'.format(calling_command))
         history_file.write('setup the following cases:\n')
-        if use_case_list:
-            for case_num in case_list:
-                core_configuration = subprocess.check_output(
-                    ['./list_testcases.py', '-n',
-                     '{:d}'.format(int(case_num))]).decode('utf-8')
-                config_options = core_configuration.strip('\n').split(' ')
+        for (case_success, case_history), test_config in zip(results,
+                                                             test_configs):
+            if not case_history:
+                continue
+            if use_case_list:
                 history_file.write('\n')
-                history_file.write('    core: {}\n'.format(config_options[1]))
-                history_file.write('    configuration: {}\n'.format(
-                    config_options[3]))
-                history_file.write('    resolution: {}\n'.format(
-                    config_options[5]))
-                history_file.write('    test: {}\n'.format(config_options[7]))
-        else:
-            history_file.write('core: {}\n'.format(
-                config.get('script_input_arguments', 'core')))
-            history_file.write('configuration: {}\n'.format(
-                config.get('script_input_arguments', 'configuration')))
-            history_file.write('resolution: {}\n'.format(
-                config.get('script_input_arguments', 'resolution')))
-            history_file.write('test: {}\n'.format(
-                config.get('script_input_arguments', 'test')))
+                indent = '    '
+            else:
+                indent = ''
+            for option in ['core', 'configuration', 'resolution', 'test']:
+                history_file.write('{}{}: {}\n'.format(
+                    indent, option,
+                    test_config.get('script_input_arguments', option)))
 
         history_file.write('**************************************************'
                            '*********************\n')
         history_file.close()
 
+    if not success:
+        print("ERROR: One or more test cases failed to set up.")
+        sys.exit(1)
+
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
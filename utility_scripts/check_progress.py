@@ -64,35 +64,63 @@ import argparse
 from datetime import datetime
 import sys
 
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file in which to find the name of the restart pointer", metavar="FILE", required=True)
-parser.add_argument("-e", "--endDate", dest="endDate", help="End date of the run", metavar="DATE", required=True)
-
-args = parser.parse_args()
-
-lines = []
-restartPointer = 'Restart_timestamp'
-inFile = open(args.fileName, 'r')
-for line in inFile:
-    if 'config_restart_timestamp_name' in line:
-        restartPointer = line.split("=")[-1]
-        restartPointer = restartPointer.lstrip(" \t'")
-        restartPointer = restartPointer.rstrip(" \t\n'")
-    lines.append(line)
-inFile.close()
-
-if not os.path.exists(restartPointer):
-    # nothing to do
+
+def read_namelist(fileName):  # {{{
+    # The lines of a namelist file and the name of the restart pointer given
+    # by config_restart_timestamp_name in it
+    lines = []
+    restartPointer = 'Restart_timestamp'
+    inFile = open(fileName, 'r')
+    for line in inFile:
+        if 'config_restart_timestamp_name' in line:
+            restartPointer = line.split("=")[-1]
+            restartPointer = restartPointer.lstrip(" \t'")
+            restartPointer = restartPointer.rstrip(" \t\n'")
+        lines.append(line)
+    inFile.close()
+    return lines, restartPointer
+# }}}
+
+
+def parse_date(date):  # {{{
+    return datetime.strptime(date, '%Y-%m-%d_%H:%M:%S')
+# }}}
+
+
+def get_restart_date(restartPointer):  # {{{
+    # The date in the restart pointer, or None if it doesn't exist yet
+    if not os.path.exists(restartPointer):
+        return None
+
+    restartDate = None
+    inFile = open(restartPointer, 'r')
+    for line in inFile:
+        line = line.strip(" \t\n")
+        restartDate = parse_date(line)
+        break
+    inFile.close()
+    return restartDate
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file in which to find the name of the restart pointer", metavar="FILE", required=True)
+    parser.add_argument("-e", "--endDate", dest="endDate", help="End date of the run", metavar="DATE", required=True)
+
+    args = parser.parse_args()
+
+    lines, restartPointer = read_namelist(args.fileName)
+
+    restartDate = get_restart_date(restartPointer)
+    if restartDate is None:
+        # nothing to do
+        sys.exit(0)
+
+    endDate = parse_date(args.endDate)
+    if restartDate >= endDate:
+        print('Run has completed.')
+        sys.exit(1)
     sys.exit(0)
 
-inFile = open(restartPointer, 'r')
-for line in inFile:
-    line = line.strip(" \t\n")
-    restartDate = datetime.strptime(line, '%Y-%m-%d_%H:%M:%S')
-    break
-inFile.close()
-endDate = datetime.strptime(args.endDate, '%Y-%m-%d_%H:%M:%S')
-if restartDate >= endDate:
-    print('Run has completed.')
-    sys.exit(1)
-sys.exit(0)
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -1,173 +1,529 @@
 #!/usr/bin/env python
+"""
+This script compares fields between two netCDF files, and fails if the L1, L2
+or L_Infinity norm of their difference exceeds the given thresholds for any
+time level.
+
+Any number of variables can be compared in one call, by giving -v for each of
+them. Both files are opened only once, and each time level of a field is read
+in chunks of at most --chunk_size values (splitting the first dimension, e.g.
+nCells, and then the next one, e.g. nVertLevels, as needed), accumulating all
+three norms in a single pass over each chunk. Memory use therefore doesn't grow
+with the size of the mesh. With -j, variables are compared in parallel worker
+processes, each of which opens the files once.
+
+For fields with a Time dimension, norms are reported for each time level, and
+L_Infinity is the maximum over the time levels so far. For fields with at least
+two dimensions, L1 is the sum of the absolute differences divided by the sum
+of the dimension sizes. Fields with a single dimension other than Time are
+compared at their first index.
+
+Variables and their thresholds can also be listed in a file given with
+--fields, one per line, with the name of the variable followed by any of
+l1_norm=VAL, l2_norm=VAL and linf_norm=VAL (as in the <field> tags of
+validation steps). Lines starting with # are ignored. With --summary, a PASS or
+FAIL line is printed after the comparison of each variable.
+
+With --bitwise, each time level is first compared by a digest of its values as
+stored in the files (without masking or scaling), and norms are only computed
+for time levels whose digests differ, since they are all zero otherwise. If a
+digest sidecar of the second file (FILE.digests.json, written by
+make_baseline_digests.py) exists and is newer than the file, its digests are
+used instead of reading the file, and the file itself is only needed for time
+levels that differ.
+"""
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
 import sys
 import os
+import json
+import hashlib
 import numpy as np
+from multiprocessing import Pool
 
 from netCDF4 import Dataset as NetCDFFile
 import argparse
 
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-1", "--file1", dest="filename1", help="first input file", metavar="FILE")
-parser.add_argument("-2", "--file2", dest="filename2", help="second input file", metavar="FILE")
-parser.add_argument("-v", "--var", dest="variable", help="variable to compute error with", metavar="VAR")
-parser.add_argument("--l2", dest="l2_norm", help="value of L2 norm for a pass.", metavar="VAL")
-parser.add_argument("--l1", dest="l1_norm", help="value of L1 norm for a pass.", metavar="VAL")
-parser.add_argument("--linf", dest="linf_norm", help="value of L_Infinity norm for a pass.", metavar="VAL")
-parser.add_argument("-q", "--quiet", dest="quiet", help="turns off printing if diff passes test.", action="store_true")
-
-args = parser.parse_args()
-
-if not args.filename1:
-    parser.error("Two filenames are required inputs.")
-
-if not args.filename2:
-    parser.error("Two filenames are required inputs.")
-
-if not args.variable:
-    parser.error("Variable is a required input.")
-
-if (not args.l2_norm) and (not args.l1_norm) and (not args.linf_norm):
-    print("WARNING: Script will pass since no norm values have been defined.")
-
-files_exist = True
-
-if not os.path.exists(args.filename1):
-    print("ERROR: File %s does not exist. Comparison will FAIL."%(args.filename1))
-    files_exist = False
-
-if not os.path.exists(args.filename2):
-    print("ERROR: File %s does not exist. Comparison will FAIL."%(args.filename2))
-    files_exist = False
-
-if not files_exist:
-    sys.exit(1)
-
-f1 = NetCDFFile(args.filename1,'r')
-f2 = NetCDFFile(args.filename2,'r')
-
-try:
-    time_length = f1.variables['xtime'].shape[0]
-except:
-    time_length = 1
-
-try:
-    field1 = f1.variables[args.variable]
-    field2 = f2.variables[args.variable]
-except:
-    print("ERROR: Field '%s' does not exist in both"%(args.variable))
-    print("           file1: %s"%(args.filename1))
-    print("       and file2: %s"%(args.filename2))
-    print("Exiting with a failed comparision, since no comparision can be done but a comparison was requested.")
-    sys.exit(1)
-
-if not field1.shape == field2.shape:
-    print("ERROR: Field sizes don't match in different files.")
-    sys.exit(1)
-
-linf_norm = -(sys.float_info.max)
-
-pass_val = True
-
-print("Beginning variable comparisons for all time levels of field '%s'. Note any time levels reported are 0-based."%(args.variable))
-if ( args.l2_norm or args.l1_norm or args.linf_norm ):
-    print("    Pass thresholds are:")
-    if ( args.l1_norm ):
-        print("       L1: %16.14e"%(float(args.l1_norm)))
-    if ( args.l2_norm ):
-        print("       L2: %16.14e"%(float(args.l2_norm)))
-    if ( args.linf_norm ):
-        print("       L_Infinity: %16.14e"%(float(args.linf_norm)))
-
-field_dims = field1.dimensions
-
-if "Time" in field_dims:
-    for t in range( 0, time_length):
-        pass_time = True
-        if len(field_dims) >= 2:
-            diff = np.absolute(field1[t][:] - field2[t][:])
-        else:
-            diff = np.absolute(field1[t] - field2[t])
-
-        l2_norm = np.sum(diff * diff)
-        l2_norm = np.sqrt(l2_norm)
+# The files being compared, opened once by each worker process
+worker_files = dict()
 
-        l1_norm = np.sum(diff)
-        if len(field_dims) >= 2:
-            l1_norm = l1_norm / np.sum(field1[t][:].shape)
-        l1_norm = np.max(l1_norm)
 
-        if np.amax(diff) > linf_norm:
-            linf_norm = np.amax(diff)
+def get_chunks(shape, chunk_size):  # {{{
+    # Yield tuples of slices that split an array of the given shape into
+    # chunks of at most chunk_size values, splitting the first dimension
+    # first, and the following dimensions only if one index of the first
+    # dimension is already too large.
+    if len(shape) == 0:
+        yield ()
+        return
 
-        diff_str = '%d: '%(t)
-        if args.l1_norm:
-            if float(args.l1_norm) < l1_norm:
-                pass_time = False
-        diff_str = '%s l1: %16.14e '%(diff_str, l1_norm)
+    size = int(np.prod(shape[1:]))
+    if size <= chunk_size:
+        step = max(1, chunk_size // max(size, 1))
+        for start in range(0, shape[0], step):
+            yield (slice(start, min(start + step, shape[0])),)
+    else:
+        for index in range(shape[0]):
+            for chunk in get_chunks(shape[1:], chunk_size):
+                yield (slice(index, index + 1),) + chunk
+# }}}
+
+
+def accumulate_norms(field1, field2, prefix, shape, chunk_size):  # {{{
+    # Accumulate the sum of the absolute difference, the sum of its square and
+    # its maximum over field[prefix + chunk] for all chunks of shape. Masked
+    # (fill) values are left out, as in numpy's masked array reductions. If
+    # field2 is None, the norms of field1 itself are accumulated.
+    l1_sum = 0.0
+    l2_sum = 0.0
+    linf = None
+    for chunk in get_chunks(shape, chunk_size):
+        index = prefix + chunk
+        diff = np.ma.array(field1[index], dtype=np.float64)
+        if field2 is not None:
+            diff -= field2[index]
+        if np.ma.count(diff) == 0:
+            continue
+        values = np.ma.filled(diff, 0.0).ravel()
+        np.absolute(values, out=values)
+        l1_sum += values.sum()
+        l2_sum += np.dot(values, values)
+        chunk_max = values.max()
+        if linf is None or chunk_max > linf:
+            linf = chunk_max
+        del diff, values
+    return l1_sum, np.sqrt(l2_sum), linf
+# }}}
+
+
+def get_digest(field, prefix, shape, chunk_size):  # {{{
+    # The sha256 digest of the values of field[prefix] as they are stored in
+    # the file. The chunks are read in C order, so the digest doesn't depend
+    # on chunk_size.
+    checksum = hashlib.sha256()
+    checksum.update(np.dtype(field.dtype).str.encode('utf-8'))
+    field.set_auto_maskandscale(False)
+    try:
+        for chunk in get_chunks(shape, chunk_size):
+            values = np.ascontiguousarray(field[prefix + chunk])
+            checksum.update(values.tobytes())
+    finally:
+        field.set_auto_maskandscale(True)
+    return checksum.hexdigest()
+# }}}
+
+
+def get_time_length(f):  # {{{
+    try:
+        return f.variables['xtime'].shape[0]
+    except KeyError:
+        return 1
+# }}}
+
+
+def get_levels(field, time_length):  # {{{
+    # The parts of a field that norms are computed over, as tuples of the
+    # index of the part, its shape and the label of its norms
+    field_dims = field.dimensions
+    if "Time" in field_dims:
+        # Each time level of the field, in chunks
+        return [((t,), field.shape[1:], '%d: ' % (t))
+                for t in range(0, time_length)]
+    elif len(field_dims) >= 2:
+        return [((), field.shape, '')]
+    else:
+        return [((0,), (), '')]
+# }}}
+
+
+def get_field_norms(field, prefix, shape, chunk_size):  # {{{
+    # The norms of a part of a field, normalized as in comparisons
+    l1_norm, l2_norm, linf_norm = accumulate_norms(field, None, prefix, shape,
+                                                   chunk_size)
+    if len(field.dimensions) >= 2:
+        l1_norm = l1_norm / np.sum(shape)
+    return l1_norm, l2_norm, linf_norm
+# }}}
+
+
+def get_sidecar_name(filename):  # {{{
+    return '{}.digests.json'.format(filename)
+# }}}
+
+
+def read_sidecar(filename):  # {{{
+    # Read the digest sidecar of a file, if it exists and is up to date
+    sidecar = get_sidecar_name(filename)
+    if not os.path.exists(sidecar):
+        return None
+    if os.path.exists(filename) and \
+            os.path.getmtime(sidecar) < os.path.getmtime(filename):
+        return None
+    with open(sidecar, 'r') as sidecar_file:
+        return json.load(sidecar_file)
+# }}}
+
+
+def get_file_digests(filename, chunk_size):  # {{{
+    # The digest and norms of each time level of each numeric variable in a
+    # file, as stored in its digest sidecar
+    f = NetCDFFile(filename, 'r')
+    time_length = get_time_length(f)
+    variables = dict()
+    for name, field in f.variables.items():
+        if field.dtype is str or np.dtype(field.dtype).kind not in 'biuf':
+            continue
+        levels = list()
+        for prefix, shape, _ in get_levels(field, time_length):
+            l1_norm, l2_norm, linf_norm = get_field_norms(field, prefix, shape,
+                                                          chunk_size)
+            if linf_norm is not None:
+                linf_norm = float(linf_norm)
+            levels.append({'digest': get_digest(field, prefix, shape,
+                                                chunk_size),
+                           'l1': float(l1_norm), 'l2': float(l2_norm),
+                           'linf': linf_norm})
+        variables[name] = {'shape': list(field.shape), 'levels': levels}
+    f.close()
+    return {'file': os.path.abspath(filename), 'variables': variables}
+# }}}
+
+
+def format_norms(prefix, l1_norm, l2_norm, linf_norm):  # {{{
+    diff_str = prefix
+    diff_str = '%s l1: %16.14e ' % (diff_str, l1_norm)
+    diff_str = '%s l2: %16.14e ' % (diff_str, l2_norm)
+    diff_str = '%s linf: %16.14e ' % (diff_str, linf_norm)
+    return diff_str
+# }}}
+
+
+def check_norms(thresholds, l1_norm, l2_norm, linf_norm):  # {{{
+    if thresholds['l1'] is not None and thresholds['l1'] < l1_norm:
+        return False
+    if thresholds['l2'] is not None and thresholds['l2'] < l2_norm:
+        return False
+    if thresholds['linf'] is not None and thresholds['linf'] < linf_norm:
+        return False
+    return True
+# }}}
+
+
+def compare_variable(f1, f2, variable, thresholds, quiet, chunk_size,
+                     bitwise=False, digests2=None):  # {{{
+    # Compare a variable between two open files. If bitwise is True, the
+    # digests of each time level are compared first, using those in digests2
+    # (the digest sidecar of the second file) if given, in which case f2 may
+    # be None. Returns whether the comparison passed, and the lines to print.
+    lines = list()
+
+    time_length = get_time_length(f1)
+
+    if f2 is not None:
+        filename2 = f2.filepath()
+        in_file2 = variable in f2.variables
+    else:
+        filename2 = digests2['file']
+        in_file2 = variable in digests2['variables']
+
+    if variable not in f1.variables or not in_file2:
+        lines.append("ERROR: Field '%s' does not exist in both" % (variable))
+        lines.append("           file1: %s" % (f1.filepath()))
+        lines.append("       and file2: %s" % (filename2))
+        lines.append("Exiting with a failed comparision, since no comparision "
+                     "can be done but a comparison was requested.")
+        return False, lines
+
+    field1 = f1.variables[variable]
+    field2 = None
+    if f2 is not None:
+        field2 = f2.variables[variable]
+        shape2 = field2.shape
+    else:
+        shape2 = tuple(digests2['variables'][variable]['shape'])
+
+    if not field1.shape == shape2:
+        lines.append("ERROR: Field sizes of '%s' don't match in different "
+                     "files." % (variable))
+        return False, lines
+
+    lines.append("Beginning variable comparisons for all time levels of field "
+                 "'%s'. Note any time levels reported are 0-based." %
+                 (variable))
+    if thresholds['l1'] is not None or thresholds['l2'] is not None or \
+            thresholds['linf'] is not None:
+        lines.append("    Pass thresholds are:")
+        if thresholds['l1'] is not None:
+            lines.append("       L1: %16.14e" % (thresholds['l1']))
+        if thresholds['l2'] is not None:
+            lines.append("       L2: %16.14e" % (thresholds['l2']))
+        if thresholds['linf'] is not None:
+            lines.append("       L_Infinity: %16.14e" % (thresholds['linf']))
+
+    field_dims = field1.dimensions
+    linf_norm = -(sys.float_info.max)
+    pass_val = True
+
+    levels2 = None
+    if digests2 is not None and variable in digests2['variables']:
+        levels2 = digests2['variables'][variable]['levels']
+
+    for index, (prefix, shape, label) in enumerate(get_levels(field1,
+                                                              time_length)):
+        identical = False
+        if bitwise:
+            digest1 = get_digest(field1, prefix, shape, chunk_size)
+            if levels2 is not None:
+                if index < len(levels2):
+                    identical = digest1 == levels2[index]['digest']
+            else:
+                identical = digest1 == get_digest(field2, prefix, shape,
+                                                  chunk_size)
+
+        if identical:
+            # Bit-for-bit identical, so all norms of the difference are zero
+            l1_norm, l2_norm, level_linf = 0.0, 0.0, 0.0
+        elif field2 is None:
+            # Only the digests of the second file are available
+            lines.append("%sdigest differs from %s, which has no data to "
+                         "compute norms with." % (label, filename2))
+            if index < len(levels2):
+                baseline = levels2[index]
+                lines.append(format_norms(
+                    '    norms of file1: ',
+                    *get_field_norms(field1, prefix, shape, chunk_size)))
+                lines.append(format_norms(
+                    '    norms of file2: ', baseline['l1'], baseline['l2'],
+                    baseline['linf']))
+            pass_val = False
+            continue
+        else:
+            l1_norm, l2_norm, level_linf = accumulate_norms(
+                field1, field2, prefix, shape, chunk_size)
+            if len(field_dims) >= 2:
+                l1_norm = l1_norm / np.sum(shape)
 
-        if args.l2_norm:
-            if float(args.l2_norm) < l2_norm:
-                pass_time = False
-        diff_str = '%s l2: %16.14e '%(diff_str, l2_norm)
+        if level_linf is not None and level_linf > linf_norm:
+            linf_norm = level_linf
 
-        if args.linf_norm:
-            if float(args.linf_norm) < linf_norm:
-                pass_time = False
-        diff_str = '%s linf: %16.14e '%(diff_str, linf_norm)
+        pass_time = check_norms(thresholds, l1_norm, l2_norm, linf_norm)
+        diff_str = format_norms(label, l1_norm, l2_norm, linf_norm)
 
-        if not args.quiet:
-            print(diff_str)
-        elif not pass_time:
-            print(diff_str)
+        if not quiet or not pass_time:
+            lines.append(diff_str)
 
         if not pass_time:
             pass_val = False
 
-        del diff
-else:
-    if len(field_dims) >= 2:
-        diff = np.absolute(field1[:] - field2[:])
+    return pass_val, lines
+# }}}
+
+
+def read_field_list(filename):  # {{{
+    # Read the variables and thresholds in a file given with --fields
+    variables = list()
+    with open(filename, 'r') as field_list:
+        for line in field_list:
+            words = line.split()
+            if len(words) == 0 or words[0].startswith('#'):
+                continue
+            thresholds = {'l1': None, 'l2': None, 'linf': None}
+            for word in words[1:]:
+                try:
+                    norm, value = word.split('=')
+                    if not norm.endswith('_norm'):
+                        raise ValueError
+                    norm = norm[:-len('_norm')]
+                    if norm not in thresholds:
+                        raise ValueError
+                    thresholds[norm] = float(value)
+                except ValueError:
+                    print("ERROR: Invalid threshold '%s' for field '%s' in "
+                          "%s." % (word, words[0], filename))
+                    print("Exiting...")
+                    sys.exit(1)
+            variables.append((words[0], thresholds))
+    return variables
+# }}}
+
+
+def print_summary(variable, filename1, filename2, passed):  # {{{
+    if passed:
+        result = 'PASS'
     else:
-        diff = np.absolute(field1[0] - field2[0])
-
-    l2_norm = np.sum(diff * diff)
-    l2_norm = np.sqrt(l2_norm)
-
-    l1_norm = np.sum(diff)
-    if len(field_dims) >= 2:
-        l1_norm = l1_norm / np.sum(field1[:].shape)
-    l1_norm = np.max(l1_norm)
-
-    if np.amax(diff) > linf_norm:
-        linf_norm = np.amax(diff)
+        result = 'FAIL'
+    print(" ** %s Comparison of %s between %s and\n    %s" %
+          (result, variable, filename1, filename2))
+# }}}
 
-    diff_str = ''
-    if args.l1_norm:
-        if float(args.l1_norm) < l1_norm:
-            pass_val = False
-    diff_str = '%s l1: %16.14e '%(diff_str, l1_norm)
-
-    if args.l2_norm:
-        if float(args.l2_norm) < l2_norm:
-            pass_val = False
-    diff_str = '%s l2: %16.14e '%(diff_str, l2_norm)
-
-    if args.linf_norm:
-        if float(args.linf_norm) < linf_norm:
-            pass_val = False
-    diff_str = '%s linf: %16.14e '%(diff_str, linf_norm)
-
-    if not args.quiet:
-        print(diff_str)
-    elif not pass_val:
-        print(diff_str)
 
-    del diff
+def init_worker(filename1, filename2, digests2):  # {{{
+    worker_files['f1'] = NetCDFFile(filename1, 'r')
+    if os.path.exists(filename2):
+        worker_files['f2'] = NetCDFFile(filename2, 'r')
+    else:
+        worker_files['f2'] = None
+    worker_files['digests2'] = digests2
+# }}}
+
+
+def close_worker_files():  # {{{
+    worker_files['f1'].close()
+    if worker_files['f2'] is not None:
+        worker_files['f2'].close()
+# }}}
+
+
+def compare_variable_worker(args):  # {{{
+    variable, thresholds, quiet, chunk_size, bitwise = args
+    return compare_variable(worker_files['f1'], worker_files['f2'], variable,
+                            thresholds, quiet, chunk_size, bitwise,
+                            worker_files['digests2'])
+# }}}
+
+
+def compare_variables(filename1, filename2, variables, quiet, chunk_size,
+                      processes, summary=False, bitwise=False,
+                      digests2=None):  # {{{
+    # Compare each variable, a tuple of its name and thresholds, printing the
+    # results of each variable in order, followed by a PASS or FAIL line if
+    # summary is True. Returns True if all comparisons passed.
+    tasks = [(variable, thresholds, quiet, chunk_size, bitwise)
+             for variable, thresholds in variables]
+
+    if processes > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(processes, len(tasks)),
+                    initializer=init_worker,
+                    initargs=(filename1, filename2, digests2))
+        results = pool.imap(compare_variable_worker, tasks)
+    else:
+        pool = None
+        init_worker(filename1, filename2, digests2)
+        results = (compare_variable_worker(task) for task in tasks)
+
+    all_passed = True
+    for (variable, _), (passed, lines) in zip(variables, results):
+        for line in lines:
+            print(line)
+        if summary:
+            print_summary(variable, filename1, filename2, passed)
+        sys.stdout.flush()
+        if not passed:
+            all_passed = False
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    else:
+        close_worker_files()
+
+    return all_passed
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-1", "--file1", dest="filename1",
+                        help="first input file", metavar="FILE")
+    parser.add_argument("-2", "--file2", dest="filename2",
+                        help="second input file", metavar="FILE")
+    parser.add_argument("-v", "--var", dest="variables", action="append",
+                        help="variable to compute error with. Can be given "
+                             "more than once.", metavar="VAR")
+    parser.add_argument("--l2", dest="l2_norm",
+                        help="value of L2 norm for a pass.", metavar="VAL")
+    parser.add_argument("--l1", dest="l1_norm",
+                        help="value of L1 norm for a pass.", metavar="VAL")
+    parser.add_argument("--linf", dest="linf_norm",
+                        help="value of L_Infinity norm for a pass.",
+                        metavar="VAL")
+    parser.add_argument("-q", "--quiet", dest="quiet",
+                        help="turns off printing if diff passes test.",
+                        action="store_true")
+    parser.add_argument("--fields", dest="field_list",
+                        help="file listing variables to compare, with their "
+                             "thresholds.", metavar="FILE")
+    parser.add_argument("--summary", dest="summary",
+                        help="print a PASS or FAIL line for each variable.",
+                        action="store_true")
+    parser.add_argument("--bitwise", dest="bitwise",
+                        help="compare digests of each time level first, and "
+                             "only compute norms where they differ.",
+                        action="store_true")
+    parser.add_argument("-j", "--jobs", dest="processes", type=int, default=1,
+                        help="number of variables to compare in parallel.",
+                        metavar="N")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int,
+                        default=1048576,
+                        help="maximum number of values of a field to read at "
+                             "once.", metavar="N")
+
+    args = parser.parse_args()
+
+    if not args.filename1:
+        parser.error("Two filenames are required inputs.")
+
+    if not args.filename2:
+        parser.error("Two filenames are required inputs.")
+
+    if not args.variables and not args.field_list:
+        parser.error("Variable is a required input.")
+
+    if args.processes < 1 or args.chunk_size < 1:
+        parser.error("--jobs and --chunk_size must be at least 1.")
+
+    thresholds = dict()
+    for norm, value in [('l1', args.l1_norm), ('l2', args.l2_norm),
+                        ('linf', args.linf_norm)]:
+        if value:
+            thresholds[norm] = float(value)
+        else:
+            thresholds[norm] = None
+
+    variables = list()
+    if args.variables:
+        variables.extend([(variable, thresholds)
+                          for variable in args.variables])
+    if args.field_list:
+        variables.extend(read_field_list(args.field_list))
+
+    for _, variable_thresholds in variables:
+        if variable_thresholds['l1'] is None and \
+                variable_thresholds['l2'] is None and \
+                variable_thresholds['linf'] is None:
+            print("WARNING: Script will pass since no norm values have been "
+                  "defined.")
+            break
+
+    files_exist = True
+
+    if not os.path.exists(args.filename1):
+        print("ERROR: File %s does not exist. Comparison will FAIL." %
+              (args.filename1))
+        files_exist = False
+
+    digests2 = None
+    if args.bitwise:
+        digests2 = read_sidecar(args.filename2)
+
+    if not os.path.exists(args.filename2) and digests2 is None:
+        print("ERROR: File %s does not exist. Comparison will FAIL." %
+              (args.filename2))
+        files_exist = False
+
+    if not files_exist:
+        if args.summary:
+            for variable, _ in variables:
+                print_summary(variable, args.filename1, args.filename2, False)
+        sys.exit(1)
+
+    if compare_variables(args.filename1, args.filename2, variables,
+                         args.quiet, args.chunk_size, args.processes,
+                         args.summary, args.bitwise, digests2):
+        sys.exit(0)
+    else:
+        sys.exit(1)
 
-if pass_val:
-    sys.exit(0)
-else:
-    sys.exit(1)
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
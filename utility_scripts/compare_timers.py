@@ -1,79 +1,442 @@
 #!/usr/bin/env python
+"""
+This script compares timers between run directories, written either by the
+built-in MPAS timers (log.*.out) or by GPTL (timing.*, one file per rank).
+
+Each run directory is read only once, into a table of the total time and the
+number of calls of each timer in each file (rank). The time of a timer in a
+run is its largest total over the ranks, which is the single total for runs
+with one timer file.
+
+Any number of timers (-t) can be compared between any number of pairs of run
+directories in one call. Each comparison directory (-c) is compared with the
+base directory (-b) given in the same position, or with the only base
+directory if just one is given. If more than one timer or pair of directories
+is compared, the speedup of each timer in each pair is also printed as a
+matrix.
+
+Base and comparison directories can be glob patterns (e.g. 'forward_*'), in
+which case each matching directory is a repeated run of the same case, and
+the median time of a timer over the runs is compared. With --max_slowdown,
+the script fails if a timer is significantly slower in the comparison runs:
+if the lower end of the bootstrap confidence interval of the relative change
+of its median time exceeds the given fraction (e.g. 0.05 for 5%). A verdict
+needs at least two runs on each side.
+
+A timer that isn't found in a run directory is reported as MISSING, and makes
+the script fail. With --skip_missing, pairs of directories where either
+doesn't exist are skipped instead of failing, but their timers must still be
+found in the directories that do exist.
+"""
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
 import os
+import sys
+import glob
+import math
+import random
 import fnmatch
 import argparse
 import re
 
-def find_timer_value(timer_name, directory):#{{{
-    # Build a regular expression for any two characters with a space between them.
-    regex = re.compile(r'(\S) (\S)')
+# Regular expression for any two characters with a space between them, used
+# to join the words of timer names with underscores
+word_regex = re.compile(r'(\S) (\S)')
+
+
+def get_timer_format(file_name):  # {{{
+    # The format of a timer file, 'mpas' or 'gptl', or None if it isn't a
+    # timer file
+    # Files written using built in MPAS timers
+    if fnmatch.fnmatch(file_name, "log.*.out"):
+        return 'mpas'
+    # Files written using GPTL timers, one per rank
+    if fnmatch.fnmatch(file_name, "timing.*") and \
+            file_name != 'timing.summary':
+        return 'gptl'
+    return None
+# }}}
+
+
+def parse_number(value):  # {{{
+    try:
+        return float(value)
+    except ValueError:
+        return None
+# }}}
+
+
+def parse_mpas_timer_line(line):  # {{{
+    # The nesting level (starting at 1), name, total time and number of calls
+    # of a timer line of an MPAS log, which starts with the level followed by
+    # the (indented) name, or None if the line isn't a timer line
+    tokens = line.split()
+    if len(tokens) < 7:
+        return None
+    try:
+        level = int(tokens[0])
+    except ValueError:
+        return None
+    # The name can contain spaces, and ends before the first number
+    name_end = 1
+    while name_end < len(tokens) and parse_number(tokens[name_end]) is None:
+        name_end += 1
+    if name_end == 1 or len(tokens) < name_end + 6:
+        return None
+    total = parse_number(tokens[name_end])
+    calls = parse_number(tokens[name_end + 1])
+    if calls is None:
+        return None
+    return level, ' '.join(tokens[1:name_end]), total, int(calls)
+# }}}
+
 
+def add_timer_total(timers, name, total, calls):  # {{{
+    # Add to the total time and number of calls of a timer, whose name has
+    # its words joined by underscores
+    name = name.replace(' ', '_')
+    if name in timers:
+        timers[name][0] += total
+        timers[name][1] += calls
+    else:
+        timers[name] = [total, calls]
+# }}}
+
+
+def read_mpas_timer_file(path):  # {{{
+    # Read the total time and number of calls of each timer in an MPAS log,
+    # summing those of timers with the same name
+    timers = dict()
+    with open(path, 'r') as stats_file:
+        for line in stats_file:
+            timer = parse_mpas_timer_line(line)
+            if timer is not None:
+                add_timer_total(timers, *timer[1:])
+    return timers
+# }}}
+
+
+def read_gptl_timer_file(path):  # {{{
+    # Read the total time and number of calls of each timer in a GPTL timing
+    # file, summing those of timers with the same name
+    timer_line_size = 6
+    timers = dict()
+    with open(path, 'r') as stats_file:
+        for block in stats_file:
+            block_arr = word_regex.sub(r"\1_\2", block[2:]).split()
+            if len(block_arr) < timer_line_size:
+                continue
+            total = parse_number(block_arr[3])
+            if total is None:
+                continue
+            calls = parse_number(block_arr[1])
+            if calls is None:
+                calls = 0
+            add_timer_total(timers, block_arr[0], total, int(calls))
+    return timers
+# }}}
+
+
+def read_timers(directory):  # {{{
+    # Read all timer files in a directory, returning a list with the timers
+    # of each rank
+    ranks = list()
+    for file_name in sorted(os.listdir(directory)):
+        timer_format = get_timer_format(file_name)
+        path = '{}/{}'.format(directory, file_name)
+        if timer_format == 'mpas':
+            timers = read_mpas_timer_file(path)
+        elif timer_format == 'gptl':
+            timers = read_gptl_timer_file(path)
+        else:
+            continue
+        if len(timers) > 0:
+            ranks.append(timers)
+    return ranks
+# }}}
+
+
+def get_timer_stats(ranks, timer_name):  # {{{
+    # The statistics of a timer over the ranks it was found on, or None if it
+    # wasn't found. As in the timer files, the words of the name are joined
+    # by underscores, and each timer whose name is part of it is included.
     sub_timer_name = timer_name.replace(' ', '_')
+    totals = list()
+    calls = 0
+    for timers in ranks:
+        found = False
+        total = 0.0
+        for name in timers:
+            if sub_timer_name.find(name) >= 0:
+                found = True
+                total += timers[name][0]
+                calls += timers[name][1]
+        if found:
+            totals.append(total)
+    if len(totals) == 0:
+        return None
+    return {'total': max(totals), 'min': min(totals), 'max': max(totals),
+            'mean': sum(totals) / len(totals), 'ranks': len(totals),
+            'calls': calls}
+# }}}
+
+
+def get_sample_stats(samples, timer_name):  # {{{
+    # The statistics of a timer in each run of a list of repeated runs (the
+    # timers of the ranks of each), with its median total time over the runs
+    # it was found in, or None if it wasn't found in any
+    stats = [get_timer_stats(ranks, timer_name) for ranks in samples]
+    stats = [run_stats for run_stats in stats if run_stats is not None]
+    if len(stats) == 0:
+        return None
+    totals = [run_stats['total'] for run_stats in stats]
+    return {'total': get_median(totals), 'samples': totals, 'runs': stats}
+# }}}
+
 
-    timer = 0.0
-    timer_found = False
-    for file in os.listdir(directory):
-        if not timer_found:
-            process_file = False
-            # Compare files written using built in MPAS timers
-            if fnmatch.fnmatch(file, "log.*.out"):
-                timer_line_size = 6
-                name_index = 0
-                total_index = 1
-                process_file = True
-            # Compare files written using GPTL timers
-            elif fnmatch.fnmatch(file, "timing.*"):
-                timer_line_size = 6
-                name_index = 0
-                total_index = 3
-                process_file = True
-
-            if process_file:
-                stats_file = open('%s/%s'%(directory, file), "r")
-                for block in iter(lambda: stats_file.readline(), ""):
-                    new_block = regex.sub(r"\1_\2", block[2:])
-                    new_block_arr = new_block.split()
-                    if len(new_block_arr) >= timer_line_size:
-                        if sub_timer_name.find(new_block_arr[name_index]) >= 0:
-                            try:
-                                timer = timer + float(new_block_arr[total_index])
-                                timer_found = True
-                            except ValueError:
-                                timer = timer
-                        del new_block
-                    del new_block_arr
-
-    return timer_found, timer
-#}}}
-
-# Define and process input arguments
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('-b', '--base_directory', dest="base_directory", help="Directory with the baseline timer information.", required=True)
-parser.add_argument('-c', '--comparison_directory', dest="comparison_directory", help="Directory with the comparison timer information.", required=True)
-parser.add_argument('-t', '--timer', dest="timer", help="Name of the timer to compare", required=True)
-parser.add_argument('-s', '--speedup', dest="speedup", help="If set, only speedup will be printed. This is useful when making speedup plots.", action="store_true")
-
-args = parser.parse_args()
-
-timer1_found, timer1 = find_timer_value(args.timer, args.base_directory)
-timer2_found, timer2 = find_timer_value(args.timer, args.comparison_directory)
-
-if timer1_found and timer2_found:
+def get_median(values):  # {{{
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return 0.5 * (values[middle - 1] + values[middle])
+# }}}
+
+
+def get_speedup(base, compare):  # {{{
     try:
-        speedup = timer1 / timer2
-    except:
-        speedup = 1.0
-
-    percent = (timer2 - timer1) / timer1
-
-    if not args.speedup:
-        print("Comparing timer %s:"%(args.timer))
-        print("             Base: %lf"%(timer1))
-        print("          Compare: %lf"%(timer2))
-        print("   Percent Change: %lf%%"%(percent*100))
-        print("          Speedup: %lf"%(speedup))
+        return base['total'] / compare['total']
+    except ZeroDivisionError:
+        return 1.0
+# }}}
+
+
+def get_change_interval(base, compare, confidence, resamples):  # {{{
+    # The bootstrap confidence interval of the relative change of the median
+    # time from the base runs to the comparison runs. The random numbers are
+    # seeded, so the interval is the same each time for the same times.
+    generator = random.Random(0)
+    changes = list()
+    for _ in range(resamples):
+        base_median = get_median([generator.choice(base) for _ in base])
+        compare_median = get_median([generator.choice(compare)
+                                     for _ in compare])
+        if base_median > 0.0:
+            changes.append(compare_median / base_median - 1.0)
+        else:
+            changes.append(0.0)
+    changes.sort()
+    alpha = 0.5 * (1.0 - confidence)
+    lower = changes[int(math.floor(alpha * (resamples - 1)))]
+    upper = changes[int(math.ceil((1.0 - alpha) * (resamples - 1)))]
+    return lower, upper
+# }}}
+
+
+def get_verdict(base, compare, max_slowdown, confidence,
+                resamples):  # {{{
+    # Whether the comparison runs are significantly slower than the base runs
+    # by more than max_slowdown, as 'PASS', 'FAIL' or 'INCONCLUSIVE' (with
+    # too few runs to tell), along with a line describing it
+    if len(base['samples']) < 2 or len(compare['samples']) < 2:
+        return 'INCONCLUSIVE', \
+            "          Verdict: INCONCLUSIVE (at least 2 runs per side are " \
+            "needed)"
+
+    lower, upper = get_change_interval(base['samples'], compare['samples'],
+                                       confidence, resamples)
+    lines = "    Change CI %2d%%: %+.2f%% to %+.2f%%\n" % (
+        round(100 * confidence), 100 * lower, 100 * upper)
+    if lower > max_slowdown:
+        return 'FAIL', lines + \
+            "          Verdict: FAIL (slower by more than %.2f%%)" % (
+                100 * max_slowdown)
+    return 'PASS', lines + \
+        "          Verdict: PASS (not significantly slower by more than " \
+        "%.2f%%)" % (100 * max_slowdown)
+# }}}
+
+
+def print_comparison(timer_name, base, compare):  # {{{
+    timer1 = base['total']
+    timer2 = compare['total']
+    if timer1 != 0.0:
+        percent = (timer2 - timer1) / timer1
     else:
-        print("%lf"%(speedup))
+        percent = 0.0
+
+    print("Comparing timer %s:" % (timer_name))
+    for label, stats in [('Base', base), ('Compare', compare)]:
+        if len(stats['samples']) > 1:
+            print("%17s: %lf (median of %d runs, min: %lf  max: %lf)" % (
+                label, stats['total'], len(stats['samples']),
+                min(stats['samples']), max(stats['samples'])))
+        else:
+            print("%17s: %lf" % (label, stats['total']))
+    print("   Percent Change: %lf%%" % (percent * 100))
+    print("          Speedup: %lf" % (get_speedup(base, compare)))
+    for label, stats in [('Base', base), ('Compare', compare)]:
+        if len(stats['runs']) > 1:
+            continue
+        run_stats = stats['runs'][0]
+        if run_stats['ranks'] > 1:
+            print("   %s ranks: %d  min: %lf  mean: %lf  max: %lf  calls: %d"
+                  % (label, run_stats['ranks'], run_stats['min'],
+                     run_stats['mean'], run_stats['max'],
+                     run_stats['calls']))
+# }}}
+
+
+def print_speedup_matrix(timers, pairs, speedups):  # {{{
+    # Print the speedup of each timer (rows) for each pair of directories
+    # (columns), with '-' where the timer wasn't found in both
+    name_width = max([len(timer_name) for timer_name in timers] + [5])
+    print("Speedup (base time / comparison time):")
+    header = '{:<{}}'.format('Timer', name_width)
+    for index in range(len(pairs)):
+        header += '  {:>12}'.format('[{}]'.format(index + 1))
+    print(header)
+    for timer_name in timers:
+        line = '{:<{}}'.format(timer_name, name_width)
+        for index in range(len(pairs)):
+            speedup = speedups.get((timer_name, index))
+            if speedup is None:
+                line += '  {:>12}'.format('-')
+            else:
+                line += '  {:12.6f}'.format(speedup)
+        print(line)
+    for index, (base_directory, comparison_directory) in enumerate(pairs):
+        print("  [{}] {} vs. base {}".format(index + 1, comparison_directory,
+                                            base_directory))
+# }}}
+
+
+if __name__ == "__main__":
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-b', '--base_directory', dest="base_directories",
+                        action="append", required=True,
+                        help="Directory with the baseline timer information. "
+                             "Can be given more than once.")
+    parser.add_argument('-c', '--comparison_directory',
+                        dest="comparison_directories", action="append",
+                        required=True,
+                        help="Directory with the comparison timer "
+                             "information. Can be given more than once.")
+    parser.add_argument('-t', '--timer', dest="timers", action="append",
+                        required=True,
+                        help="Name of the timer to compare. Can be given "
+                             "more than once.")
+    parser.add_argument('-s', '--speedup', dest="speedup",
+                        help="If set, only speedup will be printed. This is "
+                             "useful when making speedup plots.",
+                        action="store_true")
+    parser.add_argument('--skip_missing', dest="skip_missing",
+                        help="If set, pairs of directories where either "
+                             "doesn't exist are skipped.",
+                        action="store_true")
+    parser.add_argument('--max_slowdown', dest="max_slowdown", type=float,
+                        help="Fail if a timer is significantly slower in the "
+                             "comparison runs by more than this fraction.",
+                        metavar="FRAC")
+    parser.add_argument('--confidence', dest="confidence", type=float,
+                        default=0.95,
+                        help="Confidence level of the interval of the change "
+                             "in time (default: 0.95).", metavar="LEVEL")
+    parser.add_argument('--resamples', dest="resamples", type=int,
+                        default=2000,
+                        help="Number of bootstrap resamples (default: 2000).",
+                        metavar="N")
+
+    args = parser.parse_args()
+
+    base_directories = args.base_directories
+    if len(base_directories) == 1:
+        base_directories = base_directories * \
+            len(args.comparison_directories)
+    if len(base_directories) != len(args.comparison_directories):
+        parser.error('Give either one base directory, or one for each '
+                     'comparison directory.')
+    if not 0.0 < args.confidence < 1.0:
+        parser.error('The confidence level must be between 0 and 1.')
+
+    # Pairs of base and comparison directories (or patterns), with the
+    # directories of the runs each matches
+    pairs = list()
+    pair_runs = list()
+    for base_directory, comparison_directory in \
+            zip(base_directories, args.comparison_directories):
+        runs = list()
+        for pattern in [base_directory, comparison_directory]:
+            runs.append(sorted([directory for directory in glob.glob(pattern)
+                                if os.path.isdir(directory)]))
+        missing = [pattern for pattern, directories in
+                   zip([base_directory, comparison_directory], runs)
+                   if len(directories) == 0]
+        if len(missing) == 0:
+            pairs.append((base_directory, comparison_directory))
+            pair_runs.append(runs)
+        elif not args.skip_missing:
+            print("ERROR: Directory {} does not exist.".format(missing[0]))
+            print("Exiting...")
+            sys.exit(1)
+
+    # Read each directory only once
+    directory_timers = dict()
+    for runs in pair_runs:
+        for directory in runs[0] + runs[1]:
+            if directory not in directory_timers:
+                directory_timers[directory] = read_timers(directory)
+
+    speedups = dict()
+    failures = 0
+    missing_timers = 0
+    for timer_name in args.timers:
+        for index, (base_runs, comparison_runs) in enumerate(pair_runs):
+            missing = [directory for directory in base_runs + comparison_runs
+                       if get_timer_stats(directory_timers[directory],
+                                          timer_name) is None]
+            if len(missing) > 0:
+                print("Comparing timer %s:" % (timer_name))
+                print("          Verdict: MISSING (not found in %s)"
+                      % (', '.join(missing)))
+                missing_timers += 1
+                continue
+
+            base = get_sample_stats([directory_timers[directory]
+                                     for directory in base_runs], timer_name)
+            compare = get_sample_stats([directory_timers[directory]
+                                        for directory in comparison_runs],
+                                       timer_name)
+
+            speedups[(timer_name, index)] = get_speedup(base, compare)
+            if not args.speedup:
+                print_comparison(timer_name, base, compare)
+            else:
+                print("%lf" % (speedups[(timer_name, index)]))
+
+            if args.max_slowdown is not None:
+                verdict, lines = get_verdict(base, compare, args.max_slowdown,
+                                             args.confidence, args.resamples)
+                if not args.speedup:
+                    print(lines)
+                if verdict == 'FAIL':
+                    failures += 1
+
+    if not args.speedup and len(pairs) > 0 and \
+            (len(args.timers) > 1 or len(pairs) > 1):
+        print_speedup_matrix(args.timers, pairs, speedups)
+
+    if missing_timers > 0:
+        print("ERROR: {} timer comparisons are missing the timer in some "
+              "runs.".format(missing_timers))
+    if failures > 0:
+        print("ERROR: {} timer comparisons are slower by more than {:.2f}%."
+              .format(failures, 100 * args.max_slowdown))
+    if missing_timers > 0 or failures > 0:
+        print("Exiting...")
+        sys.exit(1)
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
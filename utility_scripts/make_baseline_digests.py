@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+This script writes a digest sidecar (FILE.digests.json) next to each netCDF
+file (*.nc) in the given files and directories (e.g. a baseline directory),
+for use by compare_fields.py --bitwise.
+
+A sidecar holds, for each time level of each numeric variable in the file, a
+digest of its values as stored in the file, along with the L1, L2 and
+L_Infinity norms of the values. Comparisons against a file with an up-to-date
+sidecar only compare digests, so the file itself is only read for time levels
+that differ, and can even be removed (in which case the norms in the sidecar
+are reported for time levels that differ).
+
+Sidecars that are newer than their files are left alone, unless --force is
+given.
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+
+from compare_fields import get_file_digests, get_sidecar_name
+
+
+def find_files(paths):  # {{{
+    # The netCDF files in paths, searching directories recursively
+    files = list()
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                filename = os.path.join(root, name)
+                if name.endswith('.nc') and os.path.isfile(filename):
+                    files.append(filename)
+    return files
+# }}}
+
+
+def sidecar_is_current(filename):  # {{{
+    sidecar = get_sidecar_name(filename)
+    return os.path.exists(sidecar) and \
+        os.path.getmtime(sidecar) >= os.path.getmtime(filename)
+# }}}
+
+
+def write_sidecar(args):  # {{{
+    # Write the sidecar of a file, returning the number of variables in it
+    filename, chunk_size = args
+    digests = get_file_digests(filename, chunk_size)
+    sidecar = get_sidecar_name(filename)
+    with open('{}.tmp'.format(sidecar), 'w') as sidecar_file:
+        json.dump(digests, sidecar_file, indent=1, sort_keys=True)
+    os.rename('{}.tmp'.format(sidecar), sidecar)
+    return filename, len(digests['variables'])
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("paths", nargs='+',
+                        help="netCDF files, or directories to search for "
+                             "them.", metavar="PATH")
+    parser.add_argument("-f", "--force", dest="force",
+                        help="rewrite sidecars that are up to date.",
+                        action="store_true")
+    parser.add_argument("-j", "--jobs", dest="processes", type=int, default=1,
+                        help="number of files to process in parallel.",
+                        metavar="N")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int,
+                        default=1048576,
+                        help="maximum number of values of a field to read "
+                             "at once.", metavar="N")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if not os.path.exists(path):
+            print("ERROR: {} does not exist.".format(path))
+            print("Exiting...")
+            sys.exit(1)
+
+    files = find_files(args.paths)
+    if not args.force:
+        skipped = [filename for filename in files
+                   if sidecar_is_current(filename)]
+        files = [filename for filename in files if filename not in skipped]
+        for filename in skipped:
+            print(" -- Unchanged file {}".format(filename))
+
+    tasks = [(filename, args.chunk_size) for filename in files]
+    if args.processes > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(args.processes, len(tasks)))
+        results = pool.imap(write_sidecar, tasks)
+    else:
+        pool = None
+        results = (write_sidecar(task) for task in tasks)
+
+    for filename, count in results:
+        print(" -- Wrote digests of {} variables of {}".format(count,
+                                                              filename))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -1,64 +1,139 @@
 #!/usr/bin/env python
+"""
+This script writes the graph of the cells of an MPAS mesh (graph.info) in the
+format read by METIS, optionally with vertex weights from one or more fields
+of the mesh.
+
+The adjacency of the cells is built with numpy in compressed sparse row form
+from cellsOnCell and nEdgesOnCell, and the graph is written in blocks of
+--block_size cells. With more than one weight field (-w given more than once),
+each cell gets one weight per field, which METIS balances separately.
+"""
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
-import os
 import numpy as np
 
 import argparse
 
-from netCDF4 import *
 from netCDF4 import Dataset as NetCDFFile
 
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-f", "--file", dest="filename", help="Path to grid file", metavar="FILE", required=True)
-parser.add_argument("-w", "--weights", dest="weight_field", help="Field to weight block partition file on.", metavar="VAR")
-
-args = parser.parse_args()
-
-if not args.weight_field:
-    print("Weight field missing. Defaulting to unweighted graphs.")
-    weighted_parts = False
-else:
-    weighted_parts = True
-
-dev_null = open(os.devnull, 'w')
-grid = NetCDFFile(args.filename, 'r')
-
-nCells = len(grid.dimensions['nCells'])
-nEdges = len(grid.dimensions['nEdges'])
-
-nEdgesOnCell = grid.variables['nEdgesOnCell'][:]
-cellsOnCell = grid.variables['cellsOnCell'][:] - 1
-if weighted_parts:
-    try:
-        weights = grid.variables[args.weight_field][:]
-    except:
-        print(args.weight_field, ' not found in file. Defaulting to un-weighted partitions.')
-        weighted_parts = False
-grid.close()
-
-nEdges = 0
-for i in np.arange(0, nCells):
-    for j in np.arange(0,nEdgesOnCell[i]):
-        if cellsOnCell[i][j] != -1:
-            nEdges = nEdges + 1
-
-nEdges = nEdges/2
-
-graph = open('graph.info', 'w+')
-if weighted_parts:
-    graph.write('%s %s 010\n'%(nCells, nEdges))
-else:
-    graph.write('%s %s\n'%(nCells, nEdges))
-
-for i in np.arange(0, nCells):
-    if weighted_parts:
-        graph.write('%s '%int(weights[i]))
-
-    for j in np.arange(0,nEdgesOnCell[i]):
-        if(cellsOnCell[i][j] >= 0):
-            graph.write('%s '%(cellsOnCell[i][j]+1))
-    graph.write('\n')
-graph.close()
 
+def get_adjacency(cellsOnCell, nEdgesOnCell):  # {{{
+    # The adjacency of the cells in compressed sparse row form: the (1-based)
+    # neighbors of cell i are adjncy[xadj[i]:xadj[i+1]], in the order of
+    # cellsOnCell
+    cellsOnCell = np.ma.filled(cellsOnCell, 0).astype(np.int64)
+    nEdgesOnCell = np.ma.filled(nEdgesOnCell, 0)
+    valid = np.logical_and(
+        cellsOnCell > 0,
+        np.arange(cellsOnCell.shape[1])[np.newaxis, :] <
+        nEdgesOnCell[:, np.newaxis])
+    xadj = np.zeros(cellsOnCell.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.sum(valid, axis=1), out=xadj[1:])
+    adjncy = cellsOnCell[valid]
+    return xadj, adjncy
+# }}}
+
+
+def get_weights(grid, weight_fields):  # {{{
+    # The weights of the cells from each field that exists in the grid, as an
+    # array of shape (nCells, number of fields)
+    weights = list()
+    for weight_field in weight_fields:
+        if weight_field not in grid.variables:
+            print(weight_field, ' not found in file. Leaving it out of the '
+                  'weights.')
+            continue
+        weights.append(np.ma.filled(grid.variables[weight_field][:],
+                                    0).astype(np.int64))
+    if len(weights) == 0:
+        return None
+    return np.stack(weights, axis=1)
+# }}}
+
+
+def format_block(xadj, adjncy, weights, start, end):  # {{{
+    # The lines of the graph for cells start to end-1, each with the weights
+    # of the cell (if any) and its neighbors, each followed by a space
+    counts = np.diff(xadj[start:end + 1])
+    neighbors = adjncy[xadj[start]:xadj[end]]
+    if weights is not None:
+        ncon = weights.shape[1]
+        # Place the weights of each cell before its neighbors
+        row_starts = xadj[start:end] - xadj[start] + \
+            ncon * np.arange(end - start)
+        values = np.zeros(len(neighbors) + ncon * (end - start),
+                          dtype=np.int64)
+        is_weight = np.zeros(len(values), dtype=bool)
+        for index in range(ncon):
+            is_weight[row_starts + index] = True
+        values[is_weight] = weights[start:end, :].ravel()
+        values[~is_weight] = neighbors
+        counts = counts + ncon
+    else:
+        values = neighbors
+
+    tokens = np.char.add(values.astype(np.str_), ' ')
+    row_ends = np.cumsum(counts)
+    tokens = np.insert(tokens.astype(object), row_ends, '\n')
+    return ''.join(tokens.tolist())
+# }}}
+
+
+def write_graph(filename, xadj, adjncy, weights, block_size):  # {{{
+    nCells = len(xadj) - 1
+    nEdges = len(adjncy) // 2
+    graph = open(filename, 'w')
+    if weights is None:
+        graph.write('%d %d\n' % (nCells, nEdges))
+    elif weights.shape[1] == 1:
+        graph.write('%d %d 010\n' % (nCells, nEdges))
+    else:
+        graph.write('%d %d 010 %d\n' % (nCells, nEdges, weights.shape[1]))
+
+    for start in range(0, nCells, block_size):
+        end = min(start + block_size, nCells)
+        graph.write(format_block(xadj, adjncy, weights, start, end))
+    graph.close()
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--file", dest="filename",
+                        help="Path to grid file", metavar="FILE",
+                        required=True)
+    parser.add_argument("-w", "--weights", dest="weight_fields",
+                        action="append",
+                        help="Field to weight block partition file on. Can "
+                             "be given more than once.", metavar="VAR")
+    parser.add_argument("-o", "--output", dest="output", default="graph.info",
+                        help="Path to the graph file to write (default: "
+                             "graph.info)", metavar="FILE")
+    parser.add_argument("--block_size", dest="block_size", type=int,
+                        default=100000,
+                        help="Number of cells to write at once",
+                        metavar="N")
+
+    args = parser.parse_args()
+
+    grid = NetCDFFile(args.filename, 'r')
+
+    weights = None
+    if not args.weight_fields:
+        print("Weight field missing. Defaulting to unweighted graphs.")
+    else:
+        weights = get_weights(grid, args.weight_fields)
+        if weights is None:
+            print("No weight fields found. Defaulting to un-weighted "
+                  "partitions.")
+
+    xadj, adjncy = get_adjacency(grid.variables['cellsOnCell'][:],
+                                 grid.variables['nEdgesOnCell'][:])
+    grid.close()
+
+    write_graph(args.output, xadj, adjncy, weights, args.block_size)
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -8,50 +8,264 @@ with the -o flag.  Parameter names and values are provided as a list with
 the -p flag using syntax as in this example:
 -p param1=1,2,3 param2=1e3,1e4,1e5 param3='a','b','c' \\
    param4=.true.,.false.,.true.
-The number of parameter values must be the same for all parameters and all
-parameters are varied simultaneously.
+
+The --sampling flag selects how parameter values are combined into variants:
+  zip        (default) the number of parameter values must be the same for
+             all parameters and all parameters are varied simultaneously.
+  cartesian  every combination of the values of all parameters.
+  lhs        --samples variants from a Latin hypercube, so each parameter
+             has one value in each of --samples equal strata of its range.
+             Ranges are given as param=low:high (or param=low:high:log to
+             sample the logarithm of the parameter), and lists of values are
+             sampled with each value in equal shares.
+
+The dummy string @variant is replaced with the number of each variant,
+which can be used to give each variant a unique case name, e.g.
+<config case="forward_@variant">.
+
+A manifest mapping the number of each variant to its config file, case name
+and parameter values is written (as JSON) to PREFIX_manifest.json, or the
+file given with --manifest.  Config files listed in an existing manifest
+that are not written again are removed, so a sweep can be redone with fewer
+variants.
 """
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
+import os
+import sys
+import json
+import math
+import random
 import argparse
+import itertools
+import xml.etree.ElementTree as ET
+
 
-def write_from_template(inFile,outFile,replacements):
+def fill_template(lines, replacements):  # {{{
+    # Replace longer dummy strings first, so @param10 isn't replaced as
+    # @param1 followed by 0
+    sources = sorted(replacements, key=len, reverse=True)
+    text = ''
+    for line in lines:
+        for src in sources:
+            line = line.replace(src, replacements[src])
+        text += line
+    return text
+# }}}
+
+
+def write_from_template(inFile, outFile, replacements):  # {{{
     inID = open(inFile)
     outID = open(outFile, 'w')
-
-    for line in inID:
-        for src, target in replacements.iteritems():
-            line = line.replace(src, target)
-        outID.write(line)
+    outID.write(fill_template(inID, replacements))
     inID.close()
     outID.close()
+# }}}
+
+
+def parse_range(valueString):  # {{{
+    # A range of values low:high or low:high:log as a (low, high, log) tuple,
+    # or None if valueString isn't a range
+    rangeValues = valueString.split(':')
+    if len(rangeValues) not in [2, 3] or \
+            (len(rangeValues) == 3 and rangeValues[2] != 'log'):
+        return None
+    try:
+        low = float(rangeValues[0])
+        high = float(rangeValues[1])
+    except ValueError:
+        return None
+    return (low, high, len(rangeValues) == 3)
+# }}}
+
+
+def parse_parameters(parameterStrings, sampling):  # {{{
+    # The names of the parameters, in order, and their values: lists of
+    # strings, or (low, high, log) tuples for ranges with --sampling lhs
+    names = []
+    parameters = {}
+    for parameterString in parameterStrings:
+        (parameter, valueString) = parameterString.split('=', 1)
+        values = None
+        if sampling == 'lhs':
+            values = parse_range(valueString)
+        if values is None:
+            values = valueString.split(',')
+        elif values[2] and (values[0] <= 0. or values[1] <= 0.):
+            raise ValueError('The range of parameter {} must be positive to '
+                             'be sampled on a log scale'.format(parameter))
+        names.append(parameter)
+        parameters[parameter] = values
+    return names, parameters
+# }}}
+
+
+def get_zip_variants(names, parameters):  # {{{
+    valueCount = None
+    for parameter in names:
+        values = parameters[parameter]
+        if valueCount is None:
+            valueCount = len(values)
+        elif len(values) != valueCount:
+            raise ValueError('The number of parameter values must be the same '
+                             'for all parameters with --sampling zip')
+    return [dict([(parameter, parameters[parameter][valueIndex]) for
+                  parameter in names]) for valueIndex in range(valueCount)]
+# }}}
+
+
+def get_cartesian_variants(names, parameters):  # {{{
+    # The last parameter varies fastest
+    return [dict(zip(names, values)) for values in
+            itertools.product(*[parameters[parameter] for parameter in
+                                names])]
+# }}}
+
 
-# Define and process input arguments
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-t", "--template", dest="template", help="A config file in which to add or modify a parameter", metavar="TEMPLATE", required=True)
-parser.add_argument("-o", "--out_prefix", dest="out_prefix", help="The prefix for the output config file", metavar="PREFIX", required=True)
-parser.add_argument("-p", "--parameters", dest="parameters", help="A list of parameters and comma-separated values", metavar="PARAMETERS", nargs="+", required=True)
+def get_lhs_variants(names, parameters, samples, seed):  # {{{
+    # A Latin hypercube: for each parameter, a random permutation of the
+    # strata assigns one stratum to each sample, and the value is drawn
+    # uniformly within the stratum (or picks the value of a list whose share
+    # of the range holds that point)
+    rng = random.Random(seed)
+    variants = [dict() for sample in range(samples)]
+    for parameter in names:
+        values = parameters[parameter]
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        for sample in range(samples):
+            point = (strata[sample] + rng.random()) / samples
+            if isinstance(values, tuple):
+                (low, high, log) = values
+                if log:
+                    value = math.exp(math.log(low) + point *
+                                     (math.log(high) - math.log(low)))
+                else:
+                    value = low + point * (high - low)
+                value = '%g' % value
+            else:
+                value = values[min(int(point * len(values)),
+                                   len(values) - 1)]
+            variants[sample][parameter] = value
+    return variants
+# }}}
 
-args = parser.parse_args()
 
-parameters = {}
+def get_case_name(text):  # {{{
+    try:
+        return ET.fromstring(text.encode('utf-8')).attrib.get('case')
+    except ET.ParseError:
+        return None
+# }}}
 
-first = True
-for parameterString in args.parameters:
-    (parameter, valueString) = parameterString.split('=',1)
-    values = valueString.split(',')
-    if first:
-        valueCount = len(values)
-        first = False
+
+def write_configs(template, outPrefix, names, variants):  # {{{
+    # Write a config file for each variant, returning the manifest entry of
+    # each, keyed by the number of the variant. Nothing is written if two
+    # variants would have the same case name.
+    inID = open(template)
+    lines = inID.readlines()
+    inID.close()
+
+    width = max(2, len('%i' % (len(variants) - 1)))
+    manifest = {}
+    texts = {}
+    caseNames = {}
+    for valueIndex, variant in enumerate(variants):
+        variantID = '%0*i' % (width, valueIndex)
+        replacements = {'@variant': variantID}
+        for parameter in names:
+            replacements['@%s' % parameter] = variant[parameter]
+        texts[variantID] = fill_template(lines, replacements)
+
+        caseName = get_case_name(texts[variantID])
+        if caseName is not None and caseName in caseNames:
+            raise ValueError('Variants {} and {} have the same case name {}. '
+                             'Add @variant to the case name in the '
+                             'template.'.format(caseNames[caseName],
+                                                variantID, caseName))
+        caseNames[caseName] = variantID
+        manifest[variantID] = {'config': '%s_%s.xml' % (
+            os.path.basename(outPrefix), variantID), 'case': caseName,
+            'parameters': variant}
+
+    for variantID in sorted(texts):
+        outID = open('%s_%s.xml' % (outPrefix, variantID), 'w')
+        outID.write(texts[variantID])
+        outID.close()
+    return manifest
+# }}}
+
+
+def remove_stale_configs(manifestFile, outPrefix, manifest):  # {{{
+    # Remove config files from an earlier sweep with the same manifest that
+    # are not part of this one
+    if not os.path.exists(manifestFile):
+        return
+    with open(manifestFile, 'r') as inFile:
+        oldManifest = json.load(inFile)
+    configs = [variant['config'] for variant in manifest.values()]
+    outDir = os.path.dirname(outPrefix)
+    for variant in oldManifest['variants'].values():
+        if variant['config'] not in configs:
+            oldFile = os.path.join(outDir, variant['config'])
+            if os.path.exists(oldFile):
+                os.remove(oldFile)
+# }}}
+
+
+def make_parameter_study(template, outPrefix, parameterStrings,
+                         sampling='zip', samples=None, seed=None,
+                         manifestFile=None):  # {{{
+    # Write the config files of a parameter study and its manifest, returning
+    # the manifest
+    names, parameters = parse_parameters(parameterStrings, sampling)
+    if sampling == 'zip':
+        variants = get_zip_variants(names, parameters)
+    elif sampling == 'cartesian':
+        variants = get_cartesian_variants(names, parameters)
+    elif sampling == 'lhs':
+        if samples is None or samples < 1:
+            raise ValueError('--samples must be given with --sampling lhs')
+        variants = get_lhs_variants(names, parameters, samples, seed)
     else:
-        assert(len(values) == valueCount)
+        raise ValueError('Unexpected sampling {}'.format(sampling))
+
+    if manifestFile is None:
+        manifestFile = '%s_manifest.json' % outPrefix
+
+    manifest = write_configs(template, outPrefix, names, variants)
+    remove_stale_configs(manifestFile, outPrefix, manifest)
+
+    manifest = {'template': template, 'sampling': sampling, 'seed': seed,
+                'parameters': names, 'variants': manifest}
+    with open(manifestFile, 'w') as outFile:
+        json.dump(manifest, outFile, indent=1, sort_keys=True)
+    return manifest
+# }}}
+
+
+if __name__ == "__main__":
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-t", "--template", dest="template", help="A config file in which to add or modify a parameter", metavar="TEMPLATE", required=True)
+    parser.add_argument("-o", "--out_prefix", dest="out_prefix", help="The prefix for the output config file", metavar="PREFIX", required=True)
+    parser.add_argument("-p", "--parameters", dest="parameters", help="A list of parameters and comma-separated values", metavar="PARAMETERS", nargs="+", required=True)
+    parser.add_argument("--sampling", dest="sampling", default="zip", choices=['zip', 'cartesian', 'lhs'], help="How parameter values are combined into variants (default is zip)")
+    parser.add_argument("--samples", dest="samples", type=int, help="The number of variants with --sampling lhs", metavar="N")
+    parser.add_argument("--seed", dest="seed", type=int, help="The seed of the random numbers of --sampling lhs", metavar="SEED")
+    parser.add_argument("--manifest", dest="manifest", help="The manifest of the variants to write (default is PREFIX_manifest.json)", metavar="FILE")
+
+    args = parser.parse_args()
 
-    parameters[parameter] = values
+    try:
+        make_parameter_study(args.template, args.out_prefix, args.parameters,
+                             args.sampling, args.samples, args.seed,
+                             args.manifest)
+    except ValueError as error:
+        print("ERROR: {}".format(error))
+        print("Exiting...")
+        sys.exit(1)
 
-for valueIndex in range(valueCount):
-    outFileName = '%s_%02i.xml'%(args.out_prefix, valueIndex)
-    replacements = {}
-    for parameter in parameters:
-        replacements['@%s'%parameter] = parameters[parameter][valueIndex]
-    write_from_template(args.template, outFileName, replacements)
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
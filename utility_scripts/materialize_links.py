@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+This script replaces symlinks in a directory with the files they point to,
+without duplicating the data when possible.
+
+Each file is cloned with a reflink (FICLONE) if the file system supports it,
+hard linked if the target is read-only (so it can't be modified through the
+new link) and on the same file system, and only copied as a last resort. The
+number of bytes that did not need to be copied is reported at the end.
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import stat
+import errno
+import fcntl
+import shutil
+import argparse
+
+# The FICLONE ioctl from linux/fs.h, which makes dest share all the data
+# blocks of source on file systems that support it (e.g. btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def reflink(source, dest):  # {{{
+    # Clone source into a new file dest. Returns False if the file system
+    # doesn't support reflinks.
+    with open(source, 'rb') as source_file:
+        with open(dest, 'wb') as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+                return True
+            except (IOError, OSError) as e:
+                if e.errno in [errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                               errno.EINVAL, errno.ENOSYS, errno.EPERM]:
+                    return False
+                raise e
+    return False
+# }}}
+
+
+def is_read_only(path):  # {{{
+    # Check the permission bits, rather than os.access, which is always True
+    # for root
+    mode = os.stat(path).st_mode
+    return mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH) == 0
+# }}}
+
+
+def materialize_file(source, dest, copy_only=False, copy_mode=False):  # {{{
+    # Make dest a regular file with the contents of source, replacing dest if
+    # it exists. Returns the method that was used ('reflink', 'hardlink' or
+    # 'copy') and the size of the file.
+    if os.path.isdir(dest) and not os.path.islink(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+
+    # Build the file next to dest and move it into place, so dest (e.g. the
+    # symlink being replaced) is untouched if anything goes wrong
+    tmp_dest = '{}.materialize.{}'.format(dest, os.getpid())
+    size = os.path.getsize(source)
+
+    method = None
+    try:
+        if not copy_only:
+            if reflink(source, tmp_dest):
+                method = 'reflink'
+                if copy_mode:
+                    shutil.copymode(source, tmp_dest)
+            else:
+                os.remove(tmp_dest)
+                if is_read_only(source):
+                    try:
+                        os.link(os.path.realpath(source), tmp_dest)
+                        method = 'hardlink'
+                    except OSError:
+                        pass
+
+        if method is None:
+            if copy_mode:
+                shutil.copy(source, tmp_dest)
+            else:
+                shutil.copyfile(source, tmp_dest)
+            method = 'copy'
+
+        os.rename(tmp_dest, dest)
+    finally:
+        if os.path.lexists(tmp_dest):
+            os.remove(tmp_dest)
+
+    return method, size
+# }}}
+
+
+def materialize_links(directory, copy_only=False):  # {{{
+    # Replace each symlink to a file in directory with the file it points to.
+    # Returns a dictionary with the number of files and bytes handled by each
+    # method.
+    totals = dict()
+    for method in ['reflink', 'hardlink', 'copy']:
+        totals[method] = {'files': 0, 'bytes': 0}
+
+    for file_name in sorted(os.listdir(directory)):
+        # Like glob, skip hidden files
+        if file_name.startswith('.'):
+            continue
+        path = os.path.join(directory, file_name)
+        if os.path.islink(path) and os.path.isfile(path):
+            method, size = materialize_file(path, path, copy_only)
+            totals[method]['files'] += 1
+            totals[method]['bytes'] += size
+
+    return totals
+# }}}
+
+
+def format_bytes(size):  # {{{
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} TB'.format(size)
+# }}}
+
+
+def print_report(directory, totals):  # {{{
+    files = sum([totals[method]['files'] for method in totals])
+    saved = totals['reflink']['bytes'] + totals['hardlink']['bytes']
+    print(' -- Materialized {} links in {}: {} reflinked, {} hard linked, {} '
+          'copied ({} saved)'.format(files, directory,
+                                     totals['reflink']['files'],
+                                     totals['hardlink']['files'],
+                                     totals['copy']['files'],
+                                     format_bytes(saved)))
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("directories", nargs='+', metavar="DIR",
+                        help="Directories whose symlinks will be replaced")
+    parser.add_argument("--copy", dest="copy_only", action="store_true",
+                        help="If set, always make a full copy of each file")
+
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            print("ERROR: {} is not a directory.".format(directory))
+            print("Exiting...")
+            sys.exit(1)
+        totals = materialize_links(directory, args.copy_only)
+        print_report(directory, totals)
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
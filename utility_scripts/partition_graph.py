@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""
+This script partitions the graph of an MPAS mesh for a list of task counts in
+one call, and reports the quality of each partition.
+
+The graph is either read from a METIS graph file (-g, e.g. graph.info) or
+built from a mesh file (-f) as make_graph_file.py does and written to -o.
+The partitioner (gpmetis by default) is run for each task count, with up to -j
+of them running at once, writing GRAPH.part.N as gpmetis does. Partition files
+that are newer than the graph are reused unless --force is given.
+
+For each task count, the report gives the edge cut (the number of edges
+between cells on different ranks), the load imbalance (the largest number of
+cells, or weight for each weight of the graph, on a rank divided by the mean)
+and the number of halo cells of each rank: cells of other ranks within
+--halo_layers layers of neighbors of the rank's cells, which it exchanges with
+them. With --per_rank, the cells and halo cells of each rank are listed too.
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from make_graph_file import get_adjacency, get_weights, write_graph
+
+
+def read_graph(filename):  # {{{
+    # Read a METIS graph file, returning its adjacency in compressed sparse
+    # row form (with 1-based neighbors, as in the file) and the weights of
+    # the cells (or None)
+    with open(filename, 'r') as graph_file:
+        lines = [line for line in graph_file.read().splitlines()
+                 if not line.startswith('%')]
+
+    header = lines[0].split()
+    nCells = int(header[0])
+    fmt = header[2] if len(header) > 2 else '000'
+    fmt = fmt.zfill(3)
+    ncon = 0
+    if fmt[1] == '1':
+        ncon = int(header[3]) if len(header) > 3 else 1
+    has_edge_weights = fmt[2] == '1'
+    if fmt[0] == '1':
+        print("ERROR: Graphs with vertex sizes are not supported.")
+        print("Exiting...")
+        sys.exit(1)
+
+    lines = lines[1:nCells + 1]
+    counts = np.array([len(line.split()) for line in lines], dtype=np.int64)
+    values = np.array(' '.join(lines).split(), dtype=np.int64)
+    row_starts = np.zeros(nCells + 1, dtype=np.int64)
+    np.cumsum(counts, out=row_starts[1:])
+
+    weights = None
+    is_neighbor = np.ones(len(values), dtype=bool)
+    if ncon > 0:
+        weight_index = (row_starts[:-1, np.newaxis] +
+                        np.arange(ncon)[np.newaxis, :])
+        weights = values[weight_index]
+        is_neighbor[weight_index.ravel()] = False
+    if has_edge_weights:
+        # Each neighbor is followed by the weight of the edge
+        neighbor_index = np.nonzero(is_neighbor)[0]
+        is_neighbor[neighbor_index[1::2]] = False
+
+    adjncy = values[is_neighbor]
+    degrees = counts - ncon
+    if has_edge_weights:
+        degrees = degrees // 2
+    xadj = np.zeros(nCells + 1, dtype=np.int64)
+    np.cumsum(degrees, out=xadj[1:])
+    return xadj, adjncy, weights
+# }}}
+
+
+def get_part_file(graph_file, tasks):  # {{{
+    return '{}.part.{}'.format(graph_file, tasks)
+# }}}
+
+
+def run_partitioner(args):  # {{{
+    # Run the partitioner for one task count, with its output in a log file.
+    # Returns the task count and whether it succeeded.
+    partitioner, graph_file, tasks = args
+    log_file = '{}.log'.format(get_part_file(graph_file, tasks))
+    with open(log_file, 'w') as log:
+        try:
+            subprocess.check_call(partitioner.split() +
+                                  [graph_file, str(tasks)],
+                                  stdout=log, stderr=log)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.write('{}\n'.format(e))
+            return tasks, False
+    return tasks, True
+# }}}
+
+
+def get_rows(xadj, adjncy, cells):  # {{{
+    # The 0-based neighbors of the given cells, along with the index in cells
+    # of the cell each is a neighbor of
+    lengths = xadj[cells + 1] - xadj[cells]
+    offsets = np.cumsum(lengths) - lengths
+    index = np.repeat(xadj[cells] - offsets, lengths) + \
+        np.arange(np.sum(lengths))
+    return adjncy[index] - 1, np.repeat(np.arange(len(cells)), lengths)
+# }}}
+
+
+def get_halo_counts(xadj, adjncy, part, tasks, layers):  # {{{
+    # The number of halo cells of each rank, within the given number of
+    # layers of neighbors of its cells. Halo cells are kept as unique pairs
+    # of rank and cell, encoded as rank * nCells + cell.
+    nCells = len(part)
+    cells = np.arange(nCells)
+    ranks = part
+    known = np.unique(part.astype(np.int64) * nCells + cells)
+    halo = np.zeros(0, dtype=np.int64)
+    for layer in range(layers):
+        neighbors, index = get_rows(xadj, adjncy, cells)
+        valid = np.logical_and(neighbors >= 0, neighbors < nCells)
+        keys = ranks[index[valid]].astype(np.int64) * nCells + \
+            neighbors[valid]
+        keys = np.setdiff1d(np.unique(keys), known, assume_unique=True)
+        if len(keys) == 0:
+            break
+        halo = np.union1d(halo, keys)
+        known = np.union1d(known, keys)
+        ranks = keys // nCells
+        cells = keys % nCells
+    return np.bincount(halo // nCells, minlength=tasks)
+# }}}
+
+
+def get_partition_quality(xadj, adjncy, weights, part, tasks,
+                          halo_layers):  # {{{
+    nCells = len(part)
+    rows = np.repeat(np.arange(nCells), np.diff(xadj))
+    neighbors = adjncy - 1
+    valid = np.logical_and(neighbors >= 0, neighbors < nCells)
+    edge_cut = int(np.sum(part[rows[valid]] != part[neighbors[valid]]) // 2)
+
+    cells = np.bincount(part, minlength=tasks)
+    imbalance = [float(np.max(cells) / np.mean(cells))]
+    if weights is not None:
+        for index in range(weights.shape[1]):
+            loads = np.bincount(part, weights=weights[:, index],
+                                minlength=tasks)
+            if np.mean(loads) > 0:
+                imbalance.append(float(np.max(loads) / np.mean(loads)))
+
+    halo = get_halo_counts(xadj, adjncy, part, tasks, halo_layers)
+    return {'tasks': tasks, 'edge_cut': edge_cut, 'imbalance': imbalance,
+            'cells': cells.tolist(), 'halo_cells': halo.tolist(),
+            'empty_ranks': int(np.sum(cells == 0))}
+# }}}
+
+
+def print_report(qualities, halo_layers, per_rank):  # {{{
+    print('')
+    print('Partition quality ({} halo layers):'.format(halo_layers))
+    print('{:>8}  {:>10}  {:>16}  {:>28}  {:>10}'.format(
+        'tasks', 'edge cut', 'imbalance', 'halo cells min/mean/max',
+        'halo/owned'))
+    for quality in qualities:
+        halo = np.array(quality['halo_cells'])
+        cells = np.array(quality['cells'])
+        imbalance = '/'.join(['{:.3f}'.format(value)
+                              for value in quality['imbalance']])
+        print('{:>8d}  {:>10d}  {:>16}  {:>28}  {:>10.3f}'.format(
+            quality['tasks'], quality['edge_cut'], imbalance,
+            '{:d} / {:.1f} / {:d}'.format(int(np.min(halo)),
+                                          float(np.mean(halo)),
+                                          int(np.max(halo))),
+            float(np.sum(halo) / np.sum(cells))))
+        if quality['empty_ranks'] > 0:
+            print('          WARNING: {} ranks have no cells'.format(
+                quality['empty_ranks']))
+
+    if per_rank:
+        for quality in qualities:
+            print('')
+            print('Ranks for {} tasks:'.format(quality['tasks']))
+            print('{:>8}  {:>10}  {:>10}'.format('rank', 'cells',
+                                                 'halo cells'))
+            for rank, (cells, halo) in enumerate(zip(quality['cells'],
+                                                     quality['halo_cells'])):
+                print('{:>8d}  {:>10d}  {:>10d}'.format(rank, cells, halo))
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-g", "--graph", dest="graph_file",
+                        help="METIS graph file to partition", metavar="FILE")
+    parser.add_argument("-f", "--file", dest="filename",
+                        help="Mesh file to build the graph from",
+                        metavar="FILE")
+    parser.add_argument("-w", "--weights", dest="weight_fields",
+                        action="append",
+                        help="With -f, field to weight the partitions on. "
+                             "Can be given more than once.", metavar="VAR")
+    parser.add_argument("-o", "--output", dest="output", default="graph.info",
+                        help="With -f, the graph file to write (default: "
+                             "graph.info)", metavar="FILE")
+    parser.add_argument("-n", "--tasks", dest="tasks", type=int, nargs='+',
+                        required=True,
+                        help="Task counts to partition the graph for",
+                        metavar="N")
+    parser.add_argument("-j", "--jobs", dest="processes", type=int, default=1,
+                        help="Number of partitioner calls to run at once",
+                        metavar="N")
+    parser.add_argument("--partitioner", dest="partitioner",
+                        default="gpmetis",
+                        help="Partitioner command, called with the graph "
+                             "file and task count (default: gpmetis)",
+                        metavar="CMD")
+    parser.add_argument("--force", dest="force", action="store_true",
+                        help="Partition again even if partition files are "
+                             "up to date")
+    parser.add_argument("--halo_layers", dest="halo_layers", type=int,
+                        default=3,
+                        help="Layers of halo cells to count (default: 3)",
+                        metavar="N")
+    parser.add_argument("--per_rank", dest="per_rank", action="store_true",
+                        help="Print the cells and halo cells of each rank")
+    parser.add_argument("--report", dest="report",
+                        help="JSON file to write the partition quality to",
+                        metavar="FILE")
+
+    args = parser.parse_args()
+
+    if (args.graph_file is None) == (args.filename is None):
+        parser.error('Give either a graph file (-g) or a mesh file (-f).')
+
+    if args.filename is not None:
+        from netCDF4 import Dataset as NetCDFFile
+        grid = NetCDFFile(args.filename, 'r')
+        weights = None
+        if args.weight_fields:
+            weights = get_weights(grid, args.weight_fields)
+        xadj, adjncy = get_adjacency(grid.variables['cellsOnCell'][:],
+                                     grid.variables['nEdgesOnCell'][:])
+        grid.close()
+        graph_file = args.output
+        write_graph(graph_file, xadj, adjncy, weights, 100000)
+        print(" -- Wrote graph file {}".format(graph_file))
+    else:
+        graph_file = args.graph_file
+        if not os.path.exists(graph_file):
+            print("ERROR: Graph file {} does not exist.".format(graph_file))
+            print("Exiting...")
+            sys.exit(1)
+        xadj, adjncy, weights = read_graph(graph_file)
+
+    tasks = sorted(set(args.tasks))
+    graph_time = os.path.getmtime(graph_file)
+    to_partition = list()
+    for task_count in tasks:
+        part_file = get_part_file(graph_file, task_count)
+        if not args.force and os.path.exists(part_file) and \
+                os.path.getmtime(part_file) >= graph_time:
+            print(" -- Unchanged partition {}".format(part_file))
+        else:
+            to_partition.append(task_count)
+
+    failed = list()
+    if len(to_partition) > 0:
+        pool = ThreadPool(processes=max(1, min(args.processes,
+                                               len(to_partition))))
+        for task_count, success in pool.imap(
+                run_partitioner, [(args.partitioner, graph_file, task_count)
+                                  for task_count in to_partition]):
+            part_file = get_part_file(graph_file, task_count)
+            if success and os.path.exists(part_file):
+                print(" -- Wrote partition {}".format(part_file))
+            else:
+                print(" ** Partitioning for {} tasks failed (see {}.log)"
+                      .format(task_count, part_file))
+                failed.append(task_count)
+        pool.close()
+        pool.join()
+
+    qualities = list()
+    for task_count in tasks:
+        if task_count in failed:
+            continue
+        part = np.loadtxt(get_part_file(graph_file, task_count),
+                          dtype=np.int64, ndmin=1)
+        if len(part) != len(xadj) - 1:
+            print(" ** Partition for {} tasks doesn't match the graph".format(
+                task_count))
+            failed.append(task_count)
+            continue
+        qualities.append(get_partition_quality(xadj, adjncy, weights, part,
+                                               task_count, args.halo_layers))
+
+    if len(qualities) > 0:
+        print_report(qualities, args.halo_layers, args.per_rank)
+
+    if args.report is not None:
+        with open(args.report, 'w') as report_file:
+            json.dump({'graph': graph_file, 'halo_layers': args.halo_layers,
+                       'partitions': qualities}, report_file, indent=1)
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
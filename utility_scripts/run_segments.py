@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Runs a simulation as a chain of restart segments within a single job,
+replacing a job-script loop around check_progress.py, the run script and
+setup_restart.py.
+
+Each segment runs the command given with -c (./run.py by default), then reads
+the new date from the restart pointer named in the namelist provided with the
+-f flag and, the first time a restart file is found, sets the namelist up for
+restart runs as setup_restart.py does (with the start time given with -s).
+The next segment is started right away, until the restart date reaches the
+end date given with -e (format YYYY-MM-DD_hh:mm:ss) or the wall-clock budget
+of the job given with -w (format hh:mm:ss) would be exceeded by another
+segment.
+
+A segment is only started if the time left in the budget is at least the
+longest segment so far, increased by the fraction given with --margin, so
+the job ends with a safety margin rather than being killed in the middle of a
+segment. Without -w, segments run until the end date.
+
+For each segment, the simulated dates, wall-clock time and throughput in
+simulated years per day (SYPD, with 365-day years) are printed and appended
+to the log file given with --log (segments.log by default).
+
+Exits 0 if the wall-clock budget (or --max_segments) is reached before the
+end date, so the next job of a chain continues the run, and 1 if the run has
+completed (as check_progress.py does, so dependent jobs can be cancelled) or
+a segment failed.
+
+An example job script using this script to run until year 3 within a 4-hour
+allocation, stopping 10 minutes early to leave time for cleanup, might look
+like the following:
+
+...
+#SBATCH --time=4:00:00
+
+./run_segments.py -f namelist.ocean -e 0003-01-01_00:00:00 -w 3:50:00
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import time
+import argparse
+import subprocess
+import sys
+
+from check_progress import read_namelist, parse_date, get_restart_date
+from setup_restart import set_restart
+
+
+def parse_wall_time(wall_time):  # {{{
+    # The number of seconds in a wall-clock time of the form [[hh:]mm:]ss
+    seconds = 0
+    for value in wall_time.split(':'):
+        seconds = 60 * seconds + int(value)
+    return seconds
+# }}}
+
+
+def get_start_date(lines, restartPointer):  # {{{
+    # The simulated date at the start of the next segment: the date in the
+    # restart pointer when restarting, and config_start_time otherwise
+    for line in lines:
+        if 'config_start_time' in line:
+            startTime = line.split("=")[-1].strip(" \t\n'\"")
+            if startTime != 'file':
+                return parse_date(startTime)
+    return get_restart_date(restartPointer)
+# }}}
+
+
+def is_restart(lines, startTime):  # {{{
+    # Whether the namelist is already set up for restart runs
+    doRestart = False
+    start = None
+    for line in lines:
+        if 'config_do_restart' in line:
+            doRestart = '.true.' in line.lower()
+        if 'config_start_time' in line:
+            start = line.split("=")[-1].strip(" \t\n")
+    return doRestart and start == startTime
+# }}}
+
+
+def format_date(date):  # {{{
+    # As strftime, but with 4-digit years before 1000
+    return '{:04d}-{:02d}-{:02d}_{:02d}:{:02d}:{:02d}'.format(
+        date.year, date.month, date.day, date.hour, date.minute, date.second)
+# }}}
+
+
+def format_duration(seconds):  # {{{
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+# }}}
+
+
+def log_segment(logFile, message):  # {{{
+    print(message)
+    with open(logFile, 'a') as log:
+        log.write('{}\n'.format(message))
+        log.flush()
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file in which to find the name of the restart pointer, to be changed to restart mode", metavar="FILE", required=True)
+    parser.add_argument("-e", "--endDate", dest="endDate", help="End date of the run", metavar="DATE", required=True)
+    parser.add_argument("-c", "--command", dest="command", default="./run.py", help="The command that runs a segment (default is ./run.py)", metavar="COMMAND")
+    parser.add_argument("-s", "--startTime", dest="startTime", default="'file'", help="The new value to assign to config_start_time for restart runs (default is 'file')", metavar="STARTTIME")
+    parser.add_argument("-w", "--wallTime", dest="wallTime", help="The wall-clock budget for all segments, as hh:mm:ss", metavar="TIME")
+    parser.add_argument("--margin", dest="margin", type=float, default=0.1, help="The fraction added to the longest segment so far when checking that another segment fits in the budget (default is 0.1)", metavar="FRACTION")
+    parser.add_argument("--max_segments", dest="maxSegments", type=int, help="The maximum number of segments to run", metavar="N")
+    parser.add_argument("--log", dest="logFile", default="segments.log", help="A file to append the throughput of each segment to (default is segments.log)", metavar="FILE")
+
+    args = parser.parse_args()
+
+    jobStart = time.time()
+    budget = None
+    if args.wallTime is not None:
+        budget = parse_wall_time(args.wallTime)
+    endDate = parse_date(args.endDate)
+
+    lines, restartPointer = read_namelist(args.fileName)
+
+    segment = 0
+    longest = 0.0
+    while True:
+        startDate = get_start_date(lines, restartPointer)
+        if startDate is not None and startDate >= endDate:
+            print('Run has completed.')
+            sys.exit(1)
+
+        if args.maxSegments is not None and segment >= args.maxSegments:
+            print('Reached the maximum of {} segments.'.format(segment))
+            sys.exit(0)
+
+        elapsed = time.time() - jobStart
+        if budget is not None and segment > 0 and \
+                elapsed + (1.0 + args.margin) * longest > budget:
+            print('Not enough time left for another segment: {} used of '
+                  '{}, longest segment {}.'.format(format_duration(elapsed),
+                                                   format_duration(budget),
+                                                   format_duration(longest)))
+            sys.exit(0)
+
+        segment += 1
+        segmentStart = time.time()
+        returncode = subprocess.call(args.command, shell=True)
+        segmentTime = time.time() - segmentStart
+        if returncode != 0:
+            print('ERROR: Segment {} failed with exit status {}.'.format(
+                segment, returncode))
+            print('Exiting...')
+            sys.exit(1)
+        longest = max(longest, segmentTime)
+
+        restartDate = get_restart_date(restartPointer)
+        if restartDate is None or \
+                (startDate is not None and restartDate <= startDate):
+            print('ERROR: Segment {} did not write a new restart date to '
+                  '{}.'.format(segment, restartPointer))
+            print('Exiting...')
+            sys.exit(1)
+
+        if startDate is None:
+            simulated = '?'
+            sypd = '?'
+            startDate = '?'
+        else:
+            days = (restartDate - startDate).total_seconds() / 86400.
+            simulated = '{:.2f} days'.format(days)
+            sypd = '{:.3f}'.format((days / 365.) /
+                                   (segmentTime / 86400.))
+            startDate = format_date(startDate)
+        log_segment(args.logFile,
+                    'segment {}: {} to {}, {} in {} ({:.1f} s), SYPD {}'.format(
+                        segment, startDate, format_date(restartDate),
+                        simulated,
+                        format_duration(segmentTime), segmentTime, sypd))
+
+        # The namelist only needs to be rewritten for the first restart
+        if not is_restart(lines, args.startTime):
+            set_restart(args.fileName, lines, args.startTime)
+            lines, restartPointer = read_namelist(args.fileName)
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -18,38 +18,42 @@ import os
 import argparse
 import sys
 
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file to be changed to restart mode", metavar="FILE", required=True)
-parser.add_argument("-s", "--startTime", dest="startTime", help="The new value to assign to config_start_time (default is 'file')", metavar="STARTTIME")
+from check_progress import read_namelist
 
-args = parser.parse_args()
 
+def set_restart(fileName, lines, startTime):  # {{{
+    # Write the lines of a namelist file with config_do_restart = .true. and
+    # config_start_time set to startTime
+    outFile = open(fileName, 'w')
+    for line in lines:
+        if 'config_do_restart' in line:
+            line = "    config_do_restart = .true.\n"
+        if 'config_start_time' in line:
+            line = "    config_start_time = %s\n"%startTime
+        outFile.write(line)
+    outFile.close()
+# }}}
 
-if args.startTime is None:
-    args.startTime = "'file'"
 
-lines = []
-restartPointer = 'Restart_timestamp'
-inFile = open(args.fileName, 'r')
-for line in inFile:
-    if 'config_restart_timestamp_name' in line:
-        restartPointer = line.split("=")[-1]
-        restartPointer = restartPointer.lstrip(" \t'")
-        restartPointer = restartPointer.rstrip(" \t\n'")
-    lines.append(line)
-inFile.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file to be changed to restart mode", metavar="FILE", required=True)
+    parser.add_argument("-s", "--startTime", dest="startTime", help="The new value to assign to config_start_time (default is 'file')", metavar="STARTTIME")
 
-if not os.path.exists(restartPointer):
-    # nothing to do
-    sys.exit(0)
+    args = parser.parse_args()
+
+
+    if args.startTime is None:
+        args.startTime = "'file'"
+
+    lines, restartPointer = read_namelist(args.fileName)
 
-outFile = open(args.fileName, 'w')
-for line in lines:
-    if 'config_do_restart' in line:
-        line = "    config_do_restart = .true.\n"
-    if 'config_start_time' in line:
-        line = "    config_start_time = %s\n"%args.startTime
-    outFile.write(line)
-outFile.close()
+    if not os.path.exists(restartPointer):
+        # nothing to do
+        sys.exit(0)
+
+    set_restart(args.fileName, lines, args.startTime)
+
+    sys.exit(0)
 
-sys.exit(0)
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
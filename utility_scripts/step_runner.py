@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+This module runs the steps of scripts generated by setup_testcase.py and
+reports how long each step took.
+
+By default, each step is run in a subprocess, just like subprocess.check_call.
+In in-process mode, steps that are python scripts are run by forking the
+calling python interpreter, which has already imported the modules python
+steps typically need (numpy, netCDF4, xarray). Each forked step gets its own
+argv, working directory, environment and module state, but skips the start-up
+of a fresh interpreter and the imports. Steps that aren't python scripts (e.g.
+the model itself) are always run in a subprocess.
+
+When the script is run as part of a regression suite, the wall time, CPU time,
+peak memory and exit status of each step are also recorded in the suite's
+results file (see suite_results.py).
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import gc
+import time
+import runpy
+import traceback
+import subprocess
+
+from suite_results import wait_for_process, record_step
+
+# Modules imported up front in in-process mode, so forked steps can use them
+# without importing them again
+default_preload = ['numpy', 'netCDF4', 'xarray']
+
+
+class StepRunner(object):  # {{{
+    # Runs steps with check_call, either always in a subprocess or, for python
+    # scripts, in a fork of this interpreter.
+    def __init__(self, in_process=False, preload=None):
+        self.in_process = in_process and hasattr(os, 'fork')
+        if preload is None:
+            preload = default_preload
+        if self.in_process:
+            for module in preload:
+                try:
+                    __import__(module)
+                except ImportError:
+                    pass
+
+    def check_call(self, args, stdout=None, stderr=None):  # {{{
+        # Run a step like subprocess.check_call, raising
+        # subprocess.CalledProcessError if it fails.
+        start = time.time()
+        script_args = None
+        if self.in_process:
+            script_args = get_python_script_args(args)
+
+        if script_args is None:
+            mode = 'subprocess'
+            name = os.path.basename(args[0])
+            process = subprocess.Popen(args, stdout=stdout, stderr=stderr)
+            returncode, rusage = wait_for_process(process.pid)
+            process.returncode = returncode
+        else:
+            mode = 'in-process'
+            name = os.path.basename(script_args[0])
+            returncode, rusage = run_forked(script_args, stdout, stderr)
+
+        record_step(name, mode, start, returncode, rusage)
+
+        print("     Step time: {:.2f} s ({}: {})".format(
+            time.time() - start, mode, name))
+        sys.stdout.flush()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+    # }}}
+# }}}
+
+
+def find_executable(name):  # {{{
+    # Find the path to an executable, the way a shell would
+    if os.path.dirname(name) != '':
+        if os.path.isfile(name):
+            return name
+        return None
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+# }}}
+
+
+def is_python_script(path):  # {{{
+    # A python script either has a .py extension or a python shebang
+    if path.endswith('.py'):
+        return True
+    try:
+        with open(path, 'rb') as script:
+            first_line = script.readline(200)
+    except (IOError, OSError):
+        return False
+    return first_line.startswith(b'#!') and b'python' in first_line
+# }}}
+
+
+def get_python_script_args(args):  # {{{
+    # Return the argv of the python script the step runs (with the path to
+    # the script first), or None if the step isn't a python script.
+    if len(args) == 0:
+        return None
+
+    executable = os.path.basename(args[0])
+    pythons = ['python', 'python{}'.format(sys.version_info[0]),
+               os.path.basename(sys.executable)]
+    if executable in pythons:
+        # Running "python script.py ...", but not other python options
+        if len(args) > 1 and not args[1].startswith('-') and \
+                os.path.isfile(args[1]):
+            return list(args[1:])
+        return None
+
+    path = find_executable(args[0])
+    if path is None or not is_python_script(path):
+        return None
+    return [path] + list(args[1:])
+# }}}
+
+
+def run_forked(script_args, stdout, stderr):  # {{{
+    # Run a python script in a fork of this interpreter, and return its exit
+    # code and resource usage
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        returncode = 1
+        try:
+            if stdout is not None:
+                os.dup2(stdout.fileno(), sys.stdout.fileno())
+            if stderr is not None:
+                os.dup2(stderr.fileno(), sys.stderr.fileno())
+
+            script = os.path.abspath(script_args[0])
+            sys.argv = [script_args[0]] + script_args[1:]
+            sys.path[0] = os.path.dirname(script)
+            try:
+                runpy.run_path(script, run_name='__main__')
+                returncode = 0
+            except SystemExit as e:
+                if e.code is None:
+                    returncode = 0
+                elif isinstance(e.code, int):
+                    returncode = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+        finally:
+            try:
+                # os._exit skips interpreter shutdown, so make sure objects the
+                # script left behind (e.g. open netCDF files) are finalized
+                gc.collect()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(returncode)
+
+    return wait_for_process(pid)
+# }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+"""
+This module records and reports the results of running a regression suite.
+
+The suite scripts generated by manage_regression_suite.py record the wall
+time, CPU time, peak memory (RSS) and exit status of each test in a JSON lines
+file (suite_results.jsonl) in the suite's work directory. Steps run through
+utility_scripts/step_runner.py add a record of their own to the same file,
+which they find through the COMPASS_METRICS_FILE environment variable.
+
+A results file left by an earlier run of the suite is renamed to
+suite_results.<date>.jsonl when the suite starts, so it can be compared
+against later (see manage_regression_suite.py --report).
+
+Suites set up with manage_regression_suite.py --reuse_results also compute a
+result key for each test before running it, from the contents of everything it
+reads: the files set up for it (namelists, streams, scripts and the targets of
+links to inputs outside the test), the executables and the runtime definition.
+A test whose key matches that of its last passing run is reported as a cached
+pass without being run.
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import hashlib
+import subprocess
+from collections import OrderedDict
+
+results_file_name = 'suite_results.jsonl'
+
+# The files, in the work directory of a suite, with the result key of the last
+# passing run of each test and the digests of the files used in result keys
+result_keys_name = 'result_keys.json'
+digest_cache_name = '.digest_cache.json'
+
+# The file, in the work directory of each test, listing the files that were
+# set up for it (rather than created by running it), the runtime definition and
+# the executables
+setup_manifest_name = '.setup_manifest.json'
+
+
+# *** Recording Functions *** #{{{
+def append_record(path, record):  # {{{
+    # Append a record to a results file. Each record is written with a single
+    # write to a file opened for appending, so concurrent tests and steps
+    # don't interleave their records.
+    line = '{}\n'.format(json.dumps(record, sort_keys=True))
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+# }}}
+
+
+def wait_for_process(pid, options=0):  # {{{
+    # Wait for a child process, returning its exit code and resource usage,
+    # or (None, None) if options includes os.WNOHANG and it is still running.
+    # The resource usage includes any children of the process it waited for.
+    done_pid, status, rusage = os.wait4(pid, options)
+    if done_pid == 0:
+        return None, None
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), rusage
+    return os.WEXITSTATUS(status), rusage
+# }}}
+
+
+def get_metrics(start, returncode, rusage):  # {{{
+    # The metrics recorded for each test and step. ru_maxrss is in KB on
+    # linux.
+    metrics = {'start': start,
+               'wall_time': time.time() - start,
+               'returncode': returncode}
+    if returncode == 0:
+        metrics['status'] = 'PASS'
+    else:
+        metrics['status'] = 'FAIL'
+    if rusage is not None:
+        metrics['cpu_time'] = rusage.ru_utime + rusage.ru_stime
+        metrics['max_rss_mb'] = rusage.ru_maxrss / 1024.0
+    return metrics
+# }}}
+
+
+def get_metrics_file():  # {{{
+    # The results file that steps should record their metrics in, if any
+    return os.environ.get('COMPASS_METRICS_FILE')
+# }}}
+
+
+def record_step(step, mode, start, returncode, rusage):  # {{{
+    # Record the metrics of a step run by a StepRunner, if the script is being
+    # run as part of a suite.
+    path = get_metrics_file()
+    if path is None:
+        return
+    record = get_metrics(start, returncode, rusage)
+    record['type'] = 'step'
+    record['test'] = os.environ.get('COMPASS_METRICS_TEST', '')
+    record['script'] = os.path.basename(sys.argv[0])
+    record['case'] = os.path.basename(os.getcwd())
+    record['step'] = step
+    record['mode'] = mode
+    append_record(path, record)
+# }}}
+
+
+class SuiteResults(object):  # {{{
+    # The results file of one run of a regression suite. If reuse_results is
+    # True, tests whose result key matches that of their last passing run are
+    # not run again.
+    def __init__(self, base_path, suite_name, reuse_results=False):
+        self.base_path = base_path
+        self.path = '{}/{}'.format(base_path, results_file_name)
+        self.reuse_results = reuse_results
+        self.result_keys = dict()
+        self.digest_cache = dict()
+        self.test_keys = dict()
+        if reuse_results:
+            self.result_keys = read_json(
+                '{}/{}'.format(base_path, result_keys_name))
+            self.digest_cache = read_json(
+                '{}/{}'.format(base_path, digest_cache_name))
+        archive_results(self.path)
+        append_record(self.path, {'type': 'suite',
+                                  'suite': suite_name,
+                                  'host': socket.gethostname(),
+                                  'start': time.time()})
+
+    def get_env(self, test_name):  # {{{
+        # The environment for running a test, which tells step runners where
+        # to record their metrics
+        env = dict(os.environ)
+        env['COMPASS_METRICS_FILE'] = self.path
+        env['COMPASS_METRICS_TEST'] = test_name
+        return env
+    # }}}
+
+    def record_script(self, test_name, output_name, script, start,
+                      returncode, rusage):  # {{{
+        record = get_metrics(start, returncode, rusage)
+        record['type'] = 'test'
+        record['test'] = test_name
+        record['output'] = output_name
+        record['script'] = os.path.basename(script)
+        append_record(self.path, record)
+    # }}}
+
+    def check_call(self, args, test_name, output_name, stdout=None,
+                   stderr=None):  # {{{
+        # Run a script of a test like subprocess.check_call, and record its
+        # metrics
+        start = time.time()
+        process = subprocess.Popen(args, stdout=stdout, stderr=stderr,
+                                   env=self.get_env(test_name))
+        returncode, rusage = wait_for_process(process.pid)
+        process.returncode = returncode
+        self.record_script(test_name, output_name, args[0], start,
+                           returncode, rusage)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+    # }}}
+
+    def is_cached(self, test_name, test_path, output_name):  # {{{
+        # Check if a test can be reported as passed without running it, and
+        # record it as a cached pass if so. test_path is relative to the work
+        # directory of the suite.
+        if not self.reuse_results:
+            return False
+
+        key = get_result_key('{}/{}'.format(self.base_path, test_path),
+                             self.digest_cache)
+        self.test_keys[test_name] = key
+        if key is None or self.result_keys.get(test_name) != key:
+            return False
+
+        record = get_metrics(time.time(), 0, None)
+        record.update({'type': 'test', 'test': test_name,
+                       'output': output_name, 'script': '', 'cached': True,
+                       'wall_time': 0.0})
+        append_record(self.path, record)
+        return True
+    # }}}
+
+    def record_result(self, test_name, passed):  # {{{
+        # Store the result key of a test that passed, computed by is_cached
+        # before it was run, so later runs can reuse the result
+        if not self.reuse_results:
+            return
+
+        key = self.test_keys.get(test_name)
+        if passed and key is not None:
+            self.result_keys[test_name] = key
+        elif test_name in self.result_keys:
+            del self.result_keys[test_name]
+        write_json('{}/{}'.format(self.base_path, result_keys_name),
+                   self.result_keys)
+        write_json('{}/{}'.format(self.base_path, digest_cache_name),
+                   self.digest_cache)
+    # }}}
+
+    def finish(self, passed):  # {{{
+        if passed:
+            status = 'PASS'
+        else:
+            status = 'FAIL'
+        append_record(self.path, {'type': 'suite_end', 'end': time.time(),
+                                  'status': status})
+    # }}}
+# }}}
+
+
+def archive_results(path):  # {{{
+    # Rename the results of an earlier run, using the time that run started
+    if not os.path.exists(path):
+        return
+    start = os.path.getmtime(path)
+    for record in load_results(path):
+        if record.get('type') == 'suite':
+            start = record['start']
+            break
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(start))
+    archive_path = '{}.{}.jsonl'.format(path[:-len('.jsonl')], stamp)
+    os.rename(path, archive_path)
+# }}}
+# }}}
+
+
+# *** Result Key Functions *** #{{{
+def read_json(path):  # {{{
+    if not os.path.exists(path):
+        return dict()
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except ValueError:
+        return dict()
+# }}}
+
+
+def write_json(path, data):  # {{{
+    # Write to a temporary file and move it into place, so an interrupted
+    # suite can't leave a truncated file behind
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, sort_keys=True, indent=1)
+    os.rename(tmp_path, path)
+# }}}
+
+
+def write_setup_manifest(test_work_dir, runtime, executables):  # {{{
+    # List the files in the work directory of a test that was just set up, so
+    # they can be told apart from the files that running it creates
+    files = list()
+    for root, dirs, file_names in os.walk(test_work_dir):
+        dirs.sort()
+        for name in list(dirs):
+            if os.path.islink(os.path.join(root, name)):
+                file_names.append(name)
+                dirs.remove(name)
+        for name in sorted(file_names):
+            if name.startswith('.'):
+                continue
+            files.append(os.path.relpath(os.path.join(root, name),
+                                         test_work_dir))
+
+    write_json('{}/{}'.format(test_work_dir, setup_manifest_name),
+               {'files': files, 'runtime': runtime,
+                'executables': executables})
+# }}}
+
+
+def get_file_digest(path, digest_cache, chunk_size=1024*1024):  # {{{
+    # The sha256 digest of a file, reusing the digest from digest_cache if the
+    # file's size and modification time haven't changed
+    path = os.path.realpath(path)
+    if not os.path.isfile(path):
+        return 'missing'
+    stat = os.stat(path)
+    cached = digest_cache.get(path)
+    if cached is not None and cached[0] == stat.st_size and \
+            cached[1] == stat.st_mtime:
+        return cached[2]
+
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            checksum.update(chunk)
+    digest = checksum.hexdigest()
+    digest_cache[path] = [stat.st_size, stat.st_mtime, digest]
+    return digest
+# }}}
+
+
+def get_result_key(test_work_dir, digest_cache):  # {{{
+    # A hash of everything a test reads, or None if the test wasn't set up
+    # with a manifest. Links within the test (e.g. to the output of an earlier
+    # step) only contribute where they point, since their targets are created
+    # by running the test.
+    manifest = read_json('{}/{}'.format(test_work_dir, setup_manifest_name))
+    if 'files' not in manifest:
+        return None
+
+    test_work_dir = os.path.realpath(test_work_dir)
+    key = hashlib.sha256()
+    for name in manifest['files']:
+        path = os.path.join(test_work_dir, name)
+        if os.path.islink(path):
+            target = os.path.realpath(path)
+            if target.startswith(test_work_dir + os.sep):
+                entry = 'link {} {}'.format(name, os.readlink(path))
+            else:
+                entry = 'link {} {}'.format(
+                    name, get_file_digest(target, digest_cache))
+        else:
+            entry = 'file {} {}'.format(name,
+                                        get_file_digest(path, digest_cache))
+        key.update('{}\n'.format(entry).encode('utf-8'))
+
+    for path in [manifest['runtime']] + manifest['executables']:
+        key.update('input {} {}\n'.format(
+            path, get_file_digest(path, digest_cache)).encode('utf-8'))
+
+    return key.hexdigest()
+# }}}
+# }}}
+
+
+# *** Reporting Functions *** #{{{
+def load_results(path):  # {{{
+    records = list()
+    with open(path, 'r') as results_file:
+        for line in results_file:
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A record being written as the file was read
+                pass
+    return records
+# }}}
+
+
+def summarize_tests(records):  # {{{
+    # Combine the records of all scripts of each test, in the order the tests
+    # were started
+    tests = OrderedDict()
+    for record in sorted([record for record in records
+                          if record.get('type') == 'test'],
+                         key=lambda record: record['start']):
+        name = record['test']
+        if name not in tests:
+            tests[name] = {'output': record['output'], 'status': 'PASS',
+                           'wall_time': 0.0, 'cpu_time': 0.0,
+                           'max_rss_mb': 0.0, 'cached': False}
+        test = tests[name]
+        test['wall_time'] += record['wall_time']
+        test['cpu_time'] += record.get('cpu_time', 0.0)
+        test['max_rss_mb'] = max(test['max_rss_mb'],
+                                 record.get('max_rss_mb', 0.0))
+        if record['status'] != 'PASS':
+            test['status'] = 'FAIL'
+        if record.get('cached', False):
+            test['cached'] = True
+    return tests
+# }}}
+
+
+def format_time(seconds):  # {{{
+    # Format a time as mm:ss, rounding up to the next second
+    runtime = math.ceil(seconds)
+    mins = int(math.floor(runtime/60.0))
+    secs = int(math.ceil(runtime - mins*60))
+    return '{:02d}:{:02d}'.format(mins, secs)
+# }}}
+
+
+def print_runtimes(path):  # {{{
+    # Print the runtime of each test, as the suite script does when it is done
+    tests = summarize_tests(load_results(path))
+    totaltime = 0
+    print('TEST RUNTIMES:')
+    for name in sorted(tests, key=lambda name: tests[name]['output']):
+        runtime = math.ceil(tests[name]['wall_time'])
+        totaltime += runtime
+        print('{} {}'.format(format_time(runtime), tests[name]['output']))
+    print('Total runtime {}'.format(format_time(totaltime)))
+# }}}
+
+
+def print_report(path, previous_path=None, slowest=10):  # {{{
+    # Print a summary of a results file, its slowest tests and steps, and the
+    # change in the time of each test compared to a previous results file
+    records = load_results(path)
+    tests = summarize_tests(records)
+
+    suite_start = None
+    suite_end = None
+    for record in records:
+        if record.get('type') == 'suite':
+            suite_start = record['start']
+            print('Suite: {} on {}, started {}'.format(
+                record['suite'], record['host'],
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(record['start']))))
+        elif record.get('type') == 'suite_end':
+            suite_end = record['end']
+
+    passed = len([name for name in tests if tests[name]['status'] == 'PASS'])
+    cached = len([name for name in tests if tests[name]['cached']])
+    print('  Tests: {} ({} passed, {} failed, {} cached)'.format(
+        len(tests), passed, len(tests) - passed, cached))
+    if suite_start is not None and suite_end is not None:
+        print('  Suite wall-clock time: {}'.format(
+            format_time(suite_end - suite_start)))
+    else:
+        print('  Suite wall-clock time: (suite did not finish)')
+    print('  Total test time: {}, total CPU time: {}'.format(
+        format_time(sum([test['wall_time'] for test in tests.values()])),
+        format_time(sum([test['cpu_time'] for test in tests.values()]))))
+
+    print('')
+    print('Slowest tests:')
+    print('  {:>9} {:>9} {:>9} {:>6}  {}'.format('wall (s)', 'cpu (s)',
+                                                 'RSS (MB)', 'status', 'test'))
+    for name in sorted(tests, key=lambda name: tests[name]['wall_time'],
+                       reverse=True)[0:slowest]:
+        test = tests[name]
+        print('  {:>9.1f} {:>9.1f} {:>9.1f} {:>6}  {}'.format(
+            test['wall_time'], test['cpu_time'], test['max_rss_mb'],
+            test['status'], name))
+
+    steps = [record for record in records if record.get('type') == 'step']
+    if len(steps) > 0:
+        print('')
+        print('Slowest steps:')
+        print('  {:>9} {:>9} {:>9} {:>6}  {}'.format(
+            'wall (s)', 'cpu (s)', 'RSS (MB)', 'status', 'test: case/step'))
+        for step in sorted(steps, key=lambda step: step['wall_time'],
+                           reverse=True)[0:slowest]:
+            print('  {:>9.1f} {:>9.1f} {:>9.1f} {:>6}  {}: {}/{}'.format(
+                step['wall_time'], step.get('cpu_time', 0.0),
+                step.get('max_rss_mb', 0.0), step['status'], step['test'],
+                step['case'], step['step']))
+
+    if previous_path is not None:
+        print_deltas(tests, summarize_tests(load_results(previous_path)),
+                     previous_path)
+# }}}
+
+
+def print_deltas(tests, previous, previous_path):  # {{{
+    print('')
+    print('Changes compared to {}:'.format(previous_path))
+    print('  {:>9} {:>9} {:>9} {:>8}  {}'.format('before (s)', 'after (s)',
+                                                 'change', '%', 'test'))
+    total_before = 0.0
+    total_after = 0.0
+    for name in sorted(tests, key=lambda name: abs(
+            tests[name]['wall_time'] - previous[name]['wall_time'])
+            if name in previous else 0.0, reverse=True):
+        if name not in previous or tests[name]['cached'] or \
+                previous[name]['cached']:
+            # Cached tests weren't run, so their times can't be compared
+            continue
+        before = previous[name]['wall_time']
+        after = tests[name]['wall_time']
+        total_before += before
+        total_after += after
+        print('  {:>9.1f} {:>9.1f} {:>+9.1f} {:>+8.1f}  {}'.format(
+            before, after, after - before, get_percent_change(before, after),
+            name))
+    print('  {:>9.1f} {:>9.1f} {:>+9.1f} {:>+8.1f}  {}'.format(
+        total_before, total_after, total_after - total_before,
+        get_percent_change(total_before, total_after), 'Total'))
+
+    for name in tests:
+        if name not in previous:
+            print('  New test: {}'.format(name))
+    for name in previous:
+        if name not in tests:
+            print('  Missing test: {}'.format(name))
+# }}}
+
+
+def get_percent_change(before, after):  # {{{
+    if before == 0.0:
+        return 0.0
+    return 100.0 * (after - before) / before
+# }}}
+# }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+This module runs the tests of a regression suite concurrently, and is used by
+the suite scripts that manage_regression_suite.py generates with --max_cores.
+
+Tests are started in the order they appear in the suite as soon as their
+prerequisites have passed and enough cores are free, so many small tests can
+share a node while larger ones wait for their turn. A test that needs more
+cores than are available runs once nothing else is running. The output of
+each test is written to case_outputs/, as in the serial suite script, and the
+metrics of each test are recorded in the suite's results file (see
+suite_results.py).
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import time
+import subprocess
+
+from suite_results import wait_for_process
+
+
+class SuiteTest(object):  # {{{
+    # A test in the suite, which runs its scripts one after the other
+    def __init__(self, test, base_path, results=None):
+        self.name = test['name']
+        self.test_path = test['path']
+        self.path = '{}/{}'.format(base_path, test['path'])
+        self.scripts = test['scripts']
+        self.cores = test['cores']
+        self.prereqs = test['prereqs']
+        self.output_name = test['output']
+        self.output_path = '{}/case_outputs/{}'.format(base_path,
+                                                       test['output'])
+        self.results = results
+        self.output = None
+        self.process = None
+        self.script_start = None
+        self.script_index = 0
+        self.start_failed = False
+        self.cached = False
+        self.status = 'waiting'
+
+    def start(self):  # {{{
+        if self.results is not None and self.results.is_cached(
+                self.name, self.test_path, self.output_name):
+            # Reuse the result of an earlier run with the same inputs
+            self.cached = True
+            self.status = 'passed'
+            return
+        self.output = open(self.output_path, 'w')
+        self.status = 'running'
+        if len(self.scripts) > 0:
+            self.start_script()
+    # }}}
+
+    def start_script(self):  # {{{
+        script = '{}/{}'.format(self.path, self.scripts[self.script_index])
+        env = None
+        if self.results is not None:
+            env = self.results.get_env(self.name)
+        self.script_start = time.time()
+        try:
+            self.process = subprocess.Popen([script], stdout=self.output,
+                                            stderr=self.output, cwd=self.path,
+                                            env=env)
+        except OSError as e:
+            self.output.write('Could not run {}: {}\n'.format(script, e))
+            self.process = None
+            self.start_failed = True
+    # }}}
+
+    def poll(self):  # {{{
+        # Check on the running script, starting the next one if it passed.
+        # Returns True once the test has finished.
+        if self.process is None:
+            return self.finish(not self.start_failed)
+
+        returncode, rusage = wait_for_process(self.process.pid, os.WNOHANG)
+        if returncode is None:
+            return False
+        self.process.returncode = returncode
+
+        if self.results is not None:
+            self.results.record_script(self.name, self.output_name,
+                                       self.scripts[self.script_index],
+                                       self.script_start, returncode, rusage)
+
+        if returncode != 0:
+            return self.finish(False)
+
+        self.script_index += 1
+        if self.script_index < len(self.scripts):
+            self.start_script()
+            return False
+
+        return self.finish(True)
+    # }}}
+
+    def finish(self, passed):  # {{{
+        self.output.close()
+        self.process = None
+        if self.results is not None:
+            self.results.record_result(self.name, passed)
+        if passed:
+            self.status = 'passed'
+        else:
+            self.status = 'failed'
+        return True
+    # }}}
+# }}}
+
+
+def run_suite(tests, max_cores, base_path, results=None,
+              poll_interval=0.1):  # {{{
+    # Run the tests, a list of dictionaries with the name, path (relative to
+    # base_path), scripts, cores, prereqs (names of other tests) and output
+    # file name of each test, within max_cores, recording their metrics in
+    # results (a SuiteResults) if given. Returns True if all tests passed.
+    suite_tests = [SuiteTest(test, base_path, results) for test in tests]
+    by_name = dict([(test.name, test) for test in suite_tests])
+
+    for test in suite_tests:
+        for prereq in test.prereqs:
+            if prereq not in by_name:
+                print("ERROR: Prerequisite '{}' of '{}' is not in the "
+                      "suite.".format(prereq, test.name))
+                print("Exiting...")
+                sys.exit(1)
+
+    running = list()
+    used_cores = 0
+    suite_start = time.time()
+
+    while True:
+        # Start all waiting tests whose prerequisites have passed and that
+        # fit in the free cores, in suite order, until no more can start
+        # (a test that passes from the cache or is skipped can let later
+        # tests start)
+        changed = True
+        while changed:
+            changed = False
+            for test in suite_tests:
+                if test.status != 'waiting':
+                    continue
+
+                prereq_status = [by_name[prereq].status for prereq in
+                                 test.prereqs]
+                if 'failed' in prereq_status or 'skipped' in prereq_status:
+                    test.status = 'skipped'
+                    changed = True
+                    print('   ** FAIL {} (a prerequisite failed)'.format(
+                        test.name))
+                    continue
+
+                if not all([status == 'passed' for status in prereq_status]):
+                    continue
+
+                cores = min(test.cores, max_cores)
+                if used_cores + cores <= max_cores or len(running) == 0:
+                    test.start()
+                    changed = True
+                    if test.cached:
+                        print('      PASS {} (cached)'.format(test.name))
+                        continue
+                    print(' ** Running case {} ({} cores)'.format(test.name,
+                                                                  cores))
+                    running.append(test)
+                    used_cores += cores
+
+        if len(running) == 0:
+            # Tests still waiting now have prerequisites that can never
+            # complete (e.g. a cycle of prerequisites)
+            for test in suite_tests:
+                if test.status == 'waiting':
+                    test.status = 'skipped'
+                    print('   ** FAIL {} (prerequisites never '
+                          'completed)'.format(test.name))
+            break
+
+        time.sleep(poll_interval)
+
+        for test in list(running):
+            if test.poll():
+                running.remove(test)
+                used_cores -= min(test.cores, max_cores)
+                if test.status == 'passed':
+                    print('      PASS {}'.format(test.name))
+                else:
+                    print('   ** FAIL {} (See case_outputs/{} for more '
+                          'information)'.format(test.name, test.output_name))
+
+    print('Suite wall-clock time: {:.1f} s'.format(time.time() - suite_start))
+
+    return all([test.status == 'passed' for test in suite_tests])
+# }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
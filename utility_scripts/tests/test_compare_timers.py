@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from compare_timers import parse_mpas_timer_line, read_timers, \
+    get_timer_stats
+
+# The timer block at the end of an MPAS-Ocean log.0000.out
+MPAS_LOG = """
+ Timer information:
+    Globals are computed across all threads and processors
+
+ Columns:
+    total time: Global max of accumulated time spent in timer
+    calls: Total number of times this timer was started / stopped.
+    min: Global min of time spent in a single start / stop
+    max: Global max of time spent in a single start / stop
+    avg: Global average of time spent in a single start / stop
+    pct_tot: Percent of the timer at level 1
+    pct_par: Percent of the parent timer (one level up)
+    par_eff: Parallel efficiency, global average total time / global max total time
+
+
+    timer_name                                            total       calls        min            max            avg      pct_tot   pct_par     par_eff
+  1 total time                                         23.94512         1       23.94512       23.94512       23.94512   100.00       0.00       1.00
+  2  initialize                                         3.59434         1        3.59434        3.59434        3.59434    15.01      15.01       1.00
+  2  time integration                                  20.11803        10        1.94129        2.31245        2.01180    84.02      84.02       1.00
+  3   se timestep                                      18.81370        10        1.81227        2.17013        1.88137    78.57      93.52       1.00
+  4    se btr vel                                       9.48032        10        0.91023        1.12312        0.94803    39.59      50.39       1.00
+  2  io_write                                           0.13420         2        0.00210        0.13210        0.06710     0.56       0.56       1.00
+ -----------------------------------------
+ Total log messages printed:
+    Output messages =                   83
+    Warning messages =                   2
+    Error messages =                     0
+    Critical error messages =            0
+ -----------------------------------------
+"""
+
+
+def write_log(directory):
+    with open(os.path.join(directory, 'log.ocean.0000.out'), 'w') as log:
+        log.write(MPAS_LOG)
+
+
+def test_parse_mpas_timer_line():
+    assert parse_mpas_timer_line(
+        '  1 total time                                         23.94512'
+        '         1       23.94512       23.94512       23.94512   100.00'
+        '       0.00       1.00') == (1, 'total time', 23.94512, 1)
+    assert parse_mpas_timer_line(
+        '  3   se timestep                                      18.81370'
+        '        10        1.81227        2.17013        1.88137    78.57'
+        '      93.52       1.00') == (3, 'se timestep', 18.8137, 10)
+    assert parse_mpas_timer_line(
+        '    Output messages =                   83') is None
+
+
+def test_read_mpas_timers(tmpdir):
+    write_log(str(tmpdir))
+    ranks = read_timers(str(tmpdir))
+    assert ranks == [{'total_time': [23.94512, 1],
+                      'initialize': [3.59434, 1],
+                      'time_integration': [20.11803, 10],
+                      'se_timestep': [18.8137, 10],
+                      'se_btr_vel': [9.48032, 10],
+                      'io_write': [0.1342, 2]}]
+
+
+def test_get_mpas_timer_stats(tmpdir):
+    write_log(str(tmpdir))
+    ranks = read_timers(str(tmpdir))
+    stats = get_timer_stats(ranks, 'total time')
+    assert stats['total'] == 23.94512
+    assert stats['calls'] == 1
+    stats = get_timer_stats(ranks, 'se timestep')
+    assert stats['total'] == 18.8137
+    assert stats['calls'] == 10
+    assert get_timer_stats(ranks, 'missing timer') is None
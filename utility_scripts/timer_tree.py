@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""
+This script reconstructs the tree of nested timers of a run from the timer
+output of MPAS (log.*.out, where each timer line starts with its nesting level)
+or GPTL (timing.*, where nesting is shown by indentation), and exports it as
+an indented text tree, as folded stacks for flamegraph.pl, or as JSON.
+
+Each RUN is either a timer file or a run directory, in which case the first
+timer file (e.g. that of rank 0) is used. The self time of a timer is its total
+time less that of its children.
+
+With --diff, the timers of a second run are compared with those of the first,
+timer by timer along the tree, so the subtrees that gained (or lost) time
+stand out. The text tree then shows the total time of each timer in both runs
+and the change, and the folded stacks hold the self times of both runs (the
+input format of flamegraph.pl for differential flame graphs, as written by
+difffolded.pl).
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import json
+import argparse
+
+from compare_timers import get_timer_format, parse_number, \
+    parse_mpas_timer_line
+
+
+def new_timer(name):  # {{{
+    return {'name': name, 'total': 0.0, 'calls': 0, 'children': list()}
+# }}}
+
+
+def get_child(timer, name):  # {{{
+    # The child of a timer with the given name, added if it doesn't exist, so
+    # that timers with the same name and parent are merged
+    for child in timer['children']:
+        if child['name'] == name:
+            return child
+    child = new_timer(name)
+    timer['children'].append(child)
+    return child
+# }}}
+
+
+def add_timer(stack, level, name, total, calls):  # {{{
+    # Add a timer at the given nesting level (starting at 1) below the last
+    # timer of the level above it in stack, a list with the current timer at
+    # each level, starting with the root
+    level = max(1, min(level, len(stack)))
+    del stack[level:]
+    timer = get_child(stack[-1], name)
+    timer['total'] += total
+    timer['calls'] += calls
+    stack.append(timer)
+# }}}
+
+
+def read_mpas_timers(timer_file, root):  # {{{
+    # Each timer line of an MPAS log starts with the nesting level of the
+    # timer, followed by its (indented) name, total time and number of calls
+    stack = [root]
+    for line in timer_file:
+        timer = parse_mpas_timer_line(line)
+        if timer is not None:
+            add_timer(stack, *timer)
+# }}}
+
+
+def read_gptl_timers(timer_file, root):  # {{{
+    # The timers of the first thread in a GPTL timing file follow a header
+    # line with the column names, up to the next blank line. Each line starts
+    # with a two-character marker (for timers with more than one parent),
+    # followed by two spaces of indentation for each nesting level.
+    stack = [root]
+    in_table = False
+    base_indent = None
+    for line in timer_file:
+        if not in_table:
+            in_table = 'Called' in line and 'Wallclock' in line
+            continue
+        if line.strip() == '':
+            if base_indent is not None:
+                break
+            continue
+        entry = line.rstrip('\n')[2:]
+        indent = len(entry) - len(entry.lstrip())
+        tokens = entry.split()
+        if len(tokens) < 4:
+            continue
+        total = parse_number(tokens[3])
+        calls = parse_number(tokens[1])
+        if total is None or calls is None:
+            continue
+        if base_indent is None:
+            base_indent = indent
+        level = (indent - base_indent) // 2 + 1
+        add_timer(stack, level, tokens[0].strip('"'), total, int(calls))
+# }}}
+
+
+def get_timer_file(path):  # {{{
+    # The timer file of a run, given either the file or the run directory
+    if os.path.isfile(path):
+        return path
+    for file_name in sorted(os.listdir(path)):
+        if get_timer_format(file_name) is not None:
+            return '{}/{}'.format(path, file_name)
+    return None
+# }}}
+
+
+def read_timer_tree(path):  # {{{
+    # Read the tree of timers of a run, returning its root, whose children are
+    # the outermost timers
+    timer_path = get_timer_file(path)
+    if timer_path is None:
+        print("ERROR: No timer files were found in {}.".format(path))
+        print("Exiting...")
+        sys.exit(1)
+
+    root = new_timer('root')
+    with open(timer_path, 'r') as timer_file:
+        if get_timer_format(os.path.basename(timer_path)) == 'gptl':
+            read_gptl_timers(timer_file, root)
+        else:
+            read_mpas_timers(timer_file, root)
+
+    if len(root['children']) == 0:
+        print("ERROR: No timers were found in {}.".format(timer_path))
+        print("Exiting...")
+        sys.exit(1)
+
+    root['total'] = sum([child['total'] for child in root['children']])
+    return root
+# }}}
+
+
+def get_self_time(timer):  # {{{
+    children = sum([child['total'] for child in timer['children']])
+    return max(timer['total'] - children, 0.0)
+# }}}
+
+
+def add_self_times(timer):  # {{{
+    # Add the self time of each timer, for the JSON export
+    timer['self'] = get_self_time(timer)
+    for child in timer['children']:
+        add_self_times(child)
+# }}}
+
+
+def merge_trees(base, compare):  # {{{
+    # Merge the trees of two runs into a tree with the total time of each
+    # timer in both runs (0 if it is missing from one)
+    merged = {'name': base['name'] if base is not None else compare['name'],
+              'base': 0.0, 'compare': 0.0, 'children': list()}
+    names = list()
+    children = dict()
+    for index, timer in enumerate([base, compare]):
+        if timer is None:
+            continue
+        merged[['base', 'compare'][index]] = timer['total']
+        for child in timer['children']:
+            if child['name'] not in children:
+                names.append(child['name'])
+                children[child['name']] = [None, None]
+            children[child['name']][index] = child
+    for name in names:
+        merged['children'].append(merge_trees(*children[name]))
+    return merged
+# }}}
+
+
+def get_merged_self_times(merged):  # {{{
+    times = list()
+    for key in ['base', 'compare']:
+        children = sum([child[key] for child in merged['children']])
+        times.append(max(merged[key] - children, 0.0))
+    return times
+# }}}
+
+
+def walk(timer, depth, max_depth, path=()):  # {{{
+    # Yield the path (names from the outermost timer) and each timer below
+    # timer, depth first, down to max_depth levels if given
+    for child in timer['children']:
+        child_path = path + (child['name'].replace(';', ':'),)
+        yield child_path, child
+        if max_depth is None or depth + 1 < max_depth:
+            for item in walk(child, depth + 1, max_depth, child_path):
+                yield item
+# }}}
+
+
+def format_folded(tree, max_depth, diff):  # {{{
+    # Folded stacks, with self times in microseconds. Timers at max_depth
+    # include the time of the timers below them.
+    lines = list()
+    for path, timer in walk(tree, 0, max_depth):
+        leaf = max_depth is not None and len(path) == max_depth
+        if diff:
+            if leaf:
+                base, compare = timer['base'], timer['compare']
+            else:
+                base, compare = get_merged_self_times(timer)
+            if base == 0.0 and compare == 0.0:
+                continue
+            lines.append('{} {:d} {:d}'.format(';'.join(path),
+                                               int(round(base * 1e6)),
+                                               int(round(compare * 1e6))))
+        else:
+            if leaf:
+                self_time = timer['total']
+            else:
+                self_time = get_self_time(timer)
+            if self_time == 0.0:
+                continue
+            lines.append('{} {:d}'.format(';'.join(path),
+                                          int(round(self_time * 1e6))))
+    return lines
+# }}}
+
+
+def format_text(tree, max_depth, min_percent, diff):  # {{{
+    # An indented tree of the timers, leaving out those below min_percent of
+    # the total time (or of the total change with --diff)
+    lines = list()
+    if diff:
+        reference = sum([abs(child['compare'] - child['base'])
+                         for child in tree['children']])
+        lines.append('{:>12}  {:>12}  {:>12}  {:>8}  {}'.format(
+            'base (s)', 'compare (s)', 'change (s)', 'change', 'timer'))
+    else:
+        reference = tree['total']
+        lines.append('{:>12}  {:>12}  {:>10}  {:>7}  {}'.format(
+            'total (s)', 'self (s)', 'calls', 'percent', 'timer'))
+
+    for path, timer in walk(tree, 0, max_depth):
+        indent = '  ' * (len(path) - 1)
+        if diff:
+            change = timer['compare'] - timer['base']
+            if reference > 0.0 and \
+                    100.0 * abs(change) / reference < min_percent:
+                continue
+            if timer['base'] > 0.0:
+                percent = '{:+7.1f}%'.format(100.0 * change / timer['base'])
+            else:
+                percent = '{:>8}'.format('new')
+            lines.append('{:12.4f}  {:12.4f}  {:+12.4f}  {}  {}{}'.format(
+                timer['base'], timer['compare'], change, percent, indent,
+                timer['name']))
+        else:
+            percent = 0.0
+            if reference > 0.0:
+                percent = 100.0 * timer['total'] / reference
+            if percent < min_percent:
+                continue
+            lines.append('{:12.4f}  {:12.4f}  {:10d}  {:6.2f}%  {}{}'.format(
+                timer['total'], get_self_time(timer), timer['calls'],
+                percent, indent, timer['name']))
+    return lines
+# }}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("run",
+                        help="timer file or run directory.", metavar="RUN")
+    parser.add_argument("-d", "--diff", dest="diff",
+                        help="timer file or run directory to compare with "
+                             "RUN.", metavar="RUN2")
+    parser.add_argument("-f", "--format", dest="format", default="text",
+                        choices=['text', 'folded', 'json'],
+                        help="output format (default: text).")
+    parser.add_argument("-o", "--output", dest="output",
+                        help="file to write to, instead of standard "
+                             "output.", metavar="FILE")
+    parser.add_argument("--max_depth", dest="max_depth", type=int,
+                        help="deepest nesting level of timers to include.",
+                        metavar="N")
+    parser.add_argument("--min_percent", dest="min_percent", type=float,
+                        default=0.0,
+                        help="in the text tree, leave out timers below this "
+                             "percent of the total time (or of the total "
+                             "change with --diff).", metavar="P")
+    args = parser.parse_args()
+
+    for path in [args.run, args.diff]:
+        if path is not None and not os.path.exists(path):
+            print("ERROR: {} does not exist.".format(path))
+            print("Exiting...")
+            sys.exit(1)
+
+    tree = read_timer_tree(args.run)
+    diff = args.diff is not None
+    if diff:
+        tree = merge_trees(tree, read_timer_tree(args.diff))
+
+    if args.format == 'json':
+        if not diff:
+            add_self_times(tree)
+        output = json.dumps(tree['children'], indent=1)
+    elif args.format == 'folded':
+        output = '\n'.join(format_folded(tree, args.max_depth, diff))
+    else:
+        output = '\n'.join(format_text(tree, args.max_depth, args.min_percent,
+                                       diff))
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write('{}\n'.format(output))
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python